@@ -0,0 +1,224 @@
+######################################################################
+# Step-throughput benchmarks of TradeEnv and TradeGraph               #
+# Sweeps lookback_range, dataset length and episode length on         #
+# synthetic data, writes JSON and compares it against a baseline      #
+######################################################################
+
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+from config import get_config
+from envs.TradeEnv import TradeEnv
+
+PHASES = ['reset', 'step', 'next_observation', 'render']
+# parameters each phase depends on; the others are left out of its results
+PHASE_PARAMS = {'reset': ['lookback_range', 'length'],
+                'step': ['lookback_range', 'length', 'episode_length'],
+                'next_observation': ['lookback_range', 'length'],
+                'render': ['lookback_range', 'length']}
+KEY = ['assetType', 'phase', 'lookback_range', 'length', 'episode_length']
+
+
+def synthetic_data(assetType, length, seed=0):
+    '''random walk prices with the columns of ./data/stock/AAPL.csv or ./data/bitcoin/coinbaseUSD.csv'''
+    rng = np.random.RandomState(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, length)))
+    open_ = close * np.exp(rng.normal(0, 0.005, length))
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.01, length))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.01, length))
+    volume = rng.uniform(1e3, 1e6, length)
+    if assetType == 'bitcoin':
+        timestamps = 1500000000 + 60 * np.arange(length)
+        return pd.DataFrame({'Timestamp': timestamps, 'Open': open_, 'High': high, 'Low': low,
+                             'Close': close, 'Volume_(BTC)': volume / close,
+                             'Volume_(Currency)': volume, 'Weighted_Price': (high + low) / 2})
+    dates = pd.bdate_range('1990-01-01', periods=length).strftime('%Y-%m-%d')
+    return pd.DataFrame({'Date': dates, 'Open': open_, 'High': high, 'Low': low, 'Close': close,
+                         'Adj Close': close, 'Volume': volume.astype(np.int64)})
+
+
+def latency_stats(times):
+    '''throughput and latency percentiles of per-call times in seconds'''
+    times = np.asarray(times)
+    us = times * 1e6
+    return {'calls': len(times),
+            'steps_per_sec': len(times) / times.sum(),
+            'mean_us': us.mean(),
+            'p50_us': np.percentile(us, 50),
+            'p90_us': np.percentile(us, 90),
+            'p99_us': np.percentile(us, 99),
+            'max_us': us.max()}
+
+
+def make_env(df, assetType, lookback_range, seed):
+    env = TradeEnv(df, assetType, config=get_config(assetType, lookback_range=lookback_range))
+    env.seed(seed)
+    return env
+
+
+def bench_reset(env, calls, **kwargs):
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        env.reset()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_step(env, calls, episode_length, seed=0, **kwargs):
+    '''step with random actions, resetting (untimed) every episode_length steps or when done'''
+    rng = np.random.RandomState(seed)
+    actions = np.stack([rng.uniform(0, 3, calls), rng.uniform(0, 1, calls)], axis=1)
+    times = []
+    env.reset()
+    steps = 0
+    for action in actions:
+        start = time.perf_counter()
+        _, _, done, _ = env.step(action)
+        times.append(time.perf_counter() - start)
+        steps += 1
+        if done or steps == episode_length:
+            env.reset()
+            steps = 0
+    return times
+
+
+def bench_next_observation(env, calls, **kwargs):
+    '''build observations of consecutive steps without trading in between'''
+    times = []
+    env.reset()
+    for i in range(calls):
+        env.current_step = i % env.steps_left
+        start = time.perf_counter()
+        env._next_observation()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_render(env, calls, seed=0, **kwargs):
+    '''render steps on an offscreen TradeGraph, as the headless render mode's worker does'''
+    from render.TradeGraph import TradeGraph
+    rng = np.random.RandomState(seed)
+    graph = TradeGraph(env.df, headless=True)
+    times = []
+    env.reset()
+    while len(times) < calls:
+        _, _, done, _ = env.step(np.array([rng.uniform(0, 3), rng.uniform(0, 1)]))
+        if done:
+            env.reset()
+        elif env.current_step > env.config.lookback_range:
+            start = time.perf_counter()
+            graph.render(env.current_step + env.frame_start, env.net_worth, env.trades,
+                         window_size=env.config.lookback_range)
+            times.append(time.perf_counter() - start)
+    graph.close()
+    return times
+
+
+BENCHMARKS = {'reset': bench_reset, 'step': bench_step,
+              'next_observation': bench_next_observation, 'render': bench_render}
+
+
+def run(assetTypes, lookback_ranges, lengths, episode_lengths, phases, steps, render_steps,
+        reset_calls, seed=0, log=print):
+    '''run every phase over the grid of parameters it depends on; returns a list of results'''
+    results = []
+    for assetType in assetTypes:
+        for length in lengths:
+            df = synthetic_data(assetType, length, seed)
+            for lookback_range in lookback_ranges:
+                for phase in phases:
+                    for episode_length in (episode_lengths if phase == 'step' else [None]):
+                        env = make_env(df, assetType, lookback_range, seed)
+                        calls = {'reset': reset_calls, 'render': render_steps}.get(phase, steps)
+                        times = BENCHMARKS[phase](env, calls, episode_length=episode_length, seed=seed)
+                        env.close()
+                        result = {'assetType': assetType, 'phase': phase,
+                                  'lookback_range': lookback_range, 'length': length,
+                                  'episode_length': episode_length}
+                        result.update(latency_stats(times))
+                        results.append(result)
+                        log(format_result(result))
+    return results
+
+
+def format_result(result):
+    params = ' '.join('{}={}'.format(name, result[name]) for name in PHASE_PARAMS[result['phase']])
+    return '{:8s} {:17s} {:45s} {:12.1f} steps/s  p50 {:9.1f}us  p99 {:9.1f}us'.format(
+        result['assetType'], result['phase'], params, result['steps_per_sec'],
+        result['p50_us'], result['p99_us'])
+
+
+def compare(results, baseline, tolerance):
+    '''
+    results that regressed against the baseline: throughput below, or median latency above,
+    the baseline's by more than tolerance (a fraction); returns (result, baseline result, reasons)
+    '''
+    base = {tuple(result[k] for k in KEY): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = base.get(tuple(result[k] for k in KEY))
+        if old is None:
+            continue
+        reasons = []
+        if result['steps_per_sec'] < old['steps_per_sec'] * (1 - tolerance):
+            reasons.append('steps/s {:.1f} -> {:.1f}'.format(old['steps_per_sec'], result['steps_per_sec']))
+        if result['p50_us'] > old['p50_us'] * (1 + tolerance):
+            reasons.append('p50 {:.1f}us -> {:.1f}us'.format(old['p50_us'], result['p50_us']))
+        if reasons:
+            regressions.append((result, old, reasons))
+    return regressions
+
+
+def environment():
+    return {'date': dt.datetime.now().isoformat(' '),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor()}
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--env_names', default=['stock', 'bitcoin'], nargs='+', choices=['stock', 'bitcoin'])
+parser.add_argument('--lookback_ranges', default=[5, 50], nargs='+', type=int)
+parser.add_argument('--lengths', default=[1000, 100000], nargs='+', type=int,
+                    help='number of rows of the synthetic datasets')
+parser.add_argument('--episode_lengths', default=[100, 1000], nargs='+', type=int,
+                    help='steps before the step benchmark resets the env')
+parser.add_argument('--phases', default=PHASES, nargs='+', choices=PHASES)
+parser.add_argument('--steps', default=5000, type=int, help='timed calls of step and next_observation')
+parser.add_argument('--render_steps', default=300, type=int)
+parser.add_argument('--reset_calls', default=200, type=int)
+parser.add_argument('--seed', default=0, type=int)
+parser.add_argument('--output', default=None, type=str, help='write the results to this JSON file')
+parser.add_argument('--compare', default=None, type=str,
+                    help='JSON file of baseline results; exits with 1 if any benchmark regressed')
+parser.add_argument('--tolerance', default=0.25, type=float,
+                    help='fraction by which a benchmark may be slower than the baseline, '
+                         'above the run to run noise of a shared machine')
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    results = run(args.env_names, args.lookback_ranges, args.lengths, args.episode_lengths,
+                  args.phases, args.steps, args.render_steps, args.reset_calls, seed=args.seed)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'args': vars(args), 'results': results}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for result, _, reasons in regressions:
+            print('REGRESSION {}: {}'.format(format_result(result), ', '.join(reasons)))
+        print('{} of {} benchmarks regressed by more than {:.0%}'.format(
+            len(regressions), len(results), args.tolerance))
+        sys.exit(1 if regressions else 0)
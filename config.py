@@ -7,6 +7,14 @@ class config_stock:
         self.tran_cost = 0.003
         self.serial = True
         self.num_portfolio_status = 5
+        # keep the whole account history rather than only the last lookback_range + 1 steps
+        self.full_history = False
+        # observation normalisation: 'minmax', 'rolling_minmax', 'zscore' or 'log_return'
+        self.normalisation = 'minmax'
+        # also record the price every trade was filled at in the trade ledger
+        self.fill_price = False
+        # time the phases of every step, see TradeEnv.enable_profiling
+        self.profile = False
 
 class config_bitcoin:
     def __init__(self):
@@ -17,8 +25,16 @@ class config_bitcoin:
         self.tran_cost = 0.00075
         self.serial = True
         self.num_portfolio_status = 5
+        # keep the whole account history rather than only the last lookback_range + 1 steps
+        self.full_history = False
+        # observation normalisation: 'minmax', 'rolling_minmax', 'zscore' or 'log_return'
+        self.normalisation = 'minmax'
+        # also record the price every trade was filled at in the trade ledger
+        self.fill_price = False
+        # time the phases of every step, see TradeEnv.enable_profiling
+        self.profile = False
 
-class FX:
+class config_FX:
     def __init__(self):
         # env config 
         self.max_steps = 1000
@@ -27,8 +43,16 @@ class FX:
         self.tran_cost = 0.00075
         self.serial = True
         self.num_portfolio_status = 5
+        # keep the whole account history rather than only the last lookback_range + 1 steps
+        self.full_history = False
+        # observation normalisation: 'minmax', 'rolling_minmax', 'zscore' or 'log_return'
+        self.normalisation = 'minmax'
+        # also record the price every trade was filled at in the trade ledger
+        self.fill_price = False
+        # time the phases of every step, see TradeEnv.enable_profiling
+        self.profile = False
 
-class options:
+class config_options:
     def __init__(self):
         # env config 
         self.max_steps = 1000
@@ -37,14 +61,51 @@ class options:
         self.tran_cost = 0.00075
         self.serial = True
         self.num_portfolio_status = 5
+        # option chain: num_strikes strikes around the money, strike_step apart as a
+        # fraction of the median underlying price, for the next num_expiries expiries,
+        # which fall every expiry_every steps; calls and puts of every strike and expiry
+        self.num_strikes = 9
+        self.strike_step = 0.025
+        self.num_expiries = 3
+        self.expiry_every = 21
+        # units of the underlying per contract, and steps (bars) per year for times to expiry
+        self.contract_size = 100
+        self.steps_per_year = 252
+        # continuously compounded risk-free rate and dividend yield
+        self.rate = 0.02
+        self.dividend = 0.0
+        # implied vol surface: atm vol, skew and smile in log moneyness, and slope in years
+        self.atm_vol = 0.2
+        self.vol_skew = -0.2
+        self.vol_smile = 0.5
+        self.vol_term = 0.0
+        # keep the whole account history rather than only the last lookback_range + 1 steps
+        self.full_history = False
+        # observation normalisation: 'minmax', 'rolling_minmax', 'zscore' or 'log_return'
+        self.normalisation = 'minmax'
+        # also record the price every trade was filled at in the trade ledger
+        self.fill_price = False
+        # time the phases of every step, see TradeEnv.enable_profiling
+        self.profile = False
 
 
-def get_config(env_name):
+def get_config(env_name, **overrides):
+    '''
+    a new config of env_name, with the settings in overrides replacing the defaults,
+    e.g. get_config('stock', lookback_range=20, serial=False)
+    '''
     if env_name == 'stock':
-        return config_stock()
+        config = config_stock()
     elif env_name == 'FX':
-        return config_FX()
-    elif env_name == 'options':
-        return config_options()
+        config = config_FX()
+    elif env_name == 'option':
+        config = config_options()
     elif env_name == 'bitcoin':
-        return config_bitcoin()
\ No newline at end of file
+        config = config_bitcoin()
+    else:
+        raise ValueError('unknown env: {}'.format(env_name))
+    for name, value in overrides.items():
+        if not hasattr(config, name):
+            raise ValueError('{} has no setting {}'.format(type(config).__name__, name))
+        setattr(config, name, value)
+    return config
\ No newline at end of file
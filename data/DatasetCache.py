@@ -0,0 +1,219 @@
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# bump when the layout of the cache changes so that old caches are rebuilt
+CACHE_VERSION = 2
+
+
+def file_hash(path, chunk_size=1 << 20):
+    '''sha256 of the contents of a file'''
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def parse_timestamps(dates):
+    '''
+    parse a date/time column into int64 seconds since the epoch;
+    numeric columns are taken to be unix timestamps already
+    '''
+    dates = pd.Series(dates)
+    if pd.api.types.is_numeric_dtype(dates):
+        return dates.values.astype(np.int64)
+    parsed = pd.to_datetime(dates)
+    return ((parsed - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).values.astype(np.int64)
+
+
+class DatasetCache():
+    '''
+    Binary columnar cache of a CSV dataset, so it is parsed only once.
+
+    Every column is saved as a .npy file in <csv dir>/.cache/<csv name>/, together with the
+    first (date or time) column parsed into int64 unix seconds. Text columns are saved as
+    strings with a mask of their missing values, restored as NaN on load. meta.json records the size,
+    mtime and sha256 of the CSV the cache was built from: the cache is used while size and
+    mtime match; otherwise the CSV is hashed, and it is only parsed again if its contents
+    have changed.
+    '''
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        if cache_dir is None:
+            name = os.path.splitext(os.path.basename(path))[0]
+            cache_dir = os.path.join(os.path.dirname(path), '.cache', name)
+        self.cache_dir = cache_dir
+        self.meta_path = os.path.join(cache_dir, 'meta.json')
+
+    def load(self):
+        '''the dataset as pandas.read_csv would return it, building the cache if needed'''
+        meta = self.meta()
+        columns = {}
+        for i, (name, kind) in enumerate(zip(meta['columns'], meta['kinds'])):
+            values = np.load(self._column_path(i))
+            if kind == 'str':
+                values = values.astype(object)
+                if meta['nulls'][i]:
+                    values[np.load(self._null_path(i))] = np.nan
+            columns[name] = values
+        return pd.DataFrame(columns)
+
+    def timestamps(self):
+        '''first column of the dataset as int64 unix seconds'''
+        return self.column('timestamp', mmap_mode=None)
+
+    def column(self, name, mmap_mode='r'):
+        '''
+        one column of the dataset, memory-mapped from the cache by default;
+        'timestamp' is the first column parsed into unix seconds
+        '''
+        meta = self.meta()
+        if name == 'timestamp':
+            path = os.path.join(self.cache_dir, 'timestamp.npy')
+        else:
+            path = self._column_path(meta['columns'].index(name))
+        return np.load(path, mmap_mode=mmap_mode)
+
+    def content_hash(self):
+        '''sha256 of the CSV the cache holds'''
+        return self.meta()['sha256']
+
+    def meta(self):
+        '''metadata of the cache, building it first if it is missing or stale'''
+        meta = self._valid_meta()
+        if meta is None:
+            meta = self.build()
+        return meta
+
+    def build(self, chunksize=1000000):
+        '''
+        parse the CSV and write the cache; returns its metadata. The CSV is read chunksize
+        rows at a time, so files larger than memory can be converted
+        '''
+        stat = os.stat(self.path)
+        sha256 = file_hash(self.path)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        columns = None
+        parts = []
+        for k, chunk in enumerate(pd.read_csv(self.path, chunksize=chunksize)):
+            if columns is None:
+                columns = list(chunk.columns)
+            # every chunk of every column, and of the parsed timestamps, goes to its own part file
+            for i, col in enumerate(columns):
+                self._save(self._part_path(i, k), chunk[col].values
+                           if pd.api.types.is_numeric_dtype(chunk[col])
+                           else np.asarray(chunk[col].values, dtype=str))
+                # strings have no NaN, so where text columns are missing is kept apart
+                self._save(self._part_path('null{}'.format(i), k), chunk[col].isna().values)
+            self._save(self._part_path('timestamp', k), parse_timestamps(chunk[columns[0]]))
+            parts.append(len(chunk))
+
+        kinds, nulls = [], []
+        for i in range(len(columns)):
+            kinds.append(self._join_parts(i, len(parts), self._column_path(i)))
+            nulls.append(self._join_nulls(i, len(parts), kinds[-1] == 'str'))
+        self._join_parts('timestamp', len(parts), os.path.join(self.cache_dir, 'timestamp.npy'))
+
+        meta = {'version': CACHE_VERSION,
+                'source': os.path.abspath(self.path),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'sha256': sha256,
+                'columns': columns,
+                'kinds': kinds,
+                'nulls': nulls,
+                'rows': sum(parts)}
+        self._write_meta(meta)
+        return meta
+
+    def _join_parts(self, name, num_parts, path):
+        '''
+        concatenate the part files of a column into one .npy file, streaming numeric parts
+        through a memory map; returns the kind of the column, 'num' or 'str'
+        '''
+        paths = [self._part_path(name, k) for k in range(num_parts)]
+        chunks = [np.load(part, mmap_mode='r') for part in paths]
+        if all(chunk.dtype.kind in 'biufc' for chunk in chunks):
+            kind = 'num'
+            dtype = np.result_type(*chunks)
+            tmp = '{}.{}.tmp'.format(path, os.getpid())
+            out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype,
+                                            shape=(sum(len(chunk) for chunk in chunks),))
+            start = 0
+            for chunk in chunks:
+                out[start:start + len(chunk)] = chunk
+                start += len(chunk)
+            out.flush()
+            del out
+            os.replace(tmp, path)
+        else:
+            kind = 'str'
+            self._save(path, np.concatenate([np.asarray(chunk, dtype=str) for chunk in chunks]))
+        del chunks
+        for part in paths:
+            os.remove(part)
+        return kind
+
+    def _join_nulls(self, i, num_parts, keep):
+        '''
+        concatenate the null masks of column i into one file when keep is set and any value is
+        missing; returns whether it was written
+        '''
+        paths = [self._part_path('null{}'.format(i), k) for k in range(num_parts)]
+        mask = np.concatenate([np.load(part) for part in paths]) if keep else None
+        written = mask is not None and bool(mask.any())
+        if written:
+            self._save(self._null_path(i), mask)
+        for part in paths:
+            os.remove(part)
+        return written
+
+    def _valid_meta(self):
+        '''metadata of the cache if it still matches the CSV, otherwise None'''
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION:
+            return None
+        stat = os.stat(self.path)
+        if meta['size'] == stat.st_size and meta['mtime'] == stat.st_mtime:
+            return meta
+        # touched or copied: only rebuild if the contents have changed
+        if meta['size'] == stat.st_size and meta['sha256'] == file_hash(self.path):
+            meta['mtime'] = stat.st_mtime
+            self._write_meta(meta)
+            return meta
+        return None
+
+    def _column_path(self, i):
+        return os.path.join(self.cache_dir, 'col_{:03d}.npy'.format(i))
+
+    def _null_path(self, i):
+        return os.path.join(self.cache_dir, 'null_{:03d}.npy'.format(i))
+
+    def _part_path(self, name, k):
+        return os.path.join(self.cache_dir, '{}.part{}.{}.npy'.format(name, k, os.getpid()))
+
+    def _save(self, path, values):
+        # write then rename, so concurrent readers never see a partial file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp, path)
+
+    def _write_meta(self, meta):
+        tmp = '{}.{}.tmp'.format(self.meta_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, self.meta_path)
+
+
+def load_dataset(path, cache_dir=None):
+    '''load a CSV dataset through its binary cache'''
+    return DatasetCache(path, cache_dir).load()
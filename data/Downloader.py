@@ -0,0 +1,221 @@
+######################################################################
+# Bulk download of daily prices from the Yahoo Finance API            #
+# Symbols and date ranges are fetched concurrently over one pooled    #
+# HTTP session, and only days missing from the local CSVs are fetched #
+######################################################################
+
+import os
+import time
+import random
+import asyncio
+import argparse
+import datetime as dt
+import aiohttp
+import numpy as np
+import pandas as pd
+
+URL = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v2/get-historical-data"
+HOST = "apidojo-yahoo-finance-v1.p.rapidapi.com"
+# columns of the local CSVs, as in ./data/stock/AAPL.csv
+COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+# HTTP statuses worth retrying: rate limited or a temporary server error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+ONE_DAY = dt.timedelta(days=1)
+
+
+def to_timestamp(date):
+    '''start of a date in UTC as unix seconds'''
+    return int(dt.datetime(date.year, date.month, date.day, tzinfo=dt.timezone.utc).timestamp())
+
+
+def to_date(timestamp):
+    '''UTC date of unix seconds'''
+    return dt.datetime.fromtimestamp(timestamp, tz=dt.timezone.utc).date()
+
+
+class RateLimiter():
+    '''token bucket allowing `rate` requests per `per` seconds, with bursts up to `rate`'''
+    def __init__(self, rate, per=1.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+
+class Downloader():
+    '''
+    Downloads daily prices of many symbols concurrently into one CSV per symbol,
+    <out_dir>/<symbol>.csv. Requests share a pooled aiohttp session, are rate limited,
+    and are retried with exponential backoff. A sync only requests the business days not
+    stored yet, in chunks of chunk_days; between stored days, runs of fewer than min_gap
+    missing business days are taken to be market holidays and not requested.
+    '''
+    def __init__(self, out_dir='./data/stock', url=URL, api_key=None, max_connections=8,
+                 rate_limit=5, per=1.0, max_retries=5, backoff=0.5, chunk_days=365, timeout=30,
+                 min_gap=3):
+        self.out_dir = out_dir
+        self.url = url
+        api_key = api_key or os.environ.get('RAPIDAPI_KEY')
+        self.headers = {'x-rapidapi-host': HOST}
+        if api_key:
+            self.headers['x-rapidapi-key'] = api_key
+        self.max_connections = max_connections
+        self.rate_limit = rate_limit
+        self.per = per
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.chunk_days = chunk_days
+        self.timeout = timeout
+        self.min_gap = min_gap
+
+    def sync(self, symbols, start, end=None):
+        '''blocking wrapper of async_sync'''
+        return asyncio.run(self.async_sync(symbols, start, end))
+
+    async def async_sync(self, symbols, start, end=None):
+        '''
+        bring the CSVs of symbols up to date over [start, end] (dates or 'YYYY-MM-DD');
+        returns the number of rows added per symbol
+        '''
+        start = pd.Timestamp(start).date()
+        end = pd.Timestamp(end).date() if end is not None else dt.date.today()
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.limiter = RateLimiter(self.rate_limit, self.per)
+        connector = aiohttp.TCPConnector(limit=self.max_connections)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         headers=self.headers) as session:
+            added = await asyncio.gather(*[self._sync_symbol(session, symbol, start, end)
+                                           for symbol in symbols])
+        return dict(zip(symbols, added))
+
+    def missing_ranges(self, symbol, start, end):
+        '''date ranges within [start, end] of the business days not in the CSV of symbol yet'''
+        path = self._path(symbol)
+        if not os.path.exists(path):
+            return [(start, end)]
+        stored = pd.to_datetime(pd.read_csv(path, usecols=['Date'])['Date']).values.astype('datetime64[D]')
+        if len(stored) == 0:
+            return [(start, end)]
+        days = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+        days = days[np.is_busday(days)]
+        missing = ~np.isin(days, stored)
+        # start and end of every run of missing days
+        edges = np.flatnonzero(np.diff(np.concatenate([[0], missing.astype(np.int8), [0]])))
+        ranges = []
+        for lo, hi in zip(edges[::2], edges[1::2]):
+            if stored.min() < days[lo] and days[hi - 1] < stored.max() and hi - lo < self.min_gap:
+                continue
+            ranges.append((days[lo].astype(object), days[hi - 1].astype(object)))
+        return ranges
+
+    def chunks(self, ranges):
+        '''split date ranges into ranges of at most chunk_days days'''
+        step = dt.timedelta(days=self.chunk_days)
+        for start, end in ranges:
+            while start <= end:
+                chunk_end = min(end, start + step - ONE_DAY)
+                yield start, chunk_end
+                start = chunk_end + ONE_DAY
+
+    async def _sync_symbol(self, session, symbol, start, end):
+        ranges = list(self.chunks(self.missing_ranges(symbol, start, end)))
+        if not ranges:
+            return 0
+        results = await asyncio.gather(*[self._fetch(session, symbol, chunk_start, chunk_end)
+                                         for chunk_start, chunk_end in ranges])
+        rows = [row for result in results for row in result]
+        if not rows:
+            return 0
+        new = pd.DataFrame(rows, columns=COLUMNS)
+        path = self._path(symbol)
+        if os.path.exists(path):
+            old = pd.read_csv(path)
+            new = new[~new['Date'].isin(old['Date'])]
+            df = pd.concat([old, new], ignore_index=True)
+        else:
+            df = new
+        df = df.sort_values(by='Date').reset_index(drop=True)
+        # write then rename, so readers never see a partial file
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        df.to_csv(tmp, index=False)
+        os.replace(tmp, path)
+        return len(new)
+
+    async def _fetch(self, session, symbol, start, end):
+        '''daily price rows of symbol between the dates start and end, with retries'''
+        params = {'frequency': '1d',
+                  'filter': 'history',
+                  'period1': to_timestamp(start),
+                  'period2': to_timestamp(end + ONE_DAY),
+                  'symbol': symbol}
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire()
+            delay = self.backoff * 2 ** attempt * (1 + random.random())
+            try:
+                async with session.get(self.url, params=params) as response:
+                    if response.status in RETRY_STATUSES and attempt < self.max_retries:
+                        retry_after = response.headers.get('Retry-After')
+                        if retry_after is not None:
+                            delay = max(delay, float(retry_after))
+                        await asyncio.sleep(delay)
+                        continue
+                    response.raise_for_status()
+                    data = await response.json()
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.max_retries:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            return [self._row(price) for price in data.get('prices', [])
+                    # dividends and splits are listed among the prices without an 'open'
+                    if price.get('open') is not None and start <= to_date(price['date']) <= end]
+
+    @staticmethod
+    def _row(price):
+        return [to_date(price['date']).strftime('%Y-%m-%d'), price['open'], price['high'],
+                price['low'], price['close'], price['adjclose'], price['volume']]
+
+    def _path(self, symbol):
+        return os.path.join(self.out_dir, '{}.csv'.format(symbol))
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--symbols', required=True, nargs='+')
+parser.add_argument('--start', default='2018-01-01')
+parser.add_argument('--end', default=None)
+parser.add_argument('--out_dir', default='./data/stock')
+parser.add_argument('--rate_limit', default=5, type=float, help='requests per second')
+parser.add_argument('--max_connections', default=8, type=int)
+parser.add_argument('--stub', action='store_true',
+                    help='download from a local stub server instead of the API')
+
+
+async def main(args):
+    downloader = Downloader(out_dir=args.out_dir, rate_limit=args.rate_limit,
+                            max_connections=args.max_connections)
+    if args.stub:
+        from data.StubServer import StubServer
+        async with StubServer() as server:
+            downloader.url = server.url
+            added = await downloader.async_sync(args.symbols, args.start, args.end)
+    else:
+        added = await downloader.async_sync(args.symbols, args.start, args.end)
+    for symbol, rows in added.items():
+        print('{}: {} rows added'.format(symbol, rows))
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parser.parse_args()))
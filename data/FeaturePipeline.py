@@ -0,0 +1,483 @@
+import os
+import json
+import math
+import hashlib
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from data.DatasetCache import DatasetCache
+
+# indicators computed when no spec is given
+DEFAULT_FEATURES = [{'name': 'log_return'},
+                    {'name': 'sma', 'window': 10},
+                    {'name': 'ema', 'span': 20},
+                    {'name': 'rsi', 'window': 14},
+                    {'name': 'macd', 'fast': 12, 'slow': 26, 'signal': 9},
+                    {'name': 'bollinger', 'window': 20, 'num_std': 2},
+                    {'name': 'volatility', 'window': 20}]
+
+
+def _mask_warmup(values, warmup):
+    values[:warmup] = np.nan
+    return values
+
+
+def _ema(x, alpha):
+    '''exponential moving average seeded with the first value, e = (1 - alpha) * e + alpha * x'''
+    return pd.Series(x).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+
+
+def _rolling_std(x, window):
+    std = np.full(len(x), np.nan)
+    if len(x) >= window:
+        std[window - 1:] = sliding_window_view(x, window).std(axis=1)
+    return std
+
+
+class _RollingMoments():
+    '''mean and variance of the last `window` values, updated in O(1) per value (Welford)'''
+    def __init__(self, window):
+        self.window = window
+        self.values = [0.0] * window
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        i = self.count % self.window
+        if self.count < self.window:
+            delta = x - self.mean
+            self.mean += delta / (self.count + 1)
+            self.m2 += delta * (x - self.mean)
+        else:
+            old = self.values[i]
+            mean = self.mean + (x - old) / self.window
+            self.m2 += (x - old) * (x - mean + old - self.mean)
+            self.mean = mean
+        self.values[i] = x
+        self.count += 1
+        return self.count >= self.window
+
+    def seed(self, x):
+        '''the state after updating with every value of x, from its last `window` values'''
+        tail = np.asarray(x[-self.window:], dtype=np.float64)
+        self.count = len(x)
+        self.mean = float(tail.mean()) if len(tail) else 0.0
+        self.m2 = float(((tail - self.mean) ** 2).sum())
+        self.values = [0.0] * self.window
+        # where update() would have put them in the ring buffer
+        for j, value in enumerate(tail):
+            self.values[(self.count - len(tail) + j) % self.window] = float(value)
+
+    @property
+    def std(self):
+        return math.sqrt(max(self.m2 / min(self.count, self.window), 0.0))
+
+
+class Indicator():
+    '''
+    An indicator of one price column, with two paths that give the same values:
+    compute() over the whole column at once with array operations, and update() with one
+    bar at a time after reset(), in O(1), for streaming. warm() sets the streaming state
+    after a history of bars with array operations too. Values are NaN for the first
+    `warmup` bars, before the indicator is defined.
+    '''
+    warmup = 0
+
+    def __init__(self, column='Close'):
+        self.column = column
+
+    @property
+    def names(self):
+        raise NotImplementedError
+
+    def compute(self, x):
+        '''values for every bar of x, shape (len(x), len(names))'''
+        raise NotImplementedError
+
+    def reset(self):
+        self.count = 0
+
+    def update(self, x):
+        '''values after the bar x, a list of len(names)'''
+        raise NotImplementedError
+
+    def warm(self, x):
+        '''reset, then take the state update() reaches after every bar of x, an array'''
+        self.reset()
+        self.count = len(x)
+
+    def _ready(self):
+        self.count += 1
+        return self.count > self.warmup
+
+
+class LogReturn(Indicator):
+    warmup = 1
+
+    @property
+    def names(self):
+        return ['log_return']
+
+    def compute(self, x):
+        values = np.full(len(x), np.nan)
+        values[1:] = np.log(x[1:] / x[:-1])
+        return values[:, None]
+
+    def reset(self):
+        super(LogReturn, self).reset()
+        self.prev = None
+
+    def update(self, x):
+        value = math.log(x / self.prev) if self.prev is not None else math.nan
+        self.prev = x
+        return [value if self._ready() else math.nan]
+
+    def warm(self, x):
+        super(LogReturn, self).warm(x)
+        self.prev = float(x[-1]) if len(x) else None
+
+
+class SMA(Indicator):
+    def __init__(self, window, column='Close'):
+        super(SMA, self).__init__(column)
+        self.window = window
+        self.warmup = window - 1
+
+    @property
+    def names(self):
+        return ['sma_{}'.format(self.window)]
+
+    def compute(self, x):
+        values = np.full(len(x), np.nan)
+        if len(x) >= self.window:
+            values[self.window - 1:] = sliding_window_view(x, self.window).mean(axis=1)
+        return values[:, None]
+
+    def reset(self):
+        super(SMA, self).reset()
+        self.moments = _RollingMoments(self.window)
+
+    def update(self, x):
+        self.moments.update(x)
+        return [self.moments.mean if self._ready() else math.nan]
+
+    def warm(self, x):
+        super(SMA, self).warm(x)
+        self.moments.seed(x)
+
+
+class EMA(Indicator):
+    def __init__(self, span, column='Close'):
+        super(EMA, self).__init__(column)
+        self.span = span
+        self.alpha = 2 / (span + 1)
+        self.warmup = span - 1
+
+    @property
+    def names(self):
+        return ['ema_{}'.format(self.span)]
+
+    def compute(self, x):
+        return _mask_warmup(_ema(x, self.alpha), self.warmup)[:, None]
+
+    def reset(self):
+        super(EMA, self).reset()
+        self.value = None
+
+    def update(self, x):
+        self.value = x if self.value is None else (1 - self.alpha) * self.value + self.alpha * x
+        return [self.value if self._ready() else math.nan]
+
+    def warm(self, x):
+        super(EMA, self).warm(x)
+        self.value = float(_ema(x, self.alpha)[-1]) if len(x) else None
+
+
+class RSI(Indicator):
+    '''relative strength index with Wilder's smoothing of gains and losses'''
+    def __init__(self, window=14, column='Close'):
+        super(RSI, self).__init__(column)
+        self.window = window
+        self.warmup = window
+
+    @property
+    def names(self):
+        return ['rsi_{}'.format(self.window)]
+
+    def compute(self, x):
+        delta = np.diff(x)
+        gains = _ema(np.maximum(delta, 0), 1 / self.window)
+        losses = _ema(np.maximum(-delta, 0), 1 / self.window)
+        values = np.full(len(x), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[1:] = np.where(gains + losses > 0, 100 * gains / (gains + losses), 50)
+        return _mask_warmup(values, self.warmup)[:, None]
+
+    def reset(self):
+        super(RSI, self).reset()
+        self.prev = None
+        self.gain = None
+        self.loss = None
+
+    def update(self, x):
+        if self.prev is not None:
+            delta = x - self.prev
+            alpha = 1 / self.window
+            gain, loss = max(delta, 0.0), max(-delta, 0.0)
+            self.gain = gain if self.gain is None else (1 - alpha) * self.gain + alpha * gain
+            self.loss = loss if self.loss is None else (1 - alpha) * self.loss + alpha * loss
+        self.prev = x
+        if not self._ready():
+            return [math.nan]
+        total = self.gain + self.loss
+        return [100 * self.gain / total if total > 0 else 50.0]
+
+    def warm(self, x):
+        super(RSI, self).warm(x)
+        self.prev = float(x[-1]) if len(x) else None
+        if len(x) > 1:
+            delta = np.diff(x)
+            self.gain = float(_ema(np.maximum(delta, 0), 1 / self.window)[-1])
+            self.loss = float(_ema(np.maximum(-delta, 0), 1 / self.window)[-1])
+
+
+class MACD(Indicator):
+    '''moving average convergence divergence: the MACD line, its signal line and their difference'''
+    def __init__(self, fast=12, slow=26, signal=9, column='Close'):
+        super(MACD, self).__init__(column)
+        self.fast = EMA(fast, column)
+        self.slow = EMA(slow, column)
+        self.signal_span = signal
+        self.alpha = 2 / (signal + 1)
+        self.warmup = slow + signal - 2
+
+    @property
+    def names(self):
+        suffix = '{}_{}_{}'.format(self.fast.span, self.slow.span, self.signal_span)
+        return ['macd_' + suffix, 'macd_signal_' + suffix, 'macd_hist_' + suffix]
+
+    def compute(self, x):
+        macd = _ema(x, self.fast.alpha) - _ema(x, self.slow.alpha)
+        signal = _ema(macd, self.alpha)
+        values = np.stack([macd, signal, macd - signal], axis=1)
+        return _mask_warmup(values, self.warmup)
+
+    def reset(self):
+        super(MACD, self).reset()
+        self.fast.reset()
+        self.slow.reset()
+        self.signal = None
+
+    def update(self, x):
+        self.fast.update(x)
+        self.slow.update(x)
+        macd = self.fast.value - self.slow.value
+        self.signal = macd if self.signal is None else (1 - self.alpha) * self.signal + self.alpha * macd
+        if not self._ready():
+            return [math.nan] * 3
+        return [macd, self.signal, macd - self.signal]
+
+    def warm(self, x):
+        super(MACD, self).warm(x)
+        self.fast.warm(x)
+        self.slow.warm(x)
+        if len(x):
+            self.signal = float(_ema(_ema(x, self.fast.alpha) - _ema(x, self.slow.alpha), self.alpha)[-1])
+
+
+class Bollinger(Indicator):
+    '''upper and lower Bollinger bands, num_std standard deviations around the moving average'''
+    def __init__(self, window=20, num_std=2, column='Close'):
+        super(Bollinger, self).__init__(column)
+        self.window = window
+        self.num_std = num_std
+        self.warmup = window - 1
+
+    @property
+    def names(self):
+        suffix = '{}_{}'.format(self.window, self.num_std)
+        return ['bb_upper_' + suffix, 'bb_lower_' + suffix]
+
+    def compute(self, x):
+        mean = SMA(self.window).compute(x)[:, 0]
+        std = _rolling_std(x, self.window)
+        return np.stack([mean + self.num_std * std, mean - self.num_std * std], axis=1)
+
+    def reset(self):
+        super(Bollinger, self).reset()
+        self.moments = _RollingMoments(self.window)
+
+    def update(self, x):
+        self.moments.update(x)
+        if not self._ready():
+            return [math.nan] * 2
+        mean, std = self.moments.mean, self.moments.std
+        return [mean + self.num_std * std, mean - self.num_std * std]
+
+    def warm(self, x):
+        super(Bollinger, self).warm(x)
+        self.moments.seed(x)
+
+
+class Volatility(Indicator):
+    '''standard deviation of the log returns over the window'''
+    def __init__(self, window=20, column='Close'):
+        super(Volatility, self).__init__(column)
+        self.window = window
+        self.warmup = window
+
+    @property
+    def names(self):
+        return ['volatility_{}'.format(self.window)]
+
+    def compute(self, x):
+        values = np.full(len(x), np.nan)
+        values[1:] = _rolling_std(np.log(x[1:] / x[:-1]), self.window)
+        return values[:, None]
+
+    def reset(self):
+        super(Volatility, self).reset()
+        self.prev = None
+        self.moments = _RollingMoments(self.window)
+
+    def update(self, x):
+        if self.prev is not None:
+            self.moments.update(math.log(x / self.prev))
+        self.prev = x
+        return [self.moments.std if self._ready() else math.nan]
+
+    def warm(self, x):
+        super(Volatility, self).warm(x)
+        self.prev = float(x[-1]) if len(x) else None
+        self.moments.seed(np.log(x[1:] / x[:-1]))
+
+
+INDICATORS = {'log_return': LogReturn, 'sma': SMA, 'ema': EMA, 'rsi': RSI, 'macd': MACD,
+              'bollinger': Bollinger, 'volatility': Volatility}
+
+
+def get_indicator(spec):
+    '''an indicator from its spec, e.g. {'name': 'rsi', 'window': 14, 'column': 'Close'}'''
+    spec = dict(spec)
+    name = spec.pop('name')
+    if name not in INDICATORS:
+        raise ValueError('unknown indicator: {}'.format(name))
+    return INDICATORS[name](**spec)
+
+
+class FeatureStream():
+    '''
+    Incremental path of a FeaturePipeline: update() takes one bar and returns the feature
+    row it adds, with the same values as the batch path, at a constant cost per bar
+    '''
+    def __init__(self, indicators):
+        self.indicators = indicators
+        for indicator in self.indicators:
+            indicator.reset()
+
+    def update(self, bar):
+        '''
+        input:
+            bar:
+            a mapping of price column to value, e.g. a row of the dataset
+        returns the features of the bar as an array, in the order of FeaturePipeline.names
+        '''
+        row = []
+        for indicator in self.indicators:
+            row.extend(indicator.update(float(bar[indicator.column])))
+        return np.array(row)
+
+
+class FeaturePipeline():
+    '''
+    Declarative pipeline of technical indicators, see DEFAULT_FEATURES and INDICATORS.
+
+    transform() appends the indicators of a dataframe as columns, computed once over the
+    whole dataset with vectorised column operations; rows where an indicator is still
+    warming up hold NaN, so MarketData drops them like other rows with missing values and
+    TradeEnv windows the indicators exactly like the price columns. load() does the same for
+    a CSV dataset and caches the columns next to its DatasetCache, so they are computed
+    once per dataset and spec. stream() gives the incremental per-bar path for live data.
+    '''
+    def __init__(self, spec=None):
+        '''
+        input:
+            spec:
+            a list of dicts, each the name of an indicator and its parameters; DEFAULT_FEATURES
+            when None
+        '''
+        self.spec = [dict(item) for item in (spec if spec is not None else DEFAULT_FEATURES)]
+        self.indicators = [get_indicator(item) for item in self.spec]
+
+    @property
+    def names(self):
+        return [name for indicator in self.indicators for name in indicator.names]
+
+    def compute(self, df):
+        '''the features of every row of df, shape (len(df), len(names)); rows must be in time order'''
+        columns = {}
+        for indicator in self.indicators:
+            if indicator.column not in columns:
+                columns[indicator.column] = np.asarray(df[indicator.column], dtype=np.float64)
+        return np.concatenate([indicator.compute(columns[indicator.column])
+                               for indicator in self.indicators], axis=1)
+
+    def transform(self, df):
+        '''
+        df with the features appended as columns; rows with missing values are dropped and
+        the rest put in time order first, as MarketData would
+        '''
+        df = df.dropna()
+        df = df.sort_values(by=[df.columns[0]], kind='stable').reset_index(drop=True)
+        features = pd.DataFrame(self.compute(df), columns=self.names)
+        return pd.concat([df, features], axis=1)
+
+    def stream(self, history=None):
+        '''
+        the incremental path; the indicators are warmed up on history, a dataframe of the
+        bars before the stream starts, with array operations over its columns
+        '''
+        stream = FeatureStream([get_indicator(item) for item in self.spec])
+        if history is not None:
+            for indicator in stream.indicators:
+                indicator.warm(np.asarray(history[indicator.column], dtype=np.float64))
+        return stream
+
+    def key(self):
+        return hashlib.sha256(json.dumps(self.spec, sort_keys=True).encode()).hexdigest()[:16]
+
+    def load(self, path, cache_dir=None):
+        '''
+        the CSV dataset at path with the features appended, as transform() gives it; the
+        feature columns are cached in <dataset cache>/features/<hash of the spec>/ and only
+        computed again when the CSV or the spec changes
+        '''
+        cache = DatasetCache(path, cache_dir)
+        df = cache.load()
+        df = df.dropna()
+        df = df.sort_values(by=[df.columns[0]], kind='stable').reset_index(drop=True)
+
+        feature_dir = os.path.join(cache.cache_dir, 'features', self.key())
+        meta_path = os.path.join(feature_dir, 'meta.json')
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+        if meta is None or meta['sha256'] != cache.content_hash() or meta['rows'] != len(df):
+            os.makedirs(feature_dir, exist_ok=True)
+            tmp = '{}.{}.tmp'.format(os.path.join(feature_dir, 'features.npy'), os.getpid())
+            with open(tmp, 'wb') as f:
+                np.save(f, self.compute(df))
+            os.replace(tmp, os.path.join(feature_dir, 'features.npy'))
+            meta = {'sha256': cache.content_hash(), 'spec': self.spec, 'names': self.names,
+                    'rows': len(df)}
+            tmp = '{}.{}.tmp'.format(meta_path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp, meta_path)
+
+        features = pd.DataFrame(np.load(os.path.join(feature_dir, 'features.npy')), columns=meta['names'])
+        return pd.concat([df, features], axis=1)
@@ -0,0 +1,137 @@
+######################################################################
+# Local replay of a CSV dataset as a live bar feed                    #
+# Bars are pushed over a websocket at a configurable speed and orders #
+# are acknowledged as paper fills, standing in for a broker's feed    #
+######################################################################
+
+import json
+import time
+import asyncio
+import argparse
+from aiohttp import web
+
+from data.DatasetCache import load_dataset, parse_timestamps
+
+BARS_PATH = '/bars'
+ORDERS_PATH = '/orders'
+
+
+class ReplayServer():
+    '''
+    aiohttp server on localhost that replays the rows of a dataframe as live bars.
+
+    Every websocket client of /bars gets the bars from the first row on, each as a JSON
+    message {'bar': {column: value}, 'sent_at': unix seconds}, followed by {'end': true}.
+    Bars are spaced as their timestamps divided by speed, or `interval` seconds apart when
+    given. Orders POSTed to /orders as JSON are recorded in `orders` and filled in full at
+    the close of the last bar sent: {'status': 'filled', 'price': close, 'assets': assets}.
+
+        async with ReplayServer(df, interval=0.01) as server:
+            trader = LiveTrader(env, model, server.bars_url, server.orders_url)
+    '''
+    def __init__(self, df, speed=1.0, interval=None, host='127.0.0.1', port=0):
+        '''
+        input:
+            df:
+            a pandas dataframe whose first column is the date or time; rows with missing
+            values are skipped
+
+            speed:
+            a float; how many times faster than real time the bars are replayed
+
+            interval:
+            a float or None; seconds between two bars, instead of their real spacing
+        '''
+        self.df = df.dropna().reset_index(drop=True)
+        self.timestamps = parse_timestamps(self.df[self.df.columns[0]])
+        self.speed = speed
+        self.interval = interval
+        self.host = host
+        self.port = port
+        self.orders = []
+        self.last_close = None
+
+    @property
+    def bars_url(self):
+        return 'ws://{}:{}{}'.format(self.host, self.port, BARS_PATH)
+
+    @property
+    def orders_url(self):
+        return 'http://{}:{}{}'.format(self.host, self.port, ORDERS_PATH)
+
+    def delays(self):
+        '''seconds from the first bar to every bar'''
+        if self.interval is not None:
+            return [i * self.interval for i in range(len(self.df))]
+        return ((self.timestamps - self.timestamps[0]) / self.speed).tolist()
+
+    async def bars(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        loop = asyncio.get_running_loop()
+        # bars are scheduled from the start of the replay, so slow sends do not add up
+        start = loop.time()
+        for bar, delay in zip(self.df.to_dict('records'), self.delays()):
+            wait = start + delay - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if ws.closed:
+                break
+            self.last_close = bar['Close']
+            await ws.send_str(json.dumps({'bar': bar, 'sent_at': time.time()}))
+        if not ws.closed:
+            await ws.send_str(json.dumps({'end': True}))
+            await ws.close()
+        return ws
+
+    async def order(self, request):
+        order = await request.json()
+        order['received_at'] = time.time()
+        self.orders.append(order)
+        return web.json_response({'status': 'filled', 'price': self.last_close, 'assets': order['assets'],
+                                  'received_at': order['received_at']})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(BARS_PATH, self.bars)
+        app.router.add_post(ORDERS_PATH, self.order)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # the port chosen by the OS when port=0
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data', required=True, type=str, help='CSV dataset to replay')
+parser.add_argument('--port', default=8081, type=int)
+parser.add_argument('--speed', default=None, type=float,
+                    help='how many times faster than real time the bars are replayed, instead of '
+                         '--interval; e.g. 86400 plays daily bars one a second')
+parser.add_argument('--interval', default=0.1, type=float,
+                    help='seconds between two bars, unless --speed is given')
+
+
+async def main(args):
+    df = load_dataset(args.data)
+    # real time is a day per bar for daily data, so bars are evenly spaced unless --speed is given
+    speed, interval = (args.speed, None) if args.speed is not None else (1.0, args.interval)
+    async with ReplayServer(df, speed=speed, interval=interval, port=args.port) as server:
+        print('replaying {} bars on {}, orders to {}'.format(len(server.df), server.bars_url,
+                                                              server.orders_url))
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+######################################################################
+# Local stand-in for the Yahoo Finance historical data API            #
+# Serves deterministic daily prices so the downloader can be checked  #
+# without network access                                              #
+######################################################################
+
+import zlib
+import random
+import asyncio
+import argparse
+import datetime as dt
+import numpy as np
+from aiohttp import web
+
+PATH = '/stock/v2/get-historical-data'
+
+
+def daily_prices(symbol, period1, period2):
+    '''
+    deterministic weekday prices of symbol between unix seconds period1 and period2,
+    in the format of the API's 'prices' list
+    '''
+    start = dt.datetime.fromtimestamp(period1, tz=dt.timezone.utc).date()
+    end = dt.datetime.fromtimestamp(period2, tz=dt.timezone.utc).date()
+    days = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    days = days[np.is_busday(days)]
+    # one random walk per symbol from a fixed origin, so overlapping requests agree
+    origin = np.datetime64('1970-01-01')
+    offsets = np.busday_count(origin, days)
+    rng = np.random.RandomState(zlib.crc32(symbol.encode()))
+    walk = 100 + np.cumsum(rng.normal(0, 1, int(offsets.max(initial=0)) + 1)) * 0.5
+    prices = []
+    for day, offset in zip(days, offsets):
+        close = float(abs(walk[offset]) + 1)
+        open_ = close * (1 + 0.01 * np.sin(offset))
+        prices.append({'date': int((day - np.datetime64('1970-01-01')) / np.timedelta64(1, 's')),
+                       'open': open_,
+                       'high': max(open_, close) * 1.01,
+                       'low': min(open_, close) * 0.99,
+                       'close': close,
+                       'adjclose': close * 0.98,
+                       'volume': int(1e6 + (offset * 7919) % 1e6)})
+    # newest first, as the API returns them
+    return prices[::-1]
+
+
+class StubServer():
+    '''
+    aiohttp server on localhost answering historical data requests with daily_prices.
+    It records every request in `requests`, and can fail a fraction of requests with
+    503 (fail_rate) or answer 429 to more than rate_limit requests per second, to exercise
+    retries and rate limiting. Every answer can be delayed by latency seconds.
+
+        async with StubServer() as server:
+            downloader.url = server.url
+    '''
+    def __init__(self, host='127.0.0.1', port=0, fail_rate=0.0, rate_limit=None, seed=0,
+                 latency=0.0):
+        self.host = host
+        self.port = port
+        self.fail_rate = fail_rate
+        self.rate_limit = rate_limit
+        self.latency = latency
+        self.random = random.Random(seed)
+        self.requests = []
+        self._window = []
+
+    @property
+    def url(self):
+        return 'http://{}:{}{}'.format(self.host, self.port, PATH)
+
+    async def handle(self, request):
+        query = request.query
+        self.requests.append(dict(query))
+        now = asyncio.get_running_loop().time()
+        self._window = [t for t in self._window if now - t < 1] + [now]
+        if self.rate_limit is not None and len(self._window) > self.rate_limit:
+            return web.json_response({'message': 'Too many requests'}, status=429,
+                                     headers={'Retry-After': '1'})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.fail_rate:
+            return web.json_response({'message': 'Service unavailable'}, status=503)
+        prices = daily_prices(query['symbol'], int(query['period1']), int(query['period2']))
+        return web.json_response({'prices': prices, 'isPending': False, 'eventsData': []})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get(PATH, self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # the port chosen by the OS when port=0
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--port', default=8080, type=int)
+parser.add_argument('--fail_rate', default=0.0, type=float)
+parser.add_argument('--rate_limit', default=None, type=int)
+parser.add_argument('--latency', default=0.0, type=float, help='seconds before every answer')
+
+
+async def main(args):
+    async with StubServer(port=args.port, fail_rate=args.fail_rate, rate_limit=args.rate_limit,
+                          latency=args.latency) as server:
+        print('serving on {}'.format(server.url))
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parser.parse_args()))
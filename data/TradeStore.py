@@ -0,0 +1,184 @@
+######################################################################
+# Persistence of agents, episodes and trades                          #
+# Rows are queued by the env and written by background threads in    #
+# batches, through a pool of MySQL or SQLite connections              #
+######################################################################
+
+import os
+import uuid
+import queue
+import sqlite3
+import threading
+import datetime as dt
+
+# codes of the asset types in the Agents table
+ASSET_TYPES = {'stock': 0, 'bitcoin': 1, 'FX': 2, 'option': 3}
+
+EPISODE_COLUMNS = ['EpisodeId', 'AgentId', 'AssetType', 'DateCreated', 'Steps', 'FrameStart',
+                   'InitialBalance', 'FinalNetWorth', 'TotalReward', 'NumTrades']
+TRADE_COLUMNS = ['EpisodeId', 'Step', 'TradeType', 'Assets', 'Total']
+
+
+class SQLiteBackend():
+    '''SQLite database file; the tables of createDB_sqlite.sql are created if missing'''
+    placeholder = '?'
+    schema = os.path.join(os.path.dirname(__file__), 'createDB_sqlite.sql')
+
+    def __init__(self, path):
+        self.path = path
+        db = self.connect()
+        with open(self.schema) as f:
+            db.executescript(f.read())
+        db.close()
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # let readers run while a batch is being written
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+
+class MySQLBackend():
+    '''MySQL database created with createDB.sql'''
+    placeholder = '%s'
+
+    def __init__(self, host='localhost', user='root', password='', database='RLTrading'):
+        self.params = dict(host=host, user=user, passwd=password, db=database)
+
+    def connect(self):
+        import pymysql
+        return pymysql.connect(**self.params)
+
+
+class ConnectionPool():
+    '''fixed number of open connections, handed out one thread at a time'''
+    def __init__(self, backend, size):
+        self.backend = backend
+        self._connections = queue.Queue()
+        for _ in range(size):
+            self._connections.put(backend.connect())
+
+    def get(self):
+        return self._connections.get()
+
+    def put(self, connection):
+        self._connections.put(connection)
+
+    def close(self):
+        while not self._connections.empty():
+            self._connections.get().close()
+
+
+class TradeStore():
+    '''
+    Records episodes and trades without blocking the caller: rows are put on a queue and
+    background writer threads, each with a connection from the pool, insert them in
+    batches of up to batch_size rows per table with executemany (a single multi-row
+    INSERT with pymysql, one transaction with sqlite3). When the queue holds max_queue
+    rows, further rows are dropped and counted in `dropped` rather than blocking; rows of
+    batches that fail to insert are counted in `failed`.
+    '''
+    def __init__(self, backend, pool_size=1, batch_size=1000, flush_interval=1.0, max_queue=1000000):
+        self.backend = backend
+        self.pool = ConnectionPool(backend, pool_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.failed = 0
+        self.error = None
+        # guards the counters and error, updated from the writer threads
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._writers = [threading.Thread(target=self._write_loop, daemon=True)
+                         for _ in range(pool_size)]
+        for writer in self._writers:
+            writer.start()
+
+    def register_agent(self, assetType):
+        '''insert an agent and return its AgentId; blocking, meant to be called once at startup'''
+        connection = self.pool.get()
+        try:
+            cursor = connection.cursor()
+            cursor.execute('INSERT INTO Agents (DateCreated, AssetType) VALUES ({0}, {0})'.format(
+                self.backend.placeholder), (dt.datetime.now().isoformat(' '), ASSET_TYPES[assetType]))
+            connection.commit()
+            return cursor.lastrowid
+        finally:
+            self.pool.put(connection)
+
+    @staticmethod
+    def new_episode_id():
+        return uuid.uuid4().hex
+
+    def record_trade(self, episode_id, trade):
+        '''queue a trade, a dict with step, type, assets and total as a TradeLedger gives them'''
+        self._put(('Trades', (episode_id, int(trade['step']), trade['type'],
+                              float(trade['assets']), float(trade['total']))))
+
+    def record_episode(self, episode_id, agent_id, assetType, steps, frame_start,
+                       initial_balance, final_net_worth, total_reward, num_trades):
+        '''queue the summary of a finished episode'''
+        self._put(('Episodes', (episode_id, agent_id, assetType, dt.datetime.now().isoformat(' '),
+                                int(steps), int(frame_start), float(initial_balance),
+                                float(final_net_worth), float(total_reward), int(num_trades))))
+
+    def _put(self, row):
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self):
+        '''block until every queued row has been written'''
+        self._queue.join()
+
+    def close(self):
+        '''write the remaining rows, stop the writers and close the connections'''
+        self.flush()
+        self._closed = True
+        for writer in self._writers:
+            writer.join()
+        self.pool.close()
+
+    def _write_loop(self):
+        while not self._closed:
+            try:
+                rows = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(rows)
+            except Exception as e:
+                # keep writing later batches; the error is kept for the caller to inspect
+                with self._lock:
+                    self.failed += len(rows)
+                    self.error = e
+            finally:
+                for _ in rows:
+                    self._queue.task_done()
+
+    def _write(self, rows):
+        tables = {'Episodes': [], 'Trades': []}
+        for table, values in rows:
+            tables[table].append(values)
+        connection = self.pool.get()
+        try:
+            cursor = connection.cursor()
+            for table, columns in (('Episodes', EPISODE_COLUMNS), ('Trades', TRADE_COLUMNS)):
+                if tables[table]:
+                    cursor.executemany('INSERT INTO {} ({}) VALUES ({})'.format(
+                        table, ', '.join(columns), ', '.join([self.backend.placeholder] * len(columns))),
+                        tables[table])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            self.pool.put(connection)
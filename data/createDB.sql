@@ -1,6 +1,6 @@
 DROP DATABASE IF EXISTS RLTrading;
-CREATE DATABASE RLTading;
-USE RLTading;
+CREATE DATABASE RLTrading;
+USE RLTrading;
 
 CREATE TABLE Agents (
 AgentId TINYINT UNSIGNED NOT NULL AUTO_INCREMENT,
@@ -10,5 +10,30 @@ AssetType TINYINT UNSIGNED NOT NULL,
 PRIMARY KEY (AgentId)
 )ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
+-- one row per finished episode; EpisodeId is generated by the client so that trades can
+-- be written before their episode
+CREATE TABLE Episodes (
+EpisodeId CHAR(32) NOT NULL,
+AgentId TINYINT UNSIGNED,
+AssetType VARCHAR(16) NOT NULL,
+DateCreated DATETIME NOT NULL,
+Steps INT UNSIGNED NOT NULL,
+FrameStart INT UNSIGNED NOT NULL,
+InitialBalance DOUBLE NOT NULL,
+FinalNetWorth DOUBLE NOT NULL,
+TotalReward DOUBLE NOT NULL,
+NumTrades INT UNSIGNED NOT NULL,
+PRIMARY KEY (EpisodeId),
+FOREIGN KEY (AgentId) REFERENCES Agents(AgentId)
+)ENGINE=InnoDB DEFAULT CHARSET=utf8;
 
-
+CREATE TABLE Trades (
+TradeId BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+EpisodeId CHAR(32) NOT NULL,
+Step INT UNSIGNED NOT NULL,
+TradeType ENUM('buy', 'sell') NOT NULL,
+Assets DOUBLE NOT NULL,
+Total DOUBLE NOT NULL,
+PRIMARY KEY (TradeId),
+INDEX (EpisodeId, Step)
+)ENGINE=InnoDB DEFAULT CHARSET=utf8;
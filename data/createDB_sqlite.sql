@@ -0,0 +1,33 @@
+-- SQLite version of createDB.sql
+CREATE TABLE IF NOT EXISTS Agents (
+AgentId INTEGER PRIMARY KEY AUTOINCREMENT,
+DateCreated TEXT NOT NULL,
+DateUpdated TEXT DEFAULT CURRENT_TIMESTAMP,
+AssetType INTEGER NOT NULL
+);
+
+-- one row per finished episode; EpisodeId is generated by the client so that trades can
+-- be written before their episode
+CREATE TABLE IF NOT EXISTS Episodes (
+EpisodeId TEXT NOT NULL PRIMARY KEY,
+AgentId INTEGER REFERENCES Agents(AgentId),
+AssetType TEXT NOT NULL,
+DateCreated TEXT NOT NULL,
+Steps INTEGER NOT NULL,
+FrameStart INTEGER NOT NULL,
+InitialBalance REAL NOT NULL,
+FinalNetWorth REAL NOT NULL,
+TotalReward REAL NOT NULL,
+NumTrades INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS Trades (
+TradeId INTEGER PRIMARY KEY AUTOINCREMENT,
+EpisodeId TEXT NOT NULL,
+Step INTEGER NOT NULL,
+TradeType TEXT NOT NULL CHECK (TradeType IN ('buy', 'sell')),
+Assets REAL NOT NULL,
+Total REAL NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS TradesByEpisode ON Trades (EpisodeId, Step);
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class AccountHistory():
+    '''
+    Portfolio status history with one column per timestep and one row per status
+    (net worth, assets held, etc.)
+
+    By default only the last `window` columns are kept, in a ring buffer where every column
+    is written twice, `window` columns apart, so the latest window is always a contiguous
+    slice. With full_history=True every column is kept in a preallocated array that doubles
+    its capacity whenever it is full.
+    '''
+    def __init__(self, num_status, window, full_history=False):
+        self.num_status = num_status
+        self.window = window
+        self.full_history = full_history
+        capacity = 2 * window if not full_history else max(2 * window, 1024)
+        self._buffer = np.zeros((num_status, capacity))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def reset(self, status):
+        '''
+        start a new history with `status` repeated for the whole window
+        input:
+            status:
+            a sequence of length num_status
+        '''
+        self._buffer[:, :self.window] = np.reshape(status, (self.num_status, 1))
+        if not self.full_history:
+            self._buffer[:, self.window:] = self._buffer[:, :self.window]
+        self._size = self.window
+
+    def append(self, status):
+        '''append the status of one timestep in constant (amortised) time'''
+        if self.full_history:
+            if self._size == self._buffer.shape[1]:
+                buffer = np.zeros((self.num_status, 2 * self._size))
+                buffer[:, :self._size] = self._buffer
+                self._buffer = buffer
+            self._buffer[:, self._size] = status
+        else:
+            i = self._size % self.window
+            self._buffer[:, i] = status
+            self._buffer[:, i + self.window] = status
+        self._size += 1
+
+    def get_state(self):
+        '''number of columns appended and a copy of the last `window` columns'''
+        return self._size, self.recent.copy()
+
+    def set_state(self, state):
+        '''
+        return to a state of get_state; with full_history, the columns before the window are
+        those the history holds now, which are the same when it has only grown since
+        '''
+        size, recent = state
+        if self.full_history:
+            if size > self._buffer.shape[1]:
+                buffer = np.zeros((self.num_status, max(2 * self._buffer.shape[1], size)))
+                buffer[:, :self._size] = self._buffer[:, :self._size]
+                self._buffer = buffer
+            self._buffer[:, size - self.window:size] = recent
+        else:
+            # the ring positions of the last `window` timesteps, each written twice
+            i = size % self.window
+            self._buffer[:, i:self.window] = recent[:, :self.window - i]
+            self._buffer[:, :i] = recent[:, self.window - i:]
+            self._buffer[:, self.window:] = self._buffer[:, :self.window]
+        self._size = size
+
+    @property
+    def recent(self):
+        '''view of the last `window` columns in time order, shape (num_status, window)'''
+        if self.full_history:
+            return self._buffer[:, self._size - self.window:self._size]
+        i = self._size % self.window
+        return self._buffer[:, i:i + self.window]
+
+    @property
+    def values(self):
+        '''
+        view of the whole history in time order; without full_history only the last
+        `window` columns are available
+        '''
+        if self.full_history:
+            return self._buffer[:, :self._size]
+        return self.recent
@@ -0,0 +1,183 @@
+import numpy as np
+from envs.MarketData import MarketData
+from envs.TradeLedger import TradeLedger
+from config import get_config
+
+
+class BacktestResult():
+    '''
+    trajectories of a backtest, arrays of shape (num_strategies, num_steps) holding the
+    state after every step as TradeEnv would have it; a strategy that is done keeps its
+    last state for the remaining steps
+    '''
+    def __init__(self, balance, assets_held, avg_cost, net_worth, rewards, steps, prices,
+                 trade_steps, bought, sold, buy_totals, sales):
+        self.balance = balance
+        self.assets_held = assets_held
+        self.avg_cost = avg_cost
+        self.net_worth = net_worth
+        self.rewards = rewards
+        # number of steps each strategy took until it was done, or num_steps
+        self.steps = steps
+        # price every step was traded at, and the dataframe row it is recorded under
+        self.prices = prices
+        self.trade_steps = trade_steps
+        self._bought = bought
+        self._sold = sold
+        self._buy_totals = buy_totals
+        self._sales = sales
+
+    def ledger(self, strategy=0, fill_price=False):
+        '''the trades of one strategy as a TradeLedger, as TradeEnv.trades records them'''
+        bought, sold = self._bought[strategy], self._sold[strategy]
+        steps = np.flatnonzero((bought > 0) | (sold > 0))
+        is_sell = sold[steps] > 0
+        return TradeLedger.from_arrays(self.trade_steps[steps], is_sell,
+                                       np.where(is_sell, sold[steps], bought[steps]),
+                                       np.where(is_sell, self._sales[strategy, steps],
+                                                self._buy_totals[strategy, steps]),
+                                       self.prices[steps] if fill_price else None)
+
+
+class Backtest():
+    '''
+    Replays fixed action sequences through the accounting of TradeEnv without stepping an
+    env. The prices do not depend on the actions, so the random prices and sessions of
+    the whole series are drawn up front, in the order TradeEnv draws them; the portfolio is
+    then scanned over time with every step applied to all strategies at once, as
+    VecTradeEnv does. Scoring many candidate strategies costs little more than one.
+
+    With the same seed (TradeEnv.seed(seed) before reset) and float64 actions, the
+    trajectories and trades are those TradeEnv produces for one episode.
+    '''
+    def __init__(self, df, assetType, config=None):
+        '''
+        input:
+            df, assetType, config:
+            as for TradeEnv
+        '''
+        self.data = df if isinstance(df, MarketData) else MarketData.from_df(df)
+        self.open_prices = self.data.open_prices
+        self.close_prices = self.data.close_prices
+        self.assetType = assetType
+        self.config = config if config is not None else get_config(assetType)
+
+    def _reset_session(self, rng):
+        '''steps_left and frame_start of a new session, as TradeEnv._reset_session draws them'''
+        length = len(self.data)
+        if self.config.serial:
+            return length - self.config.lookback_range - 1, self.config.lookback_range
+        steps_left = rng.randint(int(length/2), length)
+        frame_start = rng.randint(self.config.lookback_range, length - steps_left)
+        return steps_left, frame_start
+
+    def sessions(self, num_steps, seed=None):
+        '''
+        price, dataframe row, step within the session (counted after the step) and whether
+        the session ends, for each of num_steps steps
+        '''
+        # random numbers come from numpy's global state without a seed, as in TradeEnv
+        rng = np.random if seed is None else np.random.RandomState(seed)
+        prices = np.empty(num_steps)
+        rows = np.empty(num_steps, dtype=np.int64)
+        current_steps = np.empty(num_steps, dtype=np.int64)
+        session_ends = np.zeros(num_steps, dtype=bool)
+        t = 0
+        while t < num_steps:
+            steps_left, frame_start = self._reset_session(rng)
+            n = min(steps_left, num_steps - t)
+            steps = np.arange(n)
+            # TradeEnv draws prices at current_step, not frame_start + current_step
+            prices[t:t + n] = rng.uniform(self.open_prices[steps], self.close_prices[steps])
+            rows[t:t + n] = frame_start + steps
+            current_steps[t:t + n] = steps + 1
+            if n == steps_left:
+                session_ends[t + n - 1] = True
+            t += n
+        return prices, rows, current_steps, session_ends
+
+    def run(self, actions, seed=None):
+        '''
+        backtest actions of shape (num_steps, 2), or (num_strategies, num_steps, 2) to score
+        several strategies on the same prices; returns a BacktestResult
+        '''
+        actions = np.asarray(actions, dtype=np.float64)
+        if actions.ndim == 2:
+            actions = actions[None]
+        num_strategies, num_steps = actions.shape[:2]
+        prices, rows, current_steps, session_ends = self.sessions(num_steps, seed)
+        tran_cost = self.config.tran_cost
+
+        balance = np.full(num_strategies, float(self.config.init_bal))
+        net_worth = balance.copy()
+        assets_held = np.zeros(num_strategies)
+        avg_cost = np.zeros(num_strategies)
+        alive = np.ones(num_strategies, dtype=bool)
+        steps = np.full(num_strategies, num_steps)
+
+        shape = (num_strategies, num_steps)
+        out = {name: np.empty(shape) for name in ['balance', 'assets_held', 'avg_cost', 'net_worth', 'rewards']}
+        trades = {name: np.zeros(shape) for name in ['bought', 'sold', 'buy_totals', 'sales']}
+
+        for t in range(num_steps):
+            price = prices[t]
+            action_type = actions[:, t, 0]
+            amount = actions[:, t, 1]
+            buy = alive & (action_type < 1)
+            sell = alive & (action_type >= 1) & (action_type < 2)
+
+            # buy x% of balance in assets
+            total_possible = np.trunc(balance / price)
+            assets_bought = np.where(buy, np.trunc(total_possible * amount), 0)
+            buying_cost = assets_bought * price * (1 + tran_cost)
+            balance -= buying_cost
+            prev_cost = avg_cost * assets_held
+            held = assets_held + assets_bought
+            with np.errstate(divide='ignore', invalid='ignore'):
+                new_avg_cost = np.where(held > 0, (prev_cost + buying_cost) / held, 0)
+            avg_cost = np.where(buy, new_avg_cost, avg_cost)
+            assets_held = held
+
+            # sell x% of assets held
+            assets_sold = np.where(sell, assets_held * amount, 0)
+            sales = assets_sold * price * (1 - tran_cost)
+            balance += sales
+            assets_held -= assets_sold
+
+            prev_net_worth = net_worth
+            net_worth = np.where(alive, balance + assets_held * price, net_worth)
+
+            if self.assetType == 'stock':
+                # discount the account balance
+                rewards = balance * (current_steps[t] / self.config.max_steps)
+            elif self.assetType == 'bitcoin':
+                rewards = net_worth - prev_net_worth
+            elif self.assetType == 'option':
+                rewards = net_worth - prev_net_worth
+            else:
+                # FX has no reward yet, as in TradeEnv
+                rewards = np.zeros(num_strategies)
+
+            # sell everything when the session ends
+            if session_ends[t]:
+                balance = np.where(alive, balance + assets_held * price, balance)
+                assets_held = np.where(alive, 0, assets_held)
+
+            out['balance'][:, t] = balance
+            out['assets_held'][:, t] = assets_held
+            out['avg_cost'][:, t] = avg_cost
+            out['net_worth'][:, t] = net_worth
+            out['rewards'][:, t] = np.where(alive, rewards, 0)
+            trades['bought'][:, t] = assets_bought
+            trades['sold'][:, t] = assets_sold
+            trades['buy_totals'][:, t] = buying_cost
+            trades['sales'][:, t] = sales
+
+            # done when net worth is not positive
+            done = alive & (net_worth <= 0)
+            steps[done] = t + 1
+            alive &= ~done
+
+        return BacktestResult(out['balance'], out['assets_held'], out['avg_cost'], out['net_worth'],
+                              out['rewards'], steps, prices, rows, trades['bought'], trades['sold'],
+                              trades['buy_totals'], trades['sales'])
@@ -0,0 +1,136 @@
+import copy
+import numpy as np
+from envs.TradeEnv import TradeEnv
+from envs.AccountHistory import AccountHistory
+
+
+class LiveTradeEnv(TradeEnv):
+    '''
+    TradeEnv driven by a stream of bars instead of a static dataframe, for live or paper
+    trading. The dataframe given is only the history before the stream starts: its last
+    lookback_range + 1 bars fill the first observation window. Every new bar is appended to
+    the window with observe(), in constant time, and the normalisers step incrementally.
+    order() gives the order an action makes, and fill() books it as the broker filled it;
+    act() does both on paper, at the bar's close.
+
+        obs = env.reset()
+        for bar in bars:
+            obs = env.observe(bar)
+            trade, reward = env.act(model.predict(obs)[0])
+    '''
+    def __init__(self, history, assetType, config=None, pipeline=None):
+        '''
+        input:
+            history:
+            a pandas dataframe with the columns of the training data, first column the date,
+            in time order; at least lookback_range + 1 bars once rows with missing values
+            (and the warm-up rows of the features) are dropped
+
+            assetType, config:
+            as for TradeEnv
+
+            pipeline:
+            a data.FeaturePipeline.FeaturePipeline or None; the features the model was
+            trained with, computed for every new bar by the pipeline's stream
+        '''
+        self.columns = list(history.columns[1:])
+        self.pipeline = pipeline
+        self.history = history.dropna()
+        if pipeline is not None:
+            # the stream warmed up on the history once; every reset starts from a copy
+            self.warm_features = pipeline.stream(self.history)
+            history = pipeline.transform(history)
+        super(LiveTradeEnv, self).__init__(history, assetType, config=config)
+        self.window = self.config.lookback_range + 1
+        if len(self.market_data) < self.window:
+            raise ValueError('{} bars of history are too few for a window of {}'.format(
+                len(self.market_data), self.window))
+        # the observation window of market data, one row per feature and column per bar
+        self.bars = AccountHistory(self.market_data.shape[1], self.window)
+
+    def _reset_session(self):
+        '''start from the last bars of the history; the stream has no end'''
+        self.current_step = 0
+        self.frame_start = 0
+        self.steps_left = np.inf
+        self.new_session = True
+        self.bars.set_state((self.window, self.market_data[-self.window:].T))
+        if self.pipeline is not None:
+            self.features = copy.deepcopy(self.warm_features)
+        self.current_price = float(self.close_prices[-1])
+
+    def _next_observation(self):
+        OHCL = self.bars.recent
+        if self.new_session:
+            OHCL = self.market_normaliser.reset(OHCL)
+            scaled_history = self.account_normaliser.reset(self.account_history.recent)
+            self.new_session = False
+        else:
+            OHCL = self.market_normaliser.step(OHCL)
+            scaled_history = self.account_normaliser.step(self.account_history.recent)
+        return np.append(OHCL, scaled_history, axis=0)
+
+    def observe(self, bar):
+        '''
+        append a new bar to the window and return the observation to act on
+        input:
+            bar:
+            a mapping of column to value, with the columns of the history
+        '''
+        row = [float(bar[column]) for column in self.columns]
+        if self.pipeline is not None:
+            row.extend(self.features.update(bar))
+        self.bars.append(row)
+        self.current_price = float(bar['Close'])
+        return self._next_observation()
+
+    def order(self, action):
+        '''
+        the order an action makes at the last observed bar's close, as a dict of side and
+        assets, or None when it makes no trade; send it to the broker, then book the fill
+        with fill()
+        '''
+        side, assets = self._order(action)
+        if side is None or assets <= 0:
+            return None
+        return {'side': side, 'assets': assets}
+
+    def fill(self, order, price=None):
+        '''
+        book an order as filled and move on to the next bar, as TradeEnv.step does
+        input:
+            order:
+            a dict of side and assets as order() gives, with the assets the broker filled, or
+            None when nothing was filled
+
+            price:
+            a float or None; price the order was filled at, the bar's close when None
+        returns the trade made (a dict as in TradeEnv.trades) or None, and the reward
+        '''
+        if price is not None:
+            self.current_price = price
+        num_trades = len(self.trades)
+        if order is None:
+            self._fill(None, 0)
+        else:
+            self._fill(order['side'], order['assets'])
+        self.current_step += 1
+        reward = self._get_reward()
+        if self.store is not None and self.episode_id is not None:
+            self.episode_steps += 1
+            # FX has no reward yet
+            if reward is not None:
+                self.episode_reward += reward
+        return (self.trades[-1] if len(self.trades) > num_trades else None), reward
+
+    def act(self, action, price=None):
+        '''
+        trade on the last observed bar without a broker: the order of the action is filled
+        in full, at price or at the bar's close
+        '''
+        if price is not None:
+            self.current_price = price
+        return self.fill(self.order(action))
+
+    def step(self, action):
+        raise NotImplementedError('a live env is stepped by observe() with every new bar and act()')
@@ -0,0 +1,264 @@
+import os
+import json
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class MarketData():
+    '''
+    Market data of one dataset held as NumPy arrays:
+        features: float32 matrix of shape (timesteps, features) with every column but the date
+        open_prices, close_prices: float64 arrays used for trading
+        columns: names of the feature columns
+        df: the dataframe the arrays were built from, used for rendering; None for
+        arrays in shared memory
+    '''
+    def __init__(self, features, open_prices, close_prices, columns, df=None):
+        self.features = features
+        self.open_prices = open_prices
+        self.close_prices = close_prices
+        self.columns = list(columns)
+        self._df = df
+
+    @property
+    def df(self):
+        return self._df
+
+    @classmethod
+    def from_df(cls, df):
+        '''
+        build market data from a pandas dataframe whose first column is the date or time;
+        rows with missing values are dropped
+        '''
+        df = df.dropna().reset_index()
+        # excluding the index and date columns
+        features = np.ascontiguousarray(df[df.columns[2:]].values, dtype=np.float32)
+        return cls(features,
+                   df['Open'].values.astype(np.float64),
+                   df['Close'].values.astype(np.float64),
+                   df.columns[2:], df)
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, key):
+        '''rows start:stop of the market data, as views'''
+        if not isinstance(key, slice):
+            raise TypeError('market data can only be sliced by rows')
+        df = None if self.df is None else self.df[key].reset_index(drop=True)
+        return MarketData(self.features[key], self.open_prices[key], self.close_prices[key],
+                          self.columns, df)
+
+
+class SharedMarketData(MarketData):
+    '''
+    Market data copied once into shared memory blocks. Worker processes attach to the same
+    blocks through the picklable handle, read-only, instead of receiving their own copy.
+    The process that created the blocks frees them with unlink().
+    '''
+    arrays = ['features', 'open_prices', 'close_prices']
+
+    def __init__(self, data):
+        self._blocks = []
+        handle = {'columns': list(data.columns)}
+        arrays = []
+        for name in self.arrays:
+            array = getattr(data, name)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            shared[...] = array
+            shared.flags.writeable = False
+            self._blocks.append(block)
+            handle[name] = (block.name, array.shape, array.dtype.str)
+            arrays.append(shared)
+        self.handle = handle
+        super(SharedMarketData, self).__init__(*arrays, data.columns)
+
+    @staticmethod
+    def attach(handle):
+        '''attach to the shared blocks described by handle; returns read-only MarketData'''
+        blocks = []
+        arrays = []
+        for name in SharedMarketData.arrays:
+            block_name, shape, dtype = handle[name]
+            block = shared_memory.SharedMemory(name=block_name)
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            array.flags.writeable = False
+            blocks.append(block)
+            arrays.append(array)
+        data = MarketData(*arrays, handle['columns'])
+        # keep the blocks open for as long as the arrays are in use
+        data._blocks = blocks
+        return data
+
+    def unlink(self):
+        '''free the shared blocks; attached processes should be closed first'''
+        self.features = self.open_prices = self.close_prices = None
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+class MemmapMarketData(MarketData):
+    '''
+    Market data memory-mapped from the binary cache of a CSV dataset (see DatasetCache).
+    The feature matrix and prices are written once to .npy files next to the cache, with
+    missing rows dropped and rows in time order. Sessions then read them through memory maps,
+    so only the pages a session touches are loaded and datasets larger than memory can be
+    traded. The dataframe for rendering is only loaded when it is first needed.
+    '''
+    def __init__(self, path, cache_dir=None, chunksize=1000000):
+        '''
+        input:
+            path:
+            a string; path of the CSV dataset
+
+            cache_dir:
+            a string or None; directory of its cache, as for DatasetCache
+        '''
+        # imported here as the data package is only needed for cached datasets
+        from data.DatasetCache import DatasetCache
+        self.cache = DatasetCache(path, cache_dir)
+        self.market_dir = os.path.join(self.cache.cache_dir, 'market')
+        meta = self._market_meta()
+        if meta is None:
+            meta = self._build(chunksize)
+        super(MemmapMarketData, self).__init__(self._load('features'),
+                                               self._load('open'),
+                                               self._load('close'),
+                                               meta['columns'])
+        # rows of the dataset kept, in order; used to load the dataframe for rendering
+        self.rows = self._load('rows')
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self.cache.load().iloc[self.rows].reset_index()
+        return self._df
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('market data can only be sliced by rows')
+        data = MarketData.__new__(MemmapMarketData)
+        MarketData.__init__(data, self.features[key], self.open_prices[key],
+                            self.close_prices[key], self.columns)
+        data.cache = self.cache
+        data.market_dir = self.market_dir
+        data.rows = self.rows[key]
+        return data
+
+    def _load(self, name):
+        return np.load(os.path.join(self.market_dir, name + '.npy'), mmap_mode='r')
+
+    def _market_meta(self):
+        '''metadata of the market files if they were built from the current CSV'''
+        try:
+            with open(os.path.join(self.market_dir, 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta['sha256'] == self.cache.content_hash() else None
+
+    def _build(self, chunksize):
+        '''write the market files chunksize rows at a time; returns their metadata'''
+        cache_meta = self.cache.meta()
+        columns = cache_meta['columns'][1:]
+        os.makedirs(self.market_dir, exist_ok=True)
+
+        # drop rows with missing values
+        keep = np.ones(cache_meta['rows'], dtype=bool)
+        for col in columns:
+            keep &= ~np.isnan(self.cache.column(col))
+        rows = np.flatnonzero(keep)
+        # put rows in time order if the CSV is not
+        timestamps = self.cache.column('timestamp')[rows]
+        if np.any(np.diff(timestamps) < 0):
+            rows = rows[np.argsort(timestamps, kind='stable')]
+
+        out = {'features': np.float32, 'open': np.float64, 'close': np.float64}
+        arrays = {}
+        for name, dtype in out.items():
+            shape = (len(rows), len(columns)) if name == 'features' else (len(rows),)
+            arrays[name] = np.lib.format.open_memmap(self._tmp_path(name), mode='w+',
+                                                     dtype=dtype, shape=shape)
+        for start in range(0, len(rows), chunksize):
+            chunk = rows[start:start + chunksize]
+            for j, col in enumerate(columns):
+                arrays['features'][start:start + len(chunk), j] = self.cache.column(col)[chunk]
+            arrays['open'][start:start + len(chunk)] = self.cache.column('Open')[chunk]
+            arrays['close'][start:start + len(chunk)] = self.cache.column('Close')[chunk]
+        for name in out:
+            arrays[name].flush()
+        del arrays
+        for name in out:
+            os.replace(self._tmp_path(name), os.path.join(self.market_dir, name + '.npy'))
+        np.save(os.path.join(self.market_dir, 'rows.npy'), rows)
+
+        meta = {'sha256': cache_meta['sha256'], 'columns': columns}
+        with open(os.path.join(self.market_dir, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+    def _tmp_path(self, name):
+        return os.path.join(self.market_dir, '{}.{}.tmp.npy'.format(name, os.getpid()))
+
+
+class PortfolioData():
+    '''
+    Market data of K instruments aligned on their common timesteps, held as NumPy arrays:
+        features: float32 array of shape (timesteps, K, features), so the window of every
+        instrument over a range of timesteps is one slice
+        open_prices, close_prices: float64 arrays of shape (timesteps, K)
+        names: names of the instruments
+        columns: names of the feature columns, the same for every instrument
+        dates: values of the date column of the common timesteps
+    '''
+    def __init__(self, features, open_prices, close_prices, names, columns, dates=None):
+        self.features = features
+        self.open_prices = open_prices
+        self.close_prices = close_prices
+        self.names = list(names)
+        self.columns = list(columns)
+        self.dates = dates
+
+    @classmethod
+    def from_dfs(cls, dfs):
+        '''
+        build portfolio data from a dict of instrument name to pandas dataframe, or a list of
+        dataframes, whose first column is the date or time; rows with missing values are
+        dropped and only the dates every instrument has are kept
+        '''
+        if not isinstance(dfs, dict):
+            dfs = {str(i): df for i, df in enumerate(dfs)}
+        if not dfs:
+            raise ValueError('a portfolio needs at least one instrument')
+        frames = [df.dropna().set_index(df.columns[0]) for df in dfs.values()]
+        columns = list(frames[0].columns)
+        for name, frame in zip(dfs, frames):
+            if list(frame.columns) != columns:
+                raise ValueError('{} has columns {}, expected {}'.format(name, list(frame.columns), columns))
+        dates = frames[0].index
+        for frame in frames[1:]:
+            dates = dates.intersection(frame.index)
+        dates = dates.sort_values()
+        values = np.stack([frame.loc[dates].values for frame in frames], axis=1)
+        return cls(np.ascontiguousarray(values, dtype=np.float32),
+                   np.ascontiguousarray(values[:, :, columns.index('Open')], dtype=np.float64),
+                   np.ascontiguousarray(values[:, :, columns.index('Close')], dtype=np.float64),
+                   dfs.keys(), columns, dates.values)
+
+    @property
+    def num_assets(self):
+        return self.features.shape[1]
+
+    def __len__(self):
+        return len(self.features)
+
+    def __getitem__(self, key):
+        '''rows start:stop of the portfolio data, as views'''
+        if not isinstance(key, slice):
+            raise TypeError('portfolio data can only be sliced by rows')
+        return PortfolioData(self.features[key], self.open_prices[key], self.close_prices[key],
+                             self.names, self.columns,
+                             None if self.dates is None else self.dates[key])
@@ -0,0 +1,164 @@
+from collections import deque
+import numpy as np
+
+
+def min_max_scale(x, axis=0):
+    '''
+    scale x into [0, 1] along axis with the same arithmetic as sklearn's MinMaxScaler,
+    i.e. x * scale - min * scale, and constant ranges mapped to 0
+    '''
+    low = x.min(axis=axis, keepdims=True)
+    data_range = x.max(axis=axis, keepdims=True) - low
+    data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1
+    scale = 1 / data_range
+    return x * scale + (0 - low * scale)
+
+
+class Normaliser():
+    '''
+    Normalises observation windows of shape (features, window), oldest column first.
+
+    reset() is called with the first window of a session, step() with every following
+    window, which must be the previous one moved forward by one timestep, so stateful
+    normalisers can update incrementally. transform() normalises a window (or a batch of
+    windows, shape (..., features, window)) from scratch and gives the same result.
+    Every env instance owns its normalisers, so no state is shared between envs.
+    '''
+    def reset(self, window):
+        return self.transform(window)
+
+    def step(self, window):
+        return self.transform(window)
+
+    def transform(self, window):
+        raise NotImplementedError
+
+
+class MinMaxNormaliser(Normaliser):
+    '''min-max scales every timestep across features, as MinMaxScaler.fit_transform did'''
+    def transform(self, window):
+        return min_max_scale(window, axis=-2)
+
+
+class RollingMinMaxNormaliser(Normaliser):
+    '''
+    min-max scales every feature over the timesteps of the window; the window min/max
+    are kept incrementally with monotonic deques of (timestep, value) pairs
+    '''
+    def reset(self, window):
+        self._t = 0
+        self._size = window.shape[-1]
+        self._mins = [deque() for _ in range(window.shape[-2])]
+        self._maxs = [deque() for _ in range(window.shape[-2])]
+        for column in window.T:
+            self._push(column)
+        return self._scale(window)
+
+    def step(self, window):
+        self._push(window[:, -1])
+        return self._scale(window)
+
+    def transform(self, window):
+        return min_max_scale(window, axis=-1)
+
+    def _push(self, column):
+        t = self._t
+        self._t += 1
+        for mins, maxs, x in zip(self._mins, self._maxs, column.tolist()):
+            while mins and mins[-1][1] >= x:
+                mins.pop()
+            mins.append((t, x))
+            if mins[0][0] <= t - self._size:
+                mins.popleft()
+            while maxs and maxs[-1][1] <= x:
+                maxs.pop()
+            maxs.append((t, x))
+            if maxs[0][0] <= t - self._size:
+                maxs.popleft()
+
+    def _scale(self, window):
+        low = np.array([mins[0][1] for mins in self._mins], dtype=window.dtype)[:, None]
+        high = np.array([maxs[0][1] for maxs in self._maxs], dtype=window.dtype)[:, None]
+        data_range = high - low
+        data_range[data_range < 10 * np.finfo(data_range.dtype).eps] = 1
+        scale = 1 / data_range
+        return window * scale + (0 - low * scale)
+
+
+class RollingZScoreNormaliser(Normaliser):
+    '''
+    standardises every feature by its mean and standard deviation over the window;
+    the running sums are updated with the column that enters and the one that leaves
+    '''
+    def reset(self, window):
+        window = np.asarray(window, dtype=np.float64)
+        self._sum = window.sum(axis=1)
+        self._sum_sq = (window * window).sum(axis=1)
+        self._first = window[:, 0].copy()
+        return self._scale(window)
+
+    def step(self, window):
+        window = np.asarray(window, dtype=np.float64)
+        new = window[:, -1]
+        self._sum += new - self._first
+        self._sum_sq += new * new - self._first * self._first
+        self._first = window[:, 0].copy()
+        return self._scale(window)
+
+    def transform(self, window):
+        window = np.asarray(window, dtype=np.float64)
+        mean = window.mean(axis=-1, keepdims=True)
+        std = window.std(axis=-1, keepdims=True)
+        std[std == 0] = 1
+        return (window - mean) / std
+
+    def _scale(self, window):
+        n = window.shape[1]
+        mean = self._sum / n
+        std = np.sqrt(np.maximum(self._sum_sq / n - mean * mean, 0))
+        std[std == 0] = 1
+        return (window - mean[:, None]) / std[:, None]
+
+
+class LogReturnNormaliser(Normaliser):
+    '''
+    log return of every feature against the previous timestep; the oldest column of the
+    window has no previous timestep and is 0, as are returns from or to non-positive values
+    '''
+    def reset(self, window):
+        self._obs = self.transform(window)
+        return self._obs
+
+    def step(self, window):
+        obs = np.empty_like(self._obs)
+        obs[:, 0] = 0
+        obs[:, 1:-1] = self._obs[:, 2:]
+        obs[:, -1] = _log_return(window[:, -1], window[:, -2])
+        self._obs = obs
+        return obs
+
+    def transform(self, window):
+        window = np.asarray(window, dtype=np.float64)
+        obs = np.zeros(window.shape)
+        obs[..., 1:] = _log_return(window[..., 1:], window[..., :-1])
+        return obs
+
+
+def _log_return(current, previous):
+    current = np.asarray(current, dtype=np.float64)
+    previous = np.asarray(previous, dtype=np.float64)
+    valid = (current > 0) & (previous > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(valid, np.log(np.where(valid, current / previous, 1)), 0)
+
+
+def get_normaliser(name):
+    if name == 'minmax':
+        return MinMaxNormaliser()
+    elif name == 'rolling_minmax':
+        return RollingMinMaxNormaliser()
+    elif name == 'zscore':
+        return RollingZScoreNormaliser()
+    elif name == 'log_return':
+        return LogReturnNormaliser()
+    raise ValueError('unknown normalisation: {}'.format(name))
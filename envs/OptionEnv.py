@@ -0,0 +1,345 @@
+import gym
+from gym import spaces
+import numpy as np
+from envs.AccountHistory import AccountHistory
+from envs.Normaliser import get_normaliser
+from envs.MarketData import MarketData
+from envs.TradeLedger import TradeLedger
+from envs.OptionPricing import black_scholes, VolSurface
+from config import get_config
+
+# per contract of the chain: price, delta, gamma, vega and theta in units of the
+# underlying's price, and the fraction of net worth held in it
+NUM_CHAIN_FEATURES = 6
+# contract keys pack the expiry row, the strike on the strike grid and the option type
+STRIKE_BITS = 24
+
+
+class OptionEnv(gym.Env):
+    '''
+    Trading environment for options on an index (or any underlying in df) that follows
+    gym interface.
+
+    Every step lists a chain of calls and puts around the money (see config_options), and
+    the chain and every contract held are valued together with Black-Scholes, at vols from
+    the implied vol surface, in one vectorised pass; the portfolio's value and Greeks are
+    sums over those arrays, so hundreds of contracts cost no per-contract Python.
+
+    An action is the target weight of the net worth held in every contract of the chain,
+    executed as one rebalance in whole contracts; options are only bought and sold, never
+    written. Contracts that have moved out of the chain are held until they expire, and
+    settle at their intrinsic value. The reward is the change in net worth.
+    '''
+    metadata = {'render.modes': ['file', 'none']}
+    render_file = None
+
+    def __init__(self, df, assetType='option', config=None):
+        '''
+        input:
+            df:
+            a pandas dataframe of the underlying, or MarketData built from one
+
+            assetType, config:
+            as for TradeEnv
+        '''
+        super(OptionEnv, self).__init__()
+        self.data = df if isinstance(df, MarketData) else MarketData.from_df(df)
+        self.market_data = self.data.features
+        self.close_prices = self.data.close_prices
+        self.np_random = np.random
+
+        self.assetType = assetType
+        self.config = config if config is not None else get_config(self.assetType)
+        self.market_normaliser = get_normaliser(self.config.normalisation)
+        self.account_normaliser = get_normaliser(self.config.normalisation)
+        self.surface = VolSurface.parametric(self.config.atm_vol, self.config.vol_skew,
+                                             self.config.vol_smile, self.config.vol_term)
+        # strikes lie on a fixed grid, so a contract keeps its strike from step to step
+        self.strike_step = self.config.strike_step * float(np.median(self.close_prices))
+
+        # chain layout: by expiry, then strike, then call and put
+        num_strikes, num_expiries = self.config.num_strikes, self.config.num_expiries
+        self._strike_offsets = np.tile(np.repeat(np.arange(num_strikes) - num_strikes // 2, 2), num_expiries)
+        self._expiry_offsets = np.repeat(np.arange(num_expiries), 2 * num_strikes)
+        self._is_call = np.tile([True, False], num_strikes * num_expiries)
+        self.num_contracts = len(self._is_call)
+
+        self.action_space = spaces.Box(low=0, high=1, shape=(self.num_contracts,), dtype=np.float16)
+        # market data and portfolio status (net worth, balance, delta, gamma, vega) for the
+        # last lookback_range + 1 timesteps, and the chain, flattened into one vector
+        window = self.config.lookback_range + 1
+        size = ((self.market_data.shape[1] + self.config.num_portfolio_status) * window
+                + self.num_contracts * NUM_CHAIN_FEATURES)
+        self.observation_space = spaces.Box(low=0, high=1, shape=(size,), dtype=np.float16)
+
+    def seed(self, seed=None):
+        '''give this env its own random state, e.g. one seed per worker process'''
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def reset(self):
+        '''
+        initialise or reset the portfolio: all cash, no contracts, and a new session
+        '''
+        self.balance = self.config.init_bal
+        self.net_worth = self.config.init_bal
+        self.prev_net_worth = self.net_worth
+        # contracts held, sorted by key
+        self.book = {name: np.empty(0, dtype=dtype) for name, dtype in
+                     [('key', np.int64), ('strike', np.float64), ('expiry', np.int64),
+                      ('is_call', bool), ('quantity', np.float64), ('avg_cost', np.float64),
+                      ('mark', np.float64)]}
+        self.trades = TradeLedger(fill_price=self.config.fill_price, asset_ids=True)
+
+        self._reset_session()
+        self._mark()
+        self.account_history = AccountHistory(self.config.num_portfolio_status,
+                                              self.config.lookback_range + 1,
+                                              full_history=self.config.full_history)
+        self.account_history.reset(self._status())
+        return self._next_observation()
+
+    def _reset_session(self):
+        '''as TradeEnv._reset_session'''
+        self.current_step = 0
+        self.new_session = True
+        if self.config.serial:
+            self.steps_left = len(self.market_data) - self.config.lookback_range - 1
+            self.frame_start = self.config.lookback_range
+        else:
+            self.steps_left = self.np_random.randint(int(len(self.market_data)/2), len(self.market_data))
+            self.frame_start = self.np_random.randint(
+                self.config.lookback_range, len(self.market_data) - self.steps_left)
+
+    def contract(self, key):
+        '''expiry row, strike and whether it is a call, of a contract key (e.g. a trade's asset)'''
+        key = np.asarray(key, dtype=np.int64)
+        return key >> (STRIKE_BITS + 1), ((key >> 1) & ((1 << STRIKE_BITS) - 1)) * self.strike_step, (key & 1) == 1
+
+    def _chain(self, row, spot):
+        '''
+        keys, strikes, expiry rows and types of the contracts of the chain at row, and which
+        of them are listed; strikes below the first of the strike grid are not, and have a
+        key of -1 (and a placeholder strike) so that they never match a contract held
+        '''
+        every = self.config.expiry_every
+        strike_index = np.round(spot / self.strike_step).astype(np.int64) + self._strike_offsets
+        listed = strike_index >= 1
+        strike_index = np.where(listed, strike_index, 1)
+        expiry = (row // every + 1 + self._expiry_offsets) * every
+        key = np.where(listed, ((expiry << STRIKE_BITS) + strike_index) * 2 + self._is_call, -1)
+        return key, strike_index * self.strike_step, expiry, self._is_call, listed
+
+    def _mark(self):
+        '''
+        at the current row: settle the contracts that expire, list the chain, and value the
+        chain and the book in one pass; updates net worth and the Greeks of the portfolio
+        '''
+        row = self.frame_start + self.current_step
+        spot = float(self.close_prices[row])
+        self.current_price = spot
+        book = self.book
+
+        expired = book['expiry'] <= row
+        if expired.any():
+            intrinsic = np.maximum(np.where(book['is_call'], spot - book['strike'], book['strike'] - spot), 0)
+            value = book['quantity'] * intrinsic * self.config.contract_size
+            self.balance += float(value[expired].sum())
+            self._add_trades(row, 1, book['key'][expired], book['quantity'][expired],
+                             value[expired], intrinsic[expired])
+            self.book = book = {name: values[~expired] for name, values in book.items()}
+
+        key, strike, expiry, is_call, listed = self._chain(row, spot)
+        strikes = np.concatenate([strike, book['strike']])
+        T = (np.concatenate([expiry, book['expiry']]) - row) / self.config.steps_per_year
+        values = black_scholes(spot, strikes, T, self.config.rate, self.surface.vol(strikes, spot, T),
+                               np.concatenate([is_call, book['is_call']]), self.config.dividend)
+        n = self.num_contracts
+        self.chain = {'key': key, 'strike': strike, 'expiry': expiry, 'is_call': is_call, 'listed': listed}
+        self.chain.update({name: np.where(listed, value[:n], 0) for name, value in values.items()})
+        book['mark'] = values['price'][n:]
+
+        size = self.config.contract_size
+        held = book['quantity'] * size
+        self.net_worth = self.balance + float(held @ book['mark'])
+        self.delta = float(held @ values['delta'][n:])
+        self.gamma = float(held @ values['gamma'][n:])
+        self.vega = float(held @ values['vega'][n:])
+
+    def _status(self):
+        return [self.net_worth, self.balance, self.delta, self.gamma, self.vega]
+
+    def _held(self, key):
+        '''index in the book of every key, and whether it is held'''
+        book_keys = self.book['key']
+        index = np.minimum(np.searchsorted(book_keys, key), max(len(book_keys) - 1, 0))
+        found = book_keys[index] == key if len(book_keys) else np.zeros(len(key), dtype=bool)
+        return index, found
+
+    def _next_observation(self):
+        '''
+        the normalised market window and account history, as TradeEnv gives them, and the
+        chain's prices, Greeks and holdings relative to the underlying's price, flattened
+        '''
+        row = self.frame_start + self.current_step
+        OHCL = self.market_data[row - self.config.lookback_range:row + 1].T
+        if self.new_session:
+            OHCL = self.market_normaliser.reset(OHCL)
+            scaled_history = self.account_normaliser.reset(self.account_history.recent)
+            self.new_session = False
+        else:
+            OHCL = self.market_normaliser.step(OHCL)
+            scaled_history = self.account_normaliser.step(self.account_history.recent)
+
+        spot = self.current_price
+        chain = self.chain
+        index, found = self._held(chain['key'])
+        quantity = np.where(found, self.book['quantity'][index], 0) if len(self.book['key']) else 0
+        weight = quantity * chain['price'] * self.config.contract_size / max(self.net_worth, 1e-9)
+        # contracts that are not listed are all zeros
+        chain_features = np.stack([chain['price'] / spot, chain['delta'], chain['gamma'] * spot,
+                                   chain['vega'] / spot, chain['theta'] / spot, weight], axis=1)
+        return np.concatenate([OHCL.ravel(), scaled_history.ravel(), chain_features.ravel()])
+
+    def step(self, action):
+        '''
+        given the target weights, rebalance at the prices of the chain observed, then move
+        to the next timestep and mark the portfolio to market there
+        '''
+        self.prev_net_worth = self.net_worth
+        self._take_action(action)
+
+        self.current_step += 1
+        self.steps_left -= 1
+
+        # sell every contract and restart a trading session when the data is traversed
+        if self.steps_left == 0:
+            self._liquidate()
+            self._reset_session()
+
+        self._mark()
+        self.account_history.append(self._status())
+        reward = self.net_worth - self.prev_net_worth
+        done = self.net_worth <= 0 or self.steps_left == 0
+        obs = self._next_observation()
+        return obs, reward, done, {}
+
+    def _take_action(self, action):
+        '''
+        rebalance the chain towards the target weights, as PortfolioEnv does:
+            1. sell the contracts held above every target
+            2. buy the contracts missing below every target, scaled down to the cash left
+            3. merge the chain's positions into the book, averaging the cost of buys
+        input:
+            action:
+            an np.array of shape (num_contracts,) with the target weight of every contract
+            of the chain in [0, 1]; the weights of contracts that are not listed are ignored
+        '''
+        row = self.frame_start + self.current_step
+        book = self.book
+        size = self.config.contract_size
+        tran_cost = self.config.tran_cost
+
+        # the listed contracts, once each, with the weights given to every key summed, so
+        # a position is never matched (and sold) more than once
+        listed = self.chain['listed']
+        keys, first, inverse = np.unique(self.chain['key'][listed], return_index=True, return_inverse=True)
+        chain = {name: self.chain[name][listed][first] for name in ('key', 'strike', 'expiry', 'is_call', 'price')}
+        price = chain['price']
+        weights = np.clip(np.asarray(action, dtype=np.float64), 0, 1)[listed]
+        weights = np.bincount(inverse, weights, len(keys))
+        total_weight = weights.sum()
+        if total_weight > 1:
+            weights /= total_weight
+        # worthless contracts are not bought
+        tradable = price * size > 0.01
+        with np.errstate(divide='ignore', invalid='ignore'):
+            target = np.where(tradable, np.trunc(weights * self.net_worth / (price * size * (1 + tran_cost))), 0)
+
+        index, found = self._held(chain['key'])
+        held = np.zeros(len(keys))
+        avg_cost = np.zeros(len(keys))
+        if len(book['key']):
+            held = np.where(found, book['quantity'][index], 0)
+            avg_cost = np.where(found, book['avg_cost'][index], 0)
+
+        sold = np.maximum(held - target, 0)
+        sales = sold * price * size * (1 - tran_cost)
+        self.balance += float(sales.sum())
+
+        bought = np.maximum(target - held, 0)
+        buying_cost = bought * price * size * (1 + tran_cost)
+        total_cost = float(buying_cost.sum())
+        # the balance can be a rounding error below zero after buying with all of it
+        if total_cost > max(self.balance, 0):
+            bought = np.trunc(bought * (max(self.balance, 0) / total_cost))
+            buying_cost = bought * price * size * (1 + tran_cost)
+        self.balance -= float(buying_cost.sum())
+
+        traded = (sold > 0) | (bought > 0)
+        if not traded.any():
+            return
+        self._add_trades(row, 1, chain['key'][sold > 0], sold[sold > 0], sales[sold > 0], price[sold > 0])
+        self._add_trades(row, 0, chain['key'][bought > 0], bought[bought > 0], buying_cost[bought > 0],
+                         price[bought > 0])
+
+        # the traded contracts leave the book and come back with their new positions; sells
+        # keep the average cost, buys add theirs
+        quantity = held + bought - sold
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost = (held - sold) * avg_cost + buying_cost / size
+            avg_cost = np.where(quantity > 0, cost / quantity, 0)
+        keep = np.ones(len(book['key']), dtype=bool)
+        keep[index[found & traded]] = False
+        entering = traded & (quantity > 0)
+        new = {'key': chain['key'], 'strike': chain['strike'], 'expiry': chain['expiry'],
+               'is_call': chain['is_call'], 'quantity': quantity, 'avg_cost': avg_cost, 'mark': price}
+        merged = {name: np.concatenate([book[name][keep], new[name][entering]]) for name in book}
+        order = np.argsort(merged['key'], kind='stable')
+        self.book = {name: values[order] for name, values in merged.items()}
+
+    def _liquidate(self):
+        '''sell every contract held at its last mark'''
+        book = self.book
+        if len(book['key']) == 0:
+            return
+        row = self.frame_start + self.current_step - 1
+        sales = book['quantity'] * book['mark'] * self.config.contract_size * (1 - self.config.tran_cost)
+        self.balance += float(sales.sum())
+        self._add_trades(row, 1, book['key'], book['quantity'], sales, book['mark'])
+        self.book = {name: values[:0] for name, values in book.items()}
+
+    def _add_trades(self, step, side, keys, quantities, totals, prices):
+        '''record trades of one side; the asset of a trade is its contract key, see contract()'''
+        if len(keys) == 0:
+            return
+        self.trades.extend(TradeLedger.from_arrays(
+            np.full(len(keys), step), np.full(len(keys), side), quantities, totals,
+            prices if self.config.fill_price else None, asset_ids=keys))
+
+    def _render_to_file(self, filename='render.txt'):
+        profit = self.net_worth - self.config.init_bal
+
+        # the file stays open between steps and is closed with the env
+        if self.render_file is None or self.render_file.name != filename:
+            if self.render_file is not None:
+                self.render_file.close()
+            self.render_file = open(filename, 'a+')
+        file = self.render_file
+
+        file.write(f'Step: {self.current_step}\n')
+        file.write(f'Underlying: {self.current_price}\n')
+        file.write(f'Balance: {self.balance}\n')
+        file.write(f'Contracts held: {int(self.book["quantity"].sum())} in {len(self.book["key"])} series\n')
+        file.write(f'Delta: {self.delta} Gamma: {self.gamma} Vega: {self.vega}\n')
+        file.write(f'Net worth: {self.net_worth}\n')
+        file.write(f'Profit: {profit}\n\n')
+
+    def render(self, mode='file', **kwargs):
+        if mode == 'file':
+            self._render_to_file(kwargs.get('filename', 'render.txt'))
+
+    def close(self):
+        if self.render_file is not None:
+            self.render_file.close()
+            self.render_file = None
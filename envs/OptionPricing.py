@@ -0,0 +1,117 @@
+import numpy as np
+from scipy.special import ndtr
+
+SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def _pdf(x):
+    return np.exp(-0.5 * x * x) / SQRT_2PI
+
+
+def black_scholes(spot, strike, T, rate, vol, is_call, dividend=0.0):
+    '''
+    Black-Scholes prices and Greeks of European options, vectorised over all arguments,
+    which broadcast against each other; e.g. one spot and arrays of a whole chain.
+    input:
+        spot, strike:
+        prices of the underlying and strikes
+
+        T:
+        years to expiry; an option at or past expiry is worth its intrinsic value
+
+        rate, dividend:
+        continuously compounded risk-free rate and dividend yield
+
+        vol:
+        implied volatilities, e.g. from VolSurface.vol
+
+        is_call:
+        bools; calls where True, puts where False
+    returns a dict of arrays: price, delta, gamma, vega (per 1.00 of vol), theta (per year)
+    and rho (per 1.00 of rate)
+    '''
+    spot, strike, T, vol = np.broadcast_arrays(*[np.asarray(x, dtype=np.float64)
+                                                 for x in (spot, strike, T, vol)])
+    is_call = np.asarray(is_call, dtype=bool)
+    live = (T > 0) & (vol > 0)
+    # expired options are valued apart, so the formulas never divide by zero
+    T_ = np.where(live, T, 1.0)
+    vol_ = np.where(live, vol, 1.0)
+    sqrt_T = np.sqrt(T_)
+    d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * vol_ * vol_) * T_) / (vol_ * sqrt_T)
+    d2 = d1 - vol_ * sqrt_T
+    sign = np.where(is_call, 1.0, -1.0)
+    carry = np.exp(-dividend * T_)
+    discount = np.exp(-rate * T_)
+    N1 = ndtr(sign * d1)
+    N2 = ndtr(sign * d2)
+    pdf1 = _pdf(d1)
+
+    price = sign * (spot * carry * N1 - strike * discount * N2)
+    delta = sign * carry * N1
+    gamma = carry * pdf1 / (spot * vol_ * sqrt_T)
+    vega = spot * carry * pdf1 * sqrt_T
+    theta = (-spot * carry * pdf1 * vol_ / (2 * sqrt_T)
+             + sign * (dividend * spot * carry * N1 - rate * strike * discount * N2))
+    rho = sign * strike * T_ * discount * N2
+
+    intrinsic = np.maximum(sign * (spot - strike), 0)
+    in_the_money = sign * (spot - strike) > 0
+    return {'price': np.where(live, price, intrinsic),
+            'delta': np.where(live, delta, np.where(in_the_money, sign, 0.0)),
+            'gamma': np.where(live, gamma, 0.0),
+            'vega': np.where(live, vega, 0.0),
+            'theta': np.where(live, theta, 0.0),
+            'rho': np.where(live, rho, 0.0)}
+
+
+class VolSurface():
+    '''
+    Implied volatility surface on a grid of log moneyness, log(strike / spot), and years to
+    expiry. vol() interpolates bilinearly for whole arrays of options at once, and holds
+    the edge values outside the grid.
+    '''
+    def __init__(self, log_moneyness, tenors, vols):
+        '''
+        input:
+            log_moneyness, tenors:
+            increasing 1d arrays; the grid
+
+            vols:
+            an array of shape (len(log_moneyness), len(tenors)); implied vols at the grid points
+        '''
+        self.log_moneyness = np.asarray(log_moneyness, dtype=np.float64)
+        self.tenors = np.asarray(tenors, dtype=np.float64)
+        self.vols = np.asarray(vols, dtype=np.float64)
+        if len(self.log_moneyness) < 2 or len(self.tenors) < 2:
+            raise ValueError('a surface needs at least two grid points on each axis')
+        if self.vols.shape != (len(self.log_moneyness), len(self.tenors)):
+            raise ValueError('vols of shape {} do not match a grid of {} x {}'.format(
+                self.vols.shape, len(self.log_moneyness), len(self.tenors)))
+
+    @classmethod
+    def parametric(cls, atm_vol, skew=0.0, smile=0.0, term=0.0,
+                   log_moneyness=np.linspace(-0.5, 0.5, 21), tenors=np.linspace(0.0, 2.0, 25)):
+        '''
+        a surface atm_vol + skew * m + smile * m^2 + term * T over log moneyness m and years
+        T, floored at 1% vol
+        '''
+        m, T = np.meshgrid(log_moneyness, tenors, indexing='ij')
+        vols = np.maximum(atm_vol + skew * m + smile * m * m + term * T, 0.01)
+        return cls(log_moneyness, tenors, vols)
+
+    def vol(self, strike, spot, T):
+        '''implied vols of options with these strikes and years to expiry at spot'''
+        m = np.log(np.asarray(strike, dtype=np.float64) / spot)
+        i, wi = self._locate(self.log_moneyness, m)
+        j, wj = self._locate(self.tenors, np.asarray(T, dtype=np.float64))
+        v = self.vols
+        return ((1 - wi) * (1 - wj) * v[i, j] + wi * (1 - wj) * v[i + 1, j]
+                + (1 - wi) * wj * v[i, j + 1] + wi * wj * v[i + 1, j + 1])
+
+    @staticmethod
+    def _locate(grid, x):
+        '''index of the grid cell of every x and the weight of its upper edge'''
+        x = np.clip(x, grid[0], grid[-1])
+        i = np.clip(np.searchsorted(grid, x, side='right') - 1, 0, len(grid) - 2)
+        return i, (x - grid[i]) / (grid[i + 1] - grid[i])
@@ -0,0 +1,235 @@
+import gym
+from gym import spaces
+import numpy as np
+from envs.AccountHistory import AccountHistory
+from envs.Normaliser import get_normaliser
+from envs.MarketData import PortfolioData
+from envs.TradeLedger import TradeLedger
+from config import get_config
+
+
+class PortfolioEnv(gym.Env):
+    '''
+    Trading environment over a portfolio of K instruments that follows gym interface.
+
+    Holdings, cost basis and prices of the K instruments live in arrays of shape (K,), and
+    an action of K target weights is executed as one vectorised rebalance. Observations are
+    stacked windows of shape (K, features + num_portfolio_status, lookback_range + 1), sliced
+    from one (timesteps, K, features) array and normalised as a batch, so nothing loops over
+    the instruments and K in the hundreds stays practical.
+    '''
+    metadata = {'render.modes': ['file', 'none']}
+    render_file = None
+
+    def __init__(self, data, assetType, config=None):
+        '''
+        input:
+            data:
+            a dict of instrument name to pandas dataframe, a list of dataframes, or
+            PortfolioData; see PortfolioData.from_dfs
+
+            assetType:
+            a string; type of the assets, selects the config as for TradeEnv
+
+            config:
+            as for TradeEnv
+        '''
+        super(PortfolioEnv, self).__init__()
+        self.data = data if isinstance(data, PortfolioData) else PortfolioData.from_dfs(data)
+        # (timesteps, K, features); lookback windows of all instruments are views into it
+        self.market_data = self.data.features
+        # (timesteps, K) open and close prices used for trading
+        self.open_prices = self.data.open_prices
+        self.close_prices = self.data.close_prices
+        self.num_assets = self.data.num_assets
+        # random numbers for prices and sessions come from numpy's global state until seeded
+        self.np_random = np.random
+
+        self.assetType = assetType
+        self.config = config if config is not None else get_config(self.assetType)
+        self.market_normaliser = get_normaliser(self.config.normalisation)
+        self.account_normaliser = get_normaliser(self.config.normalisation)
+
+        # target weight of the net worth held in every instrument, the rest is kept as cash;
+        # weights summing to more than 1 are scaled down
+        self.action_space = spaces.Box(low=0, high=1, shape=(self.num_assets,), dtype=np.float16)
+        # market data and the portfolio status of every instrument (net worth, assets held,
+        # etc.) for the last lookback_range + 1 timesteps
+        self.observation_space = spaces.Box(low=0, high=1,
+                                            shape=(self.num_assets,
+                                                   self.market_data.shape[2] + self.config.num_portfolio_status,
+                                                   self.config.lookback_range+1),
+                                            dtype=np.float16)
+
+    def seed(self, seed=None):
+        '''give this env its own random state, e.g. one seed per worker process'''
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def reset(self):
+        '''
+        initialise or reset the portfolio: all cash, no holdings, and a new session
+        '''
+        self.balance = self.config.init_bal
+        self.net_worth = self.config.init_bal
+        self.assets_held = np.zeros(self.num_assets)
+        self.avg_cost = np.zeros(self.num_assets)
+        self.total_assets_sold = np.zeros(self.num_assets)
+        self.total_sales_value = np.zeros(self.num_assets)
+        self.current_price = np.zeros(self.num_assets)
+
+        self._reset_session()
+        # the status of all instruments, (K * num_portfolio_status) rows, one column per timestep
+        self.account_history = AccountHistory(self.num_assets * self.config.num_portfolio_status,
+                                              self.config.lookback_range + 1,
+                                              full_history=self.config.full_history)
+        self.account_history.reset(self._status())
+
+        self.trades = TradeLedger(fill_price=self.config.fill_price, asset_ids=True)
+        return self._next_observation()
+
+    def _reset_session(self):
+        '''as TradeEnv._reset_session'''
+        self.current_step = 0
+        if self.config.serial:
+            self.steps_left = len(self.market_data) - self.config.lookback_range - 1
+            self.frame_start = self.config.lookback_range
+        else:
+            self.steps_left = self.np_random.randint(int(len(self.market_data)/2), len(self.market_data))
+            self.frame_start = self.np_random.randint(
+                self.config.lookback_range, len(self.market_data) - self.steps_left)
+
+    def _status(self):
+        '''portfolio status of every instrument, shape (K, num_portfolio_status)'''
+        return np.stack([np.full(self.num_assets, self.net_worth),
+                         self.assets_held,
+                         self.avg_cost,
+                         self.total_assets_sold,
+                         self.total_sales_value], axis=1)
+
+    def _next_observation(self):
+        '''
+        the market windows of all instruments, normalised as one batch, with the scaled
+        portfolio status of every instrument appended
+        '''
+        start = self.frame_start - self.config.lookback_range + self.current_step
+        end = self.frame_start + self.current_step + 1
+        # (window, K, features) -> (K, features, window)
+        OHCL = self.market_data[start:end].transpose(1, 2, 0)
+        history = self.account_history.recent.reshape(self.num_assets, self.config.num_portfolio_status, -1)
+
+        OHCL = self.market_normaliser.transform(OHCL)
+        scaled_history = self.account_normaliser.transform(history)
+        return np.concatenate([OHCL, scaled_history], axis=1)
+
+    def step(self, action):
+        '''
+        given the target weights, rebalance and update rewards, observations, and whether
+        it's terminated, i.e. net worth not positive
+        '''
+        self._take_action(action)
+
+        self.current_step += 1
+        self.steps_left -= 1
+
+        reward = self.net_worth - self.prev_net_worth
+
+        # sell everything and restart a trading session when the data is traversed
+        if self.steps_left == 0:
+            self.balance += float(self.assets_held @ self.current_price)
+            self.assets_held[:] = 0
+            self._reset_session()
+
+        done = self.net_worth <= 0 or self.steps_left == 0
+        obs = self._next_observation()
+        return obs, reward, done, {}
+
+    def _take_action(self, action):
+        '''
+        rebalance towards the target weights for one time step:
+            1. draw the price of every instrument between its open and close
+            2. sell the whole units held above every target
+            3. buy the whole units missing below every target, scaled down to the cash left
+            4. update cost basis, totals sold, net worth and the account history
+        input:
+            action:
+            an np.array of shape (K,) with the target weight of every instrument in [0, 1]
+        '''
+        row = self.frame_start + self.current_step
+        price = self.np_random.uniform(self.open_prices[row], self.close_prices[row])
+        self.current_price = price
+        tran_cost = self.config.tran_cost
+
+        weights = np.clip(np.asarray(action, dtype=np.float64), 0, 1)
+        total_weight = weights.sum()
+        if total_weight > 1:
+            weights /= total_weight
+        net_worth = self.balance + float(self.assets_held @ price)
+        target = np.trunc(weights * net_worth / (price * (1 + tran_cost)))
+
+        assets_sold = np.maximum(self.assets_held - target, 0)
+        sales = assets_sold * price * (1 - tran_cost)
+        self.balance += float(sales.sum())
+        self.assets_held -= assets_sold
+        self.total_assets_sold += assets_sold
+        self.total_sales_value += sales
+
+        assets_bought = np.maximum(target - self.assets_held, 0)
+        buying_cost = assets_bought * price * (1 + tran_cost)
+        total_cost = float(buying_cost.sum())
+        if total_cost > self.balance:
+            assets_bought = np.trunc(assets_bought * (self.balance / total_cost))
+            buying_cost = assets_bought * price * (1 + tran_cost)
+        self.balance -= float(buying_cost.sum())
+        held = self.assets_held + assets_bought
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.avg_cost = np.where(held > 0, (self.avg_cost * self.assets_held + buying_cost) / held, 0)
+        self.assets_held = held
+
+        self._add_trades(row, assets_sold, sales, assets_bought, buying_cost, price)
+
+        self.prev_net_worth = self.net_worth
+        self.net_worth = self.balance + float(self.assets_held @ price)
+        self.account_history.append(self._status().ravel())
+
+    def _add_trades(self, step, assets_sold, sales, assets_bought, buying_cost, price):
+        '''record the sells, then the buys of a rebalance, in instrument order'''
+        sold = np.flatnonzero(assets_sold > 0)
+        bought = np.flatnonzero(assets_bought > 0)
+        if len(sold) == 0 and len(bought) == 0:
+            return
+        assets = np.concatenate([sold, bought])
+        self.trades.extend(TradeLedger.from_arrays(
+            np.full(len(assets), step),
+            np.concatenate([np.ones(len(sold)), np.zeros(len(bought))]),
+            np.concatenate([assets_sold[sold], assets_bought[bought]]),
+            np.concatenate([sales[sold], buying_cost[bought]]),
+            price[assets] if self.config.fill_price else None,
+            asset_ids=assets))
+
+    def _render_to_file(self, filename='render.txt'):
+        profit = self.net_worth - self.config.init_bal
+
+        # the file stays open between steps and is closed with the env
+        if self.render_file is None or self.render_file.name != filename:
+            if self.render_file is not None:
+                self.render_file.close()
+            self.render_file = open(filename, 'a+')
+        file = self.render_file
+
+        file.write(f'Step: {self.current_step}\n')
+        file.write(f'Balance: {self.balance}\n')
+        for name, held, cost in zip(self.data.names, self.assets_held, self.avg_cost):
+            if held > 0:
+                file.write(f'{name}: {held} held at avg cost {cost}\n')
+        file.write(f'Net worth: {self.net_worth}\n')
+        file.write(f'Profit: {profit}\n\n')
+
+    def render(self, mode='file', **kwargs):
+        if mode == 'file':
+            self._render_to_file(kwargs.get('filename', 'render.txt'))
+
+    def close(self):
+        if self.render_file is not None:
+            self.render_file.close()
+            self.render_file = None
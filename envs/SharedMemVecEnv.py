@@ -0,0 +1,121 @@
+import os
+import multiprocessing
+import numpy as np
+from stable_baselines.common.vec_env import VecEnv
+from envs.MarketData import MarketData, SharedMarketData
+from envs.SharedMemWorker import worker
+
+
+class SharedMemVecEnv(VecEnv):
+    '''
+    Vectorised TradeEnv over a pool of worker processes. The market data is copied once into
+    shared memory and every worker attaches to it read-only, so price memory stays the same
+    whatever the number of workers. Each worker runs a contiguous chunk of the envs and
+    receives one message per step for the whole chunk.
+    '''
+    def __init__(self, df, assetType, num_envs, num_workers=None, seed=None, start_method=None,
+                 config=None):
+        '''
+        input:
+            df, assetType, config:
+            as for TradeEnv
+
+            num_envs:
+            an int; total number of envs
+
+            num_workers:
+            an int or None; number of worker processes, all cores by default
+
+            seed:
+            an int or None; env i is seeded with seed + i, or randomly when None
+
+            start_method:
+            a string or None; multiprocessing start method, 'forkserver' where available
+        '''
+        data = df if isinstance(df, MarketData) else MarketData.from_df(df)
+        self.shared_data = SharedMarketData(data)
+        num_workers = min(num_workers or os.cpu_count(), num_envs)
+
+        if start_method is None:
+            forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver_available else 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            # the fork server imports the env once and every worker forks from it ready to run
+            ctx.set_forkserver_preload(['envs.SharedMemWorker'])
+
+        if seed is None:
+            seed = np.random.randint(2 ** 31 - num_envs)
+        # envs of each worker, as contiguous chunks of env indices
+        self.chunks = np.array_split(np.arange(num_envs), num_workers)
+        self.waiting = False
+        self.closed = False
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_workers)])
+        self.processes = []
+        for work_remote, remote, chunk in zip(self.work_remotes, self.remotes, self.chunks):
+            seeds = [seed + int(i) for i in chunk]
+            args = (work_remote, remote, self.shared_data.handle, assetType, seeds, config)
+            # daemon=True: if the main process crashes, we should not cause things to hang
+            process = ctx.Process(target=worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(('get_spaces', None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, num_envs, observation_space, action_space)
+
+    def step_async(self, actions):
+        for remote, chunk in zip(self.remotes, self.chunks):
+            remote.send(('step', actions[chunk[0]:chunk[-1] + 1]))
+        self.waiting = True
+
+    def step_wait(self):
+        results = [result for remote in self.remotes for result in remote.recv()]
+        self.waiting = False
+        obs, rews, dones, infos = zip(*results)
+        return np.stack(obs), np.stack(rews), np.stack(dones), infos
+
+    def seed(self, seed=None):
+        for remote, chunk in zip(self.remotes, self.chunks):
+            remote.send(('seed', [None if seed is None else seed + int(i) for i in chunk]))
+        return [s for remote in self.remotes for s in remote.recv()]
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        return np.stack([obs for remote in self.remotes for obs in remote.recv()])
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+        self.shared_data.unlink()
+        self.closed = True
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call_workers('get_attr', indices, attr_name)
+
+    def set_attr(self, attr_name, value, indices=None):
+        return self._call_workers('set_attr', indices, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call_workers('env_method', indices, method_name, method_args, method_kwargs)
+
+    def _call_workers(self, cmd, indices, *payload):
+        '''send cmd to the workers running the envs in indices, one message per worker'''
+        indices = set(self._get_indices(indices))
+        remotes = []
+        for remote, chunk in zip(self.remotes, self.chunks):
+            local = [i - chunk[0] for i in chunk if i in indices]
+            if local:
+                remote.send((cmd, (local,) + payload))
+                remotes.append(remote)
+        return [result for remote in remotes for result in remote.recv()]
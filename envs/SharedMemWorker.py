@@ -0,0 +1,57 @@
+######################################################################
+# Worker process of SharedMemVecEnv                                  #
+# Kept apart from SharedMemVecEnv so that workers import the env only#
+# and never stable-baselines, tensorflow or the renderers            #
+######################################################################
+
+from envs.MarketData import SharedMarketData
+from envs.TradeEnv import TradeEnv
+
+
+def worker(remote, parent_remote, handle, assetType, seeds, config):
+    '''
+    run one TradeEnv per seed on market data attached from shared memory, answering
+    batched messages for all of them at once
+    '''
+    parent_remote.close()
+    data = SharedMarketData.attach(handle)
+    envs = [TradeEnv(data, assetType, config=config) for _ in seeds]
+    for env, seed in zip(envs, seeds):
+        env.seed(seed)
+    try:
+        while True:
+            cmd, payload = remote.recv()
+            if cmd == 'step':
+                results = []
+                for env, action in zip(envs, payload):
+                    obs, reward, done, info = env.step(action)
+                    if done:
+                        # save final observation where user can get it, then reset
+                        info['terminal_observation'] = obs
+                        obs = env.reset()
+                    results.append((obs, reward, done, info))
+                remote.send(results)
+            elif cmd == 'reset':
+                remote.send([env.reset() for env in envs])
+            elif cmd == 'seed':
+                remote.send([env.seed(seed)[0] for env, seed in zip(envs, payload)])
+            elif cmd == 'get_spaces':
+                remote.send((envs[0].observation_space, envs[0].action_space))
+            elif cmd == 'get_attr':
+                indices, attr_name = payload
+                remote.send([getattr(envs[i], attr_name) for i in indices])
+            elif cmd == 'set_attr':
+                indices, attr_name, value = payload
+                remote.send([setattr(envs[i], attr_name, value) for i in indices])
+            elif cmd == 'env_method':
+                indices, method_name, args, kwargs = payload
+                remote.send([getattr(envs[i], method_name)(*args, **kwargs) for i in indices])
+            elif cmd == 'close':
+                for env in envs:
+                    env.close()
+                remote.close()
+                break
+            else:
+                raise NotImplementedError('unknown command: {}'.format(cmd))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+import sys
+import time
+from functools import wraps
+
+# phases of TradeEnv.step that are timed; step itself covers the whole call
+PHASES = ['step', '_take_action', '_get_reward', '_reset_session', '_next_observation']
+# latency histograms have one bucket per power of two nanoseconds
+NUM_BUCKETS = 40
+
+
+class PhaseStats():
+    '''calls, total time, log2 latency histogram and net allocated blocks of one phase'''
+    __slots__ = ['calls', 'total_ns', 'histogram', 'blocks', 'last_ns']
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.calls = 0
+        self.total_ns = 0
+        self.histogram = [0] * NUM_BUCKETS
+        self.blocks = 0
+        self.last_ns = 0
+
+    def percentile(self, q):
+        '''upper edge in ns of the histogram bucket holding the q-th percentile'''
+        target = q / 100 * self.calls
+        count = 0
+        for bucket, n in enumerate(self.histogram):
+            count += n
+            if n and count >= target:
+                return 2 ** bucket
+        return 0
+
+    def summary(self):
+        return {'calls': self.calls,
+                'total_s': self.total_ns / 1e9,
+                'mean_us': self.total_ns / self.calls / 1e3 if self.calls else 0,
+                'p50_us': self.percentile(50) / 1e3,
+                'p90_us': self.percentile(90) / 1e3,
+                'p99_us': self.percentile(99) / 1e3,
+                # net number of memory blocks the phase left allocated, per call
+                'blocks_per_call': self.blocks / self.calls if self.calls else 0,
+                # calls per bucket, bucket k holding calls of up to 2**k ns
+                'histogram': list(self.histogram)}
+
+
+class StepProfiler():
+    '''
+    Per-phase timings of one TradeEnv. While attached, the phase methods of the env are
+    shadowed by instance attributes that time them; detaching deletes those attributes,
+    so an env that is not profiled runs the plain methods without any overhead.
+
+    Phases are timed whoever calls them, e.g. _next_observation also from reset.
+    With allocations=True, allocations are counted as the change in sys.getallocatedblocks()
+    over a call; this walks the allocator's arenas and costs microseconds per call, so it
+    is off by default. With info=True, step adds the duration of every phase of that step, in seconds, to
+    info['profile'].
+    '''
+    def __init__(self, info=False, allocations=False):
+        self.info = info
+        self.allocations = allocations
+        self.stats = {phase: PhaseStats() for phase in PHASES}
+
+    def attach(self, env):
+        for phase in PHASES:
+            setattr(env, phase, self._wrap(phase, getattr(env, phase)))
+
+    def detach(self, env):
+        for phase in PHASES:
+            env.__dict__.pop(phase, None)
+
+    def _wrap(self, phase, method):
+        stats = self.stats[phase]
+        perf_counter_ns = time.perf_counter_ns
+        # a constant stands in for the block count when allocations are not counted
+        getallocatedblocks = sys.getallocatedblocks if self.allocations else int
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            if phase == 'step' and self.info:
+                for other in self.stats.values():
+                    other.last_ns = 0
+            blocks = getallocatedblocks()
+            start = perf_counter_ns()
+            result = method(*args, **kwargs)
+            elapsed = perf_counter_ns() - start
+            stats.blocks += getallocatedblocks() - blocks
+            stats.calls += 1
+            stats.total_ns += elapsed
+            stats.histogram[min(elapsed.bit_length(), NUM_BUCKETS - 1)] += 1
+            stats.last_ns = elapsed
+            if phase == 'step' and self.info:
+                result[3]['profile'] = self.last_step()
+            return result
+        return timed
+
+    def last_step(self):
+        '''duration in seconds of every phase in the last step; phases not run in it are left out'''
+        return {phase: stats.last_ns / 1e9 for phase, stats in self.stats.items() if stats.last_ns}
+
+    def summary(self):
+        return {phase: stats.summary() for phase, stats in self.stats.items()}
+
+    def reset(self):
+        for stats in self.stats.values():
+            stats.clear()
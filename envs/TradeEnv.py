@@ -1,18 +1,27 @@
 import gym
 from gym import spaces
 import numpy as np
-from sklearn import preprocessing
-from render.TradeGraph import TradeGraph
+from envs.AccountHistory import AccountHistory
+from envs.Normaliser import get_normaliser
+from envs.MarketData import MarketData
+from envs.TradeLedger import TradeLedger
+from envs.StepProfiler import StepProfiler
 from config import get_config
 
 
 class TradeEnv(gym.Env):
     '''Trading Environment that follows gym interface'''
-    metadata = {'render.modes': ['live', 'file', 'none']}
-    scaler = preprocessing.MinMaxScaler()
+    metadata = {'render.modes': ['live', 'headless', 'file', 'none']}
+    # portfolio and session fields captured by get_state; active_data is a view of the
+    # market data, so it is shared rather than copied
+    state_attrs = ['balance', 'net_worth', 'prev_net_worth', 'assets_held', 'avg_cost',
+                   'total_assets_sold', 'total_sales_value', 'current_price',
+                   'current_step', 'steps_left', 'frame_start', 'active_data']
     viewer = None
+    exporter = None
+    render_file = None
 
-    def __init__(self, df, assetType):
+    def __init__(self, df, assetType, store=None, agent_id=None, config=None):
         '''
         define action and observaton space as gym.spaces objects 
         input:
@@ -21,14 +30,42 @@ class TradeEnv(gym.Env):
             choose between 'stock', 'FX', 'option', 'bitcoin'
             
             df:
-            a pandas dataframe containing data 
+            a pandas dataframe containing data, or MarketData built from one
+
+            store:
+            a data.TradeStore.TradeStore or None; records every episode and trade in the
+            background
+
+            agent_id:
+            an int or None; AgentId the episodes are recorded under
+
+            config:
+            a config of assetType or None; get_config(assetType, **overrides) to change its
+            settings, the defaults of config.py when None
         '''
         super(TradeEnv, self).__init__()
-        self.df = df.dropna().reset_index()
+        self.data = df if isinstance(df, MarketData) else MarketData.from_df(df)
+        # market columns (excluding the index and date columns) as one contiguous float32 
+        # matrix of shape (timesteps, features); lookback windows are views into it
+        self.market_data = self.data.features
+        # open and close prices used for trading, kept at full precision
+        self.open_prices = self.data.open_prices
+        self.close_prices = self.data.close_prices
+        # random numbers for prices and sessions come from numpy's global state until seeded
+        self.np_random = np.random
 
         self.assetType = assetType
         
-        self.config = get_config(self.assetType) 
+        self.config = config if config is not None else get_config(self.assetType)
+        self.store = store
+        self.agent_id = agent_id
+        self.episode_id = None
+        # each env owns its normalisers, as rolling normalisers keep state between steps
+        self.market_normaliser = get_normaliser(self.config.normalisation)
+        self.account_normaliser = get_normaliser(self.config.normalisation)
+        self.profiler = None
+        if self.config.profile:
+            self.enable_profiling()
         
         # actions include buy, sell, or hold x% 
         self.action_space = spaces.Box(low=np.array([0, 0]), 
@@ -37,11 +74,21 @@ class TradeEnv(gym.Env):
         # observations include prices containing the open-high-low-close (OHLC) values for the last five days
         # and portfolio status (net worth, asset held, etc.) repeating for the number of days
         self.observation_space = spaces.Box(low=0, high=1, 
-                                            shape=(df.shape[1] - 1 + self.config.num_portfolio_status, 
+                                            shape=(self.market_data.shape[1] + self.config.num_portfolio_status, 
                                             self.config.lookback_range+1), 
                                             dtype=np.float16)
             
 
+    @property
+    def df(self):
+        # only needed for rendering; memory-mapped data loads it on first use
+        return self.data.df
+
+    def seed(self, seed=None):
+        '''give this env its own random state, e.g. one seed per worker process'''
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
     def reset(self):
         
         '''
@@ -50,6 +97,10 @@ class TradeEnv(gym.Env):
             intial timestep is randomly chosen within the data timeframe
         
         '''
+        # record the episode still running, if any
+        if self.store is not None and self.episode_id is not None:
+            self._end_episode()
+
         self.balance = self.config.init_bal
         self.net_worth = self.config.init_bal
         self.assets_held = 0
@@ -59,17 +110,62 @@ class TradeEnv(gym.Env):
 
         self._reset_session()
         # repeat these for the number of times same as lookback_range + 1
-        self.account_history = np.repeat([
-                [self.net_worth],
-                [self.assets_held],
-                [self.avg_cost],
-                [self.total_assets_sold],
-                [self.total_sales_value]
-            ], self.config.lookback_range + 1, axis=1)
-
-        self.trades = []
+        self.account_history = AccountHistory(self.config.num_portfolio_status, 
+                                              self.config.lookback_range + 1,
+                                              full_history=self.config.full_history)
+        self.account_history.reset([self.net_worth,
+                                    self.assets_held,
+                                    self.avg_cost,
+                                    self.total_assets_sold,
+                                    self.total_sales_value])
+
+        self.trades = TradeLedger(fill_price=self.config.fill_price)
+        if self.store is not None:
+            self._start_episode()
         return self._next_observation()
 
+    def get_state(self):
+        '''
+        a snapshot of the env to branch from with set_state: the portfolio and session
+        fields, the recent account history, the random state and the number of trades.
+        The market data and the trade ledger are shared, not copied, so a snapshot costs a
+        few small arrays; the ledger's recorded trades are never overwritten, see set_state.
+        Episodes recorded to a store are not part of the snapshot.
+        '''
+        return {'attrs': {name: getattr(self, name) for name in self.state_attrs if hasattr(self, name)},
+                'history': self.account_history.get_state(),
+                'random': self.np_random.get_state(),
+                'trades': self.trades,
+                'num_trades': len(self.trades)}
+
+    def set_state(self, state):
+        '''
+        return to a snapshot of get_state; trades recorded after it are dropped, and
+        the normalisers are reseeded with the next observation window. The restored ledger
+        is a view of the snapshot's first trades, which copies them on its first append,
+        so branches never write over the trades of another snapshot
+        '''
+        for name, value in state['attrs'].items():
+            setattr(self, name, value)
+        self.account_history.set_state(state['history'])
+        self.np_random.set_state(state['random'])
+        self.trades = state['trades'][:state['num_trades']]
+        # stateful normalisers give the same result from a fresh window
+        self.new_session = True
+
+    def _start_episode(self):
+        self.episode_id = self.store.new_episode_id()
+        self.episode_frame_start = self.frame_start
+        self.episode_steps = 0
+        self.episode_reward = 0
+
+    def _end_episode(self):
+        self.store.record_episode(self.episode_id, self.agent_id, self.assetType,
+                                  self.episode_steps, self.episode_frame_start,
+                                  self.config.init_bal, self.net_worth,
+                                  self.episode_reward, len(self.trades))
+        self.episode_id = None
+
     def _reset_session(self):
 
         '''
@@ -78,17 +174,19 @@ class TradeEnv(gym.Env):
         extracting the data from the whole dataframe  
         '''
         self.current_step = 0
+        # the next observation window does not follow on from the last one
+        self.new_session = True
         # traversing data in serial style 
         if self.config.serial: 
-            self.steps_left = len(self.df) - self.config.lookback_range - 1
+            self.steps_left = len(self.market_data) - self.config.lookback_range - 1
             self.frame_start = self.config.lookback_range
         # traversing data randomly
         else:
-            self.steps_left = np.random.randint(int(len(self.df)/2), len(self.df))
-            self.frame_start = np.random.randint(
-                self.config.lookback_range, len(self.df) - self.steps_left)
-        # extract active dataframe
-        self.active_df = self.df[self.frame_start -   
+            self.steps_left = self.np_random.randint(int(len(self.market_data)/2), len(self.market_data))
+            self.frame_start = self.np_random.randint(
+                self.config.lookback_range, len(self.market_data) - self.steps_left)
+        # view of the market data traversed in this session
+        self.active_data = self.market_data[self.frame_start -   
             self.config.lookback_range:self.frame_start + self.steps_left]
 
     def _next_observation(self):
@@ -100,19 +198,21 @@ class TradeEnv(gym.Env):
         '''
         start = self.current_step
         end = self.current_step + self.config.lookback_range + 1 
-        df = self.active_df
         
-        # excluding the first column which is date or time
-        OHCL = [df[df.columns[2]][start:end].values]
-        for col in df.columns[3:]:
-            OHCL = np.append(OHCL,[df[col][start:end].values],axis=0)
+        # transposed view of the window, shape (features, lookback_range + 1)
+        OHCL = self.active_data[start:end].T
         
-        # normalisation 
-        OHCL = self.scaler.fit_transform(OHCL)
-        scaled_history = self.scaler.fit_transform(self.account_history)
+        # normalisation, reseeding the normalisers at the start of a session
+        if self.new_session:
+            OHCL = self.market_normaliser.reset(OHCL)
+            scaled_history = self.account_normaliser.reset(self.account_history.recent)
+            self.new_session = False
+        else:
+            OHCL = self.market_normaliser.step(OHCL)
+            scaled_history = self.account_normaliser.step(self.account_history.recent)
         
         # append abservation from market data and account history in the same date range
-        obs = np.append(OHCL, scaled_history[:, -(self.config.lookback_range + 1):], axis=0)
+        obs = np.append(OHCL, scaled_history, axis=0)
         #print(obs)
         return obs
 
@@ -127,20 +227,7 @@ class TradeEnv(gym.Env):
         self.current_step += 1
         self.steps_left -= 1
 
-
-        # determination of rewards depends on the asset type
-        if self.assetType == 'stock':
-            # discount the account balance 
-            delay_modifier = (self.current_step / self.config.max_steps)
-            reward = self.balance * delay_modifier
-        elif self.assetType == 'bitcoin':
-            reward = self.net_worth - self.prev_net_worth
-        elif self.assetType == 'FX':
-            '''TODO'''
-            pass
-        elif self.assetType == 'option':
-            '''TODO'''
-            pass
+        reward = self._get_reward()
 
         # restart a trading session when the whole dataframe is traversed 
         if self.steps_left == 0:
@@ -150,11 +237,36 @@ class TradeEnv(gym.Env):
         
         # terminate when net worh is below 0 or timestep exceeds timeframe
         done = self.net_worth <= 0 or self.steps_left == 0
+        if self.store is not None and self.episode_id is not None:
+            self.episode_steps += 1
+            # FX has no reward yet
+            if reward is not None:
+                self.episode_reward += reward
+            if done:
+                self._end_episode()
+
         # load observations 
         obs = self._next_observation()
         return obs, reward, done, {}
     
 
+    def _get_reward(self):
+        '''reward of the step just taken'''
+        # determination of rewards depends on the asset type
+        if self.assetType == 'stock':
+            # discount the account balance 
+            delay_modifier = (self.current_step / self.config.max_steps)
+            return self.balance * delay_modifier
+        elif self.assetType == 'bitcoin':
+            return self.net_worth - self.prev_net_worth
+        elif self.assetType == 'FX':
+            '''TODO'''
+            pass
+        elif self.assetType == 'option':
+            # options are traded by envs.OptionEnv.OptionEnv, whose reward is the same
+            return self.net_worth - self.prev_net_worth
+
+
     def _take_action(self, action):
         '''
         execute a given action for one time step within the environment 
@@ -167,27 +279,48 @@ class TradeEnv(gym.Env):
         '''
         
         # set the current price to be a random price between open and close price within the timestep
-        self.current_price = np.random.uniform(
-            self.df.loc[self.current_step, "Open"],
-            self.df.loc[self.current_step, "Close"])
-        
-        action_type = action[0] 
+        self.current_price = self.np_random.uniform(
+            self.open_prices[self.current_step],
+            self.close_prices[self.current_step])
+        self._trade(action)
+
+    def _trade(self, action):
+        '''
+        execute a given action at the current price, and update net worth and account history;
+        see _take_action
+        '''
+        side, assets = self._order(action)
+        self._fill(side, assets)
+
+    def _order(self, action):
+        '''
+        the side ('buy', 'sell', or None to hold) and number of assets of a given action at the
+        current price:
+            buy x% of the total possible number of assets from the current balance
+            sell x% of the assets held
+        '''
+        action_type = action[0]
         amount = action[1]
-        
         if action_type < 1:
+            total_possible = int(self.balance / self.current_price)
+            return 'buy', int(total_possible * amount)
+        elif action_type < 2:
+            return 'sell', self.assets_held * amount
+        return None, 0
+
+    def _fill(self, side, assets):
+        '''
+        book a trade of assets at the current price, and update net worth and account history
+        '''
+        if side == 'buy':
             '''
-            buy x% of balance in assets:
-            1. calculate total possible number of assets from the current balance and current price
-            2. buy x% of the total possible number of assets
-            3. calculate cost of buying the assets
-            4. update balance with buying cost
-            5. update previous average buying cost with the new buying cost 
-            6. update number of assets held 
-            
+            buy assets:
+            1. calculate cost of buying the assets
+            2. update balance with buying cost
+            3. update previous average buying cost with the new buying cost
+            4. update number of assets held
             '''
-           
-            total_possible = int(self.balance / self.current_price) 
-            assets_bought = int(total_possible * amount)
+            assets_bought = assets
             buying_cost = assets_bought * self.current_price * (1 + self.config.tran_cost)
             self.balance -= buying_cost
             
@@ -196,21 +329,19 @@ class TradeEnv(gym.Env):
             self.assets_held += assets_bought
             
             if assets_bought > 0:
-                self.trades.append({'step': self.frame_start + self.current_step,
-                                    'assets': assets_bought, 'total': buying_cost,
-                                    'type': "buy"})
+                self._add_trade(self.frame_start + self.current_step, "buy",
+                                assets_bought, buying_cost)
         
-        elif action_type < 2:
+        elif side == 'sell':
             '''
-            sell x% of assets held:
-            1. sell x% of the total number of assets held
-            2. update balance with selling revenue
-            3. update number of assets held 
-            4. update total number of assets sold  
-            5. update total value of share sold
+            sell assets:
+            1. update balance with selling revenue
+            2. update number of assets held 
+            3. update total number of assets sold  
+            4. update total value of share sold
             '''
 
-            assets_sold = self.assets_held * amount 
+            assets_sold = assets
             sales = assets_sold * self.current_price * (1 - self.config.tran_cost)
 
             self.balance += sales
@@ -219,28 +350,59 @@ class TradeEnv(gym.Env):
             self.total_sales_value += sales
             
             if assets_sold > 0:
-                self.trades.append({'step': self.frame_start + self.current_step,
-                                    'assets': assets_sold, 'total': sales,
-                                    'type': "sell"})
+                self._add_trade(self.frame_start + self.current_step, "sell",
+                                assets_sold, sales)
         
         
         # update portfolio net worth 
         self.prev_net_worth = self.net_worth
         self.net_worth = self.balance + self.assets_held * self.current_price
         # update account hisotry 
-        self.account_history = np.append(self.account_history,
-                                        [[self.net_worth],
-                                        [self.assets_held],
-                                        [self.avg_cost],
-                                        [self.total_assets_sold],
-                                        [self.total_sales_value]], axis = 1)
+        self.account_history.append([self.net_worth,
+                                     self.assets_held,
+                                     self.avg_cost,
+                                     self.total_assets_sold,
+                                     self.total_sales_value])
       
             
+    def _add_trade(self, step, side, assets, total):
+        self.trades.append(step, side, assets, total, price=self.current_price)
+        if self.store is not None:
+            self.store.record_trade(self.episode_id, self.trades[-1])
+
+    def enable_profiling(self, info=False, allocations=False):
+        '''
+        start timing the phases of step, see envs/StepProfiler.py; with info=True the
+        phase durations of every step are also returned in info['profile'], and with
+        allocations=True the memory blocks allocated by every phase are counted too
+        '''
+        self.disable_profiling()
+        self.profiler = StepProfiler(info=info, allocations=allocations)
+        self.profiler.attach(self)
+
+    def disable_profiling(self):
+        if self.profiler is not None:
+            self.profiler.detach(self)
+            self.profiler = None
+
+    def get_stats(self):
+        '''per phase timings and allocations since profiling was enabled or the stats reset'''
+        return self.profiler.summary() if self.profiler is not None else {}
+
+    def reset_stats(self):
+        if self.profiler is not None:
+            self.profiler.reset()
+
     def _render_to_file(self, filename = 'render.txt'):
         # Render the environment to the screen
         profit = self.net_worth - self.config.init_bal
         
-        file = open(filename, 'a+')
+        # the file stays open between steps and is closed with the env
+        if self.render_file is None or self.render_file.name != filename:
+            if self.render_file is not None:
+                self.render_file.close()
+            self.render_file = open(filename, 'a+')
+        file = self.render_file
              
         file.write(f'Step: {self.current_step}\n')    
         file.write(f'Balance: {self.balance}\n')      
@@ -249,8 +411,6 @@ class TradeEnv(gym.Env):
         file.write(f'Net worth: {self.net_worth}\n')
         file.write(f'Profit: {profit}\n\n')
         
-        file.close()
-        
         
         
     def render(self, mode='live', title=None, **kwargs):
@@ -258,13 +418,34 @@ class TradeEnv(gym.Env):
             self._render_to_file(kwargs.get('filename', 'render.txt'))
         elif mode == 'live':
             if self.viewer == None:
-                self.viewer = TradeGraph(self.df, title)
+                # imported on first use, so that envs which never render need no matplotlib
+                from render.TradeGraph import TradeGraph
+                self.viewer = TradeGraph(self.df, title, render_every=kwargs.get('render_every', 1))
                 
             if self.current_step > self.config.lookback_range:
                 self.viewer.render(self.current_step + self.frame_start, self.net_worth, 
                                           self.trades, window_size=self.config.lookback_range)
+        elif mode == 'headless':
+            # frames are drawn and encoded by a worker process, see render/FrameExporter.py
+            if self.exporter is None:
+                from render.FrameExporter import FrameExporter
+                self.exporter = FrameExporter(self.df, kwargs.get('path', 'render.mp4'), title,
+                                              fps=kwargs.get('fps', 30),
+                                              render_every=kwargs.get('render_every', 1),
+                                              window_size=self.config.lookback_range)
+
+            if self.current_step > self.config.lookback_range:
+                self.exporter.submit(self.current_step + self.frame_start, self.net_worth, self.trades)
                 
     def close(self):
+        if self.store is not None and self.episode_id is not None:
+            self._end_episode()
         if self.viewer != None:
             self.viewer.close()
             self.viewer = None
+        if self.exporter is not None:
+            self.exporter.close()
+            self.exporter = None
+        if self.render_file is not None:
+            self.render_file.close()
+            self.render_file = None
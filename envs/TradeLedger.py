@@ -0,0 +1,213 @@
+import numpy as np
+
+# codes of the side column
+SIDES = ('buy', 'sell')
+
+
+class TradeLedger():
+    '''
+    Columnar record of the trades of an episode, in preallocated numpy arrays that double
+    in size when full, so appends are amortised O(1) and a trade costs 25 bytes (33 with
+    fill prices) instead of a dict.
+
+    Trades are usually appended in step order, and between() finds the trades of a range of
+    steps by binary search. Steps go back when a session restarts within an episode: the
+    ledger keeps where each run of trades in step order starts, and the runs before the
+    last are searched in a stable sort of their steps, built when between() first needs
+    it after a restart, so a search costs the same however many runs there are. Indexing with an int gives a trade as a dict
+    with step, type, assets and total (and price and asset), as TradeEnv used to record
+    them; slicing gives ledgers that share the arrays, as does between() when its trades are
+    all in one run.
+
+    input:
+        capacity:
+        an int; number of trades allocated up front
+
+        fill_price:
+        a bool; also record the price every trade was filled at
+
+        asset_ids:
+        a bool; also record the index of the asset traded (or the contract key, see
+        OptionEnv.contract), for envs that trade several
+    '''
+    def __init__(self, capacity=1024, fill_price=False, asset_ids=False):
+        self.fill_price = fill_price
+        self.asset_ids = asset_ids
+        self.size = 0
+        # index of the first trade of every run of steps that never decrease
+        self._runs = [0]
+        self._reset_index()
+        self._columns = {'step': np.empty(capacity, dtype=np.int64),
+                         'side': np.empty(capacity, dtype=np.int8),
+                         'assets': np.empty(capacity, dtype=np.float64),
+                         'total': np.empty(capacity, dtype=np.float64)}
+        if fill_price:
+            self._columns['price'] = np.empty(capacity, dtype=np.float64)
+        if asset_ids:
+            self._columns['asset'] = np.empty(capacity, dtype=np.int64)
+
+    @classmethod
+    def _from_columns(cls, columns, runs=None):
+        ledger = cls.__new__(cls)
+        ledger.fill_price = 'price' in columns
+        ledger.asset_ids = 'asset' in columns
+        ledger.size = len(columns['step'])
+        ledger._columns = columns
+        if runs is None:
+            runs = [0] + (np.flatnonzero(np.diff(columns['step']) < 0) + 1).tolist()
+        ledger._runs = runs
+        ledger._reset_index()
+        return ledger
+
+    def _reset_index(self):
+        # the trades before `_indexed` in step order, and their steps
+        self._indexed = 0
+        self._order = np.empty(0, dtype=np.int64)
+        self._sorted_steps = np.empty(0, dtype=np.int64)
+
+    @property
+    def in_order(self):
+        '''whether the steps recorded never decrease'''
+        return len(self._runs) == 1
+
+    @classmethod
+    def from_arrays(cls, steps, sides, assets, totals, prices=None, asset_ids=None):
+        '''ledger of trades already in arrays, sides as codes of SIDES; prices and asset_ids are optional'''
+        columns = {'step': np.asarray(steps, dtype=np.int64),
+                   'side': np.asarray(sides, dtype=np.int8),
+                   'assets': np.asarray(assets, dtype=np.float64),
+                   'total': np.asarray(totals, dtype=np.float64)}
+        if prices is not None:
+            columns['price'] = np.asarray(prices, dtype=np.float64)
+        if asset_ids is not None:
+            columns['asset'] = np.asarray(asset_ids, dtype=np.int64)
+        return cls._from_columns(columns)
+
+    def append(self, step, side, assets, total, price=None, asset_id=None):
+        '''record a trade; side is 'buy' or 'sell' '''
+        if self.size == len(self._columns['step']):
+            self._grow(max(2 * self.size, 16))
+        i = self.size
+        columns = self._columns
+        if i and step < columns['step'][i - 1]:
+            self._runs.append(i)
+        columns['step'][i] = step
+        columns['side'][i] = SIDES.index(side)
+        columns['assets'][i] = assets
+        columns['total'][i] = total
+        if self.fill_price:
+            columns['price'][i] = price
+        if self.asset_ids:
+            columns['asset'][i] = asset_id
+        self.size += 1
+
+    def extend(self, other):
+        '''append all the trades of another ledger'''
+        if len(other) == 0:
+            return
+        if self.size + len(other) > len(self._columns['step']):
+            self._grow(max(2 * self.size, self.size + len(other), 16))
+        runs = [self.size + start for start in other._runs]
+        if self.size and other._columns['step'][0] >= self._columns['step'][self.size - 1]:
+            # carries on the last run
+            runs = runs[1:]
+        self._runs = self._runs + runs
+        for name, values in self._columns.items():
+            values[self.size:self.size + len(other)] = other._columns[name][:len(other)]
+        self.size += len(other)
+
+    def _grow(self, capacity):
+        # views handed out before keep the old arrays, which still hold their trades
+        for name, values in self._columns.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self._columns[name] = grown
+
+    def __len__(self):
+        return self.size
+
+    def column(self, name):
+        '''the recorded values of a column, as a view: step, side (codes of SIDES), assets, total, price or asset'''
+        return self._columns[name][:self.size]
+
+    @property
+    def steps(self):
+        return self.column('step')
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            runs = None
+            if key.step is None or key.step == 1:
+                # the runs that start inside a contiguous slice, shifted to it
+                start, stop, _ = key.indices(self.size)
+                runs = [0] + [run - start for run in self._runs if start < run < stop]
+            return self._from_columns({name: values[:self.size][key]
+                                       for name, values in self._columns.items()}, runs)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('trade index out of range')
+        columns = self._columns
+        trade = {'step': int(columns['step'][key]),
+                 'type': SIDES[columns['side'][key]],
+                 'assets': float(columns['assets'][key]),
+                 'total': float(columns['total'][key])}
+        if self.fill_price:
+            trade['price'] = float(columns['price'][key])
+        if self.asset_ids:
+            trade['asset'] = int(columns['asset'][key])
+        return trade
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self[i]
+
+    def between(self, start, stop):
+        '''trades with start <= step < stop, in the order they were recorded'''
+        index = self._between(start, stop)
+        if isinstance(index, slice):
+            return self[index]
+        return self._from_columns({name: values[:self.size][index]
+                                   for name, values in self._columns.items()})
+
+    def index_between(self, start, stop):
+        '''indices of the trades with start <= step < stop, in the order they were recorded'''
+        index = self._between(start, stop)
+        if isinstance(index, slice):
+            return np.arange(index.start, index.stop)
+        return index
+
+    def _between(self, start, stop):
+        # a slice when the trades are all in the last run, otherwise an array of indices
+        steps = self.steps
+        last = self._runs[-1]
+        lo, hi = last + np.searchsorted(steps[last:], start), last + np.searchsorted(steps[last:], stop)
+        if last == 0:
+            return slice(lo, hi)
+        if self._indexed != last:
+            # index every run but the last; it only grows when a session restarts
+            self._order = np.argsort(steps[:last], kind='stable')
+            self._sorted_steps = steps[:last][self._order]
+            self._indexed = last
+        earlier = self._order[np.searchsorted(self._sorted_steps, start):
+                              np.searchsorted(self._sorted_steps, stop)]
+        if len(earlier) == 0:
+            return slice(lo, hi)
+        return np.concatenate([np.sort(earlier), np.arange(lo, hi)])
+
+    def to_pandas(self):
+        '''
+        the trades as a DataFrame; the numeric columns are views of the ledger's arrays,
+        and side is a categorical of buy and sell
+        '''
+        import pandas as pd
+        columns = {name: self.column(name) for name in self._columns}
+        columns['side'] = pd.Categorical.from_codes(columns['side'], SIDES)
+        return pd.DataFrame(columns, copy=False)
+
+    def to_arrow(self):
+        '''the trades as a pyarrow Table sharing the ledger's buffers; side is dictionary encoded'''
+        import pyarrow as pa
+        columns = {name: pa.array(self.column(name)) for name in self._columns}
+        columns['side'] = pa.DictionaryArray.from_arrays(columns['side'], list(SIDES))
+        return pa.table(columns)
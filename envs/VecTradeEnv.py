@@ -0,0 +1,227 @@
+import numpy as np
+from gym import spaces
+from stable_baselines.common.vec_env import VecEnv
+from envs.Normaliser import get_normaliser
+from envs.MarketData import MarketData
+from config import get_config
+
+
+class VecTradeEnv(VecEnv):
+    '''
+    Batched trading environment that runs num_envs independent sessions of TradeEnv over
+    one shared price matrix. The portfolio of every session lives in arrays of shape
+    (num_envs,), and the buy/sell/hold logic and rewards of TradeEnv are applied to all
+    sessions at once with array operations, so the cost of a step barely grows with num_envs.
+    '''
+    # per-session state, exposed through get_attr/set_attr
+    state_attrs = ['balance', 'net_worth', 'prev_net_worth', 'assets_held', 'avg_cost',
+                   'total_assets_sold', 'total_sales_value', 'current_price',
+                   'current_step', 'steps_left', 'frame_start']
+
+    def __init__(self, df, assetType, num_envs, seed=None, config=None):
+        '''
+        input:
+            df, assetType, config:
+            as for TradeEnv
+
+            num_envs:
+            an int; number of trading sessions stepped together
+
+            seed:
+            an int or None; seed of the random numbers drawn for prices and sessions
+        '''
+        self.data = df if isinstance(df, MarketData) else MarketData.from_df(df)
+        # market columns as a contiguous (timesteps, features) matrix shared by all sessions
+        self.market_data = self.data.features
+        self.open_prices = self.data.open_prices
+        self.close_prices = self.data.close_prices
+
+        self.assetType = assetType
+        self.config = config if config is not None else get_config(self.assetType)
+        self.market_normaliser = get_normaliser(self.config.normalisation)
+        self.account_normaliser = get_normaliser(self.config.normalisation)
+        self.seed(seed)
+
+        action_space = spaces.Box(low=np.array([0, 0]),
+                                  high=np.array([3, 1]),
+                                  dtype=np.float16)
+        observation_space = spaces.Box(low=0, high=1,
+                                       shape=(self.market_data.shape[1] + self.config.num_portfolio_status,
+                                       self.config.lookback_range+1),
+                                       dtype=np.float16)
+        super(VecTradeEnv, self).__init__(num_envs, observation_space, action_space)
+
+        window = self.config.lookback_range + 1
+        self._window_offsets = np.arange(window)
+        # account history of every session in a ring buffer that writes each column twice,
+        # shape (num_envs, num_portfolio_status, 2 * window); all sessions step in lockstep
+        # so they share one write position
+        self._history = np.zeros((num_envs, self.config.num_portfolio_status, 2 * window))
+        self._history_size = window
+        for attr in self.state_attrs:
+            setattr(self, attr, np.zeros(num_envs))
+        self.actions = None
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+        return [seed] * getattr(self, 'num_envs', 1)
+
+    def reset(self):
+        '''reset every session; returns observations of shape (num_envs, features, window)'''
+        self._reset_envs(np.arange(self.num_envs))
+        return self._next_observation()
+
+    def _reset_envs(self, envs):
+        '''reset the portfolio, session and account history of the sessions indexed by envs'''
+        self.balance[envs] = self.config.init_bal
+        self.net_worth[envs] = self.config.init_bal
+        self.assets_held[envs] = 0
+        self.avg_cost[envs] = 0
+        self.total_assets_sold[envs] = 0
+        self.total_sales_value[envs] = 0
+        self._reset_sessions(envs)
+
+        self._history[envs] = np.stack([self.net_worth[envs],
+                                        self.assets_held[envs],
+                                        self.avg_cost[envs],
+                                        self.total_assets_sold[envs],
+                                        self.total_sales_value[envs]], axis=1)[:, :, None]
+
+    def _reset_sessions(self, envs):
+        '''as TradeEnv._reset_session, for the sessions indexed by envs'''
+        self.current_step[envs] = 0
+        if self.config.serial:
+            self.steps_left[envs] = len(self.market_data) - self.config.lookback_range - 1
+            self.frame_start[envs] = self.config.lookback_range
+        else:
+            steps_left = self.np_random.randint(int(len(self.market_data)/2), len(self.market_data), size=len(envs))
+            self.steps_left[envs] = steps_left
+            self.frame_start[envs] = self.np_random.randint(
+                self.config.lookback_range, len(self.market_data) - steps_left)
+
+    def _next_observation(self, envs=slice(None)):
+        '''gather the market window of the sessions and append their scaled account history'''
+        rows = (self.frame_start[envs] - self.config.lookback_range + self.current_step[envs]).astype(np.int64)
+        # (num_envs, window, features) -> (num_envs, features, window)
+        OHCL = self.market_data[rows[:, None] + self._window_offsets].transpose(0, 2, 1)
+
+        window = self.config.lookback_range + 1
+        i = self._history_size % window
+        history = self._history[envs, :, i:i + window]
+
+        OHCL = self.market_normaliser.transform(OHCL)
+        scaled_history = self.account_normaliser.transform(history)
+        return np.append(OHCL, scaled_history, axis=1)
+
+    def step_async(self, actions):
+        self.actions = actions
+
+    def step_wait(self):
+        '''
+        step every session with its action; sessions that are done are reset and the
+        observation they ended with is returned in info['terminal_observation']
+        '''
+        self._take_action(np.asarray(self.actions, dtype=np.float64))
+
+        self.current_step += 1
+        self.steps_left -= 1
+
+        if self.assetType == 'stock':
+            delay_modifier = (self.current_step / self.config.max_steps)
+            rewards = self.balance * delay_modifier
+        elif self.assetType == 'bitcoin':
+            rewards = self.net_worth - self.prev_net_worth
+        elif self.assetType == 'option':
+            rewards = self.net_worth - self.prev_net_worth
+        else:
+            # FX has no reward yet, as in TradeEnv
+            rewards = np.zeros(self.num_envs)
+
+        # restart trading sessions that have traversed the whole dataframe
+        ended = np.flatnonzero(self.steps_left == 0)
+        if len(ended) > 0:
+            self.balance[ended] += self.assets_held[ended] * self.current_price[ended]
+            self.assets_held[ended] = 0
+            self._reset_sessions(ended)
+
+        dones = (self.net_worth <= 0) | (self.steps_left == 0)
+        obs = self._next_observation()
+        infos = [{} for _ in range(self.num_envs)]
+
+        done_envs = np.flatnonzero(dones)
+        if len(done_envs) > 0:
+            for env in done_envs:
+                infos[env]['terminal_observation'] = obs[env].copy()
+            self._reset_envs(done_envs)
+            obs[done_envs] = self._next_observation(done_envs)
+
+        return obs, rewards, dones, infos
+
+    def _take_action(self, actions):
+        '''
+        execute the actions of shape (num_envs, 2) for one time step, with the same
+        buy/sell/hold rules as TradeEnv._take_action
+        '''
+        steps = self.current_step.astype(np.int64)
+        self.current_price = self.np_random.uniform(self.open_prices[steps], self.close_prices[steps])
+        price = self.current_price
+
+        action_type = actions[:, 0]
+        amount = actions[:, 1]
+        buy = action_type < 1
+        sell = (action_type >= 1) & (action_type < 2)
+
+        # buy x% of balance in assets
+        total_possible = np.trunc(self.balance / price)
+        assets_bought = np.where(buy, np.trunc(total_possible * amount), 0)
+        buying_cost = assets_bought * price * (1 + self.config.tran_cost)
+        self.balance -= buying_cost
+
+        prev_cost = self.avg_cost * self.assets_held
+        held = self.assets_held + assets_bought
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_avg_cost = np.where(held > 0, (prev_cost + buying_cost) / held, 0)
+        self.avg_cost = np.where(buy, new_avg_cost, self.avg_cost)
+        self.assets_held = held
+
+        # sell x% of assets held
+        assets_sold = np.where(sell, self.assets_held * amount, 0)
+        sales = assets_sold * price * (1 - self.config.tran_cost)
+        self.balance += sales
+        self.assets_held -= assets_sold
+        self.total_assets_sold += assets_sold
+        self.total_sales_value += sales
+
+        # update portfolio net worth
+        self.prev_net_worth = self.net_worth
+        self.net_worth = self.balance + self.assets_held * price
+
+        # update account history
+        window = self.config.lookback_range + 1
+        i = self._history_size % window
+        status = np.stack([self.net_worth,
+                           self.assets_held,
+                           self.avg_cost,
+                           self.total_assets_sold,
+                           self.total_sales_value], axis=1)
+        self._history[:, :, i] = status
+        self._history[:, :, i + window] = status
+        self._history_size += 1
+
+    def close(self):
+        pass
+
+    def get_attr(self, attr_name, indices=None):
+        indices = self._get_indices(indices)
+        if attr_name in self.state_attrs:
+            return [getattr(self, attr_name)[i] for i in indices]
+        return [getattr(self, attr_name) for _ in indices]
+
+    def set_attr(self, attr_name, value, indices=None):
+        indices = self._get_indices(indices)
+        if attr_name not in self.state_attrs:
+            raise AttributeError('{} is not a per-session attribute'.format(attr_name))
+        getattr(self, attr_name)[list(indices)] = value
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        raise NotImplementedError('sessions of VecTradeEnv have no env objects to call')
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def max_drawdown(net_worths):
+    '''largest fall of net worth from its running peak, as a fraction of the peak'''
+    net_worths = np.asarray(net_worths, dtype=np.float64)
+    peaks = np.maximum.accumulate(net_worths)
+    return float(np.max(1 - net_worths / peaks)) if len(net_worths) else 0.0
+
+
+def episode_metrics(env, net_worths):
+    '''metrics of an episode of env, given its net worth before the first step and after every step'''
+    init_bal = env.config.init_bal
+    return {'return': net_worths[-1] / init_bal - 1,
+            'max_drawdown': max_drawdown(net_worths),
+            'trades': len(env.trades),
+            'steps': len(net_worths) - 1,
+            'final_net_worth': net_worths[-1]}
+
+
+class LockstepEvaluator():
+    '''
+    Runs one evaluation episode on each of K TradeEnvs in lockstep: the observations of all
+    unfinished episodes are stacked into one batch, and the policy is queried once per step
+    for the whole batch instead of once per env, so the fixed cost of a predict call is
+    shared by the K episodes.
+
+    An episode ends when its env is done, after one pass through its session (the test
+    data in serial mode) or after max_steps. The observations of the unfinished episodes are
+    kept packed at the front of one buffer: a finished episode swaps places with the last
+    unfinished one, so a batch never has to be gathered.
+    '''
+    def __init__(self, model, envs, deterministic=True, max_steps=None):
+        '''
+        input:
+            model:
+            a stable-baselines model, or anything with predict(observations, deterministic)
+
+            envs:
+            a list of TradeEnvs, e.g. the same test data with K seeds
+        '''
+        self.model = model
+        self.envs = envs
+        self.deterministic = deterministic
+        self.max_steps = max_steps
+
+    def run(self):
+        '''play one episode on every env; returns their metrics, in the order of envs'''
+        first = [env.reset() for env in self.envs]
+        obs = np.empty((len(self.envs),) + first[0].shape, dtype=first[0].dtype)
+        obs[:] = first
+        # order[j] is the env whose observation is in obs[j]; the first `active` are running
+        order = np.arange(len(self.envs))
+        active = len(self.envs)
+        limits = [env.steps_left if self.max_steps is None else min(env.steps_left, self.max_steps)
+                  for env in self.envs]
+        net_worths = [[env.net_worth] for env in self.envs]
+
+        while active > 0:
+            actions, _states = self.model.predict(obs[:active], deterministic=self.deterministic)
+            # backwards, so that swapping a finished episode to the end skips nothing
+            for j in range(active - 1, -1, -1):
+                i = order[j]
+                env = self.envs[i]
+                obs[j], reward, done, info = env.step(actions[j])
+                net_worths[i].append(env.net_worth)
+                if done or len(net_worths[i]) > limits[i]:
+                    active -= 1
+                    if j != active:
+                        obs[[j, active]] = obs[[active, j]]
+                        order[[j, active]] = order[[active, j]]
+
+        return [episode_metrics(env, worths) for env, worths in zip(self.envs, net_worths)]
@@ -0,0 +1,36 @@
+import tensorflow as tf
+from stable_baselines.common.callbacks import BaseCallback
+
+
+class ProfilingCallback(BaseCallback):
+    '''
+    writes the phase timings of the training envs (TradeEnv.get_stats, averaged over the
+    envs) to tensorboard next to PPO2's own scalars, every `every` timesteps
+    '''
+    def __init__(self, every=1000, verbose=0):
+        super(ProfilingCallback, self).__init__(verbose)
+        self.every = every
+        self.last_logged = 0
+
+    def _on_step(self):
+        if self.num_timesteps - self.last_logged < self.every:
+            return True
+        self.last_logged = self.num_timesteps
+        stats = self.training_env.env_method('get_stats')
+        values = []
+        for phase in stats[0]:
+            calls = sum(env_stats[phase]['calls'] for env_stats in stats)
+            if calls == 0:
+                continue
+            total_s = sum(env_stats[phase]['total_s'] for env_stats in stats)
+            blocks = sum(env_stats[phase]['blocks_per_call'] * env_stats[phase]['calls'] for env_stats in stats)
+            values.append(tf.Summary.Value(tag='profile/{}_mean_us'.format(phase),
+                                           simple_value=total_s / calls * 1e6))
+            values.append(tf.Summary.Value(tag='profile/{}_p99_us'.format(phase),
+                                           simple_value=max(env_stats[phase]['p99_us'] for env_stats in stats)))
+            if blocks:
+                # only counted with enable_profiling(allocations=True)
+                values.append(tf.Summary.Value(tag='profile/{}_blocks_per_call'.format(phase),
+                                               simple_value=blocks / calls))
+        self.locals['writer'].add_summary(tf.Summary(value=values), self.num_timesteps)
+        return True
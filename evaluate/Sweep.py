@@ -0,0 +1,255 @@
+######################################################################
+# Sweep over env settings and PPO2 hyperparameters                    #
+# Trials run in a process pool and weak trials are stopped early by   #
+# successive halving; results are cached by config and data hash     #
+######################################################################
+
+import os
+import json
+import math
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from config import get_config
+from envs.MarketData import MarketData
+from evaluate.Lockstep import LockstepEvaluator
+from evaluate.WalkForward import DATA_PATHS, data_hash
+
+# data of the worker processes, sent once when they start
+_data = {}
+
+
+def grid_size(space):
+    return int(np.prod([len(values) for values in space.values()]))
+
+
+def grid_point(space, index):
+    '''the index-th combination of the values in space, counting in mixed radix'''
+    params = {}
+    for name, values in reversed(list(space.items())):
+        index, i = divmod(index, len(values))
+        params[name] = values[i]
+    return {name: params[name] for name in space}
+
+
+def _hash(values):
+    return hashlib.sha256(json.dumps(values, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _init_worker(train_data, valid_data):
+    _data['train'] = train_data
+    _data['valid'] = valid_data
+
+
+def _run_trial(trial, rung, params, timesteps, prev_timesteps, assetType, seed, episodes, cache_dir):
+    '''
+    train a trial to `timesteps`, continuing its model of the previous rung when it is cached,
+    and score it on the validation data; runs in a worker process
+    '''
+    # imported here so that the parent process does not have to load tensorflow
+    from stable_baselines.common.policies import MlpPolicy
+    from stable_baselines.common.vec_env import DummyVecEnv
+    from stable_baselines import PPO2
+    from envs.TradeEnv import TradeEnv
+
+    train_data, valid_data = _data['train'], _data['valid']
+    defaults = vars(get_config(assetType))
+    settings = {name: value for name, value in params.items() if name in defaults}
+    hyperparams = {name: value for name, value in params.items() if name not in defaults}
+    config = get_config(assetType, **settings)
+
+    # a model depends on the training data, the full config, the hyperparameters, the seed
+    # and its timesteps; its score also on the validation data and the episodes
+    def model_key(timesteps):
+        return _hash({'data': data_hash(train_data), 'assetType': assetType, 'config': vars(config),
+                      'hyperparams': hyperparams, 'seed': seed, 'timesteps': timesteps})
+    model_path = os.path.join(cache_dir, 'models', '{}.zip'.format(model_key(timesteps)))
+    result_path = os.path.join(cache_dir, 'results', '{}.json'.format(_hash(
+        {'model': model_key(timesteps), 'valid': data_hash(valid_data), 'episodes': episodes})))
+
+    result = {'trial': trial, 'rung': rung, 'timesteps': timesteps}
+    result.update(params)
+    if os.path.exists(result_path):
+        with open(result_path) as f:
+            result.update(json.load(f))
+        result['cached'] = True
+        return result
+
+    def make_env():
+        env = TradeEnv(train_data, assetType, config=config)
+        env.seed(seed)
+        return env
+    train_env = DummyVecEnv([make_env])
+    prev_path = os.path.join(cache_dir, 'models', '{}.zip'.format(model_key(prev_timesteps)))
+    if os.path.exists(model_path):
+        model = PPO2.load(model_path, env=train_env)
+    else:
+        if prev_timesteps and os.path.exists(prev_path):
+            model = PPO2.load(prev_path, env=train_env)
+            model.learn(total_timesteps=timesteps - prev_timesteps, reset_num_timesteps=False)
+        else:
+            model = PPO2(MlpPolicy, train_env, seed=seed, n_cpu_tf_sess=1, **hyperparams)
+            model.learn(total_timesteps=timesteps)
+        # write then rename, so other runs never load a partial model
+        tmp = '{}.{}.tmp.zip'.format(model_path[:-len('.zip')], os.getpid())
+        model.save(tmp)
+        os.replace(tmp, model_path)
+
+    valid_envs = [TradeEnv(valid_data, assetType, config=config) for _ in range(episodes)]
+    for k, env in enumerate(valid_envs):
+        env.seed(seed * episodes + k)
+    metrics = pd.DataFrame(LockstepEvaluator(model, valid_envs).run()).mean().to_dict()
+    for env in valid_envs:
+        env.close()
+    # trials are ranked by their mean return on the validation data
+    metrics['score'] = metrics['return']
+    tmp = '{}.{}.tmp'.format(result_path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(metrics, f)
+    os.replace(tmp, result_path)
+
+    result.update(metrics)
+    result['cached'] = False
+    return result
+
+
+class Sweep():
+    '''
+    Search over env settings (any attribute of the config in config.py, e.g. lookback_range,
+    tran_cost, max_steps, serial) and PPO2 hyperparameters (any other keyword of PPO2, e.g.
+    learning_rate, n_steps, gamma). space maps every name to the values to try; the trials
+    are the whole grid, or num_trials combinations drawn from it.
+
+    Weak trials are stopped early by successive halving: all trials are trained for
+    min_timesteps, then only the best 1/eta of them by validation return go on to be
+    trained eta times longer, continuing their models, and so on up to max_timesteps.
+    Every rung runs its trials in a pool of worker processes. Models and scores are cached
+    in cache_dir under the hash of the config, hyperparameters, seed, timesteps and data,
+    so a finished trial is never computed again.
+    '''
+    def __init__(self, train_df, valid_df, assetType, space, num_trials=None, min_timesteps=2000,
+                 max_timesteps=16000, eta=2, episodes=4, num_workers=None,
+                 cache_dir='./models/sweep', seed=0, start_method=None):
+        '''
+        input:
+            train_df, valid_df:
+            dataframes or MarketData; the trials train on the first and are scored on the second
+
+            assetType:
+            as for TradeEnv
+
+            space:
+            a dict; the values to try for every setting or hyperparameter
+
+            episodes:
+            an int; validation episodes per trial, run in lockstep
+
+            start_method:
+            a string or None; multiprocessing start method, 'forkserver' where available
+        '''
+        self.train_data = train_df if isinstance(train_df, MarketData) else MarketData.from_df(train_df)
+        self.valid_data = valid_df if isinstance(valid_df, MarketData) else MarketData.from_df(valid_df)
+        self.assetType = assetType
+        self.space = space
+        self.num_trials = min(num_trials or grid_size(space), grid_size(space))
+        self.min_timesteps = min_timesteps
+        self.max_timesteps = max_timesteps
+        self.eta = eta
+        self.episodes = episodes
+        self.num_workers = num_workers or os.cpu_count()
+        self.cache_dir = cache_dir
+        self.seed = seed
+        if start_method is None:
+            forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver_available else 'spawn'
+        self.start_method = start_method
+
+    def trials(self):
+        '''the parameters of every trial'''
+        size = grid_size(self.space)
+        if self.num_trials == size:
+            indices = range(size)
+        else:
+            indices = np.random.RandomState(self.seed).choice(size, self.num_trials, replace=False)
+        return [grid_point(self.space, int(i)) for i in indices]
+
+    def rungs(self):
+        '''training timesteps of every rung of successive halving'''
+        rungs = [self.min_timesteps]
+        while rungs[-1] < self.max_timesteps:
+            rungs.append(min(rungs[-1] * self.eta, self.max_timesteps))
+        return rungs
+
+    def run(self):
+        '''run the sweep; returns a DataFrame with one row per trial and rung it reached'''
+        for directory in ('models', 'results'):
+            os.makedirs(os.path.join(self.cache_dir, directory), exist_ok=True)
+        trials = self.trials()
+        alive = list(range(len(trials)))
+        results = []
+        ctx = multiprocessing.get_context(self.start_method)
+        with ProcessPoolExecutor(min(self.num_workers, len(trials)), mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(self.train_data, self.valid_data)) as pool:
+            prev_timesteps = 0
+            for rung, timesteps in enumerate(self.rungs()):
+                futures = [pool.submit(_run_trial, trial, rung, trials[trial], timesteps, prev_timesteps,
+                                       self.assetType, self.seed, self.episodes, self.cache_dir)
+                           for trial in alive]
+                rung_results = [future.result() for future in futures]
+                results.extend(rung_results)
+                # the best 1/eta of the trials go on to the next rung
+                ranked = sorted(rung_results, key=lambda result: result['score'], reverse=True)
+                alive = [result['trial'] for result in ranked[:max(1, math.ceil(len(ranked) / self.eta))]]
+                prev_timesteps = timesteps
+        return pd.DataFrame(results)
+
+
+def best_trials(report, n=5):
+    '''the n best trials by their score at the last rung they reached'''
+    last = report.sort_values('rung').groupby('trial').tail(1)
+    return last.sort_values(['rung', 'score'], ascending=False).head(n)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--env_name', required=True, type=str, choices=list(DATA_PATHS))
+parser.add_argument('--space', required=True, type=str,
+                    help='JSON object, or file holding one, mapping settings and PPO2 '
+                         'hyperparameters to lists of values, e.g. \'{"lookback_range": [5, 20], '
+                         '"learning_rate": [0.00025, 0.001]}\'')
+parser.add_argument('--num_trials', default=None, type=int,
+                    help='trials drawn from the grid of the space; the whole grid by default')
+parser.add_argument('--min_timesteps', default=2000, type=int)
+parser.add_argument('--max_timesteps', default=16000, type=int)
+parser.add_argument('--eta', default=2, type=int, help='1/eta of the trials go on to every next rung')
+parser.add_argument('--episodes', default=4, type=int, help='validation episodes per trial')
+parser.add_argument('--num_workers', default=None, type=int)
+parser.add_argument('--cache_dir', default='./models/sweep', type=str)
+parser.add_argument('--seed', default=0, type=int)
+parser.add_argument('--report', default=None, type=str, help='write every trial and rung to this CSV')
+
+
+if __name__ == '__main__':
+    from data.DatasetCache import load_dataset
+    args = parser.parse_args()
+    if os.path.exists(args.space):
+        with open(args.space) as f:
+            space = json.load(f)
+    else:
+        space = json.loads(args.space)
+    df = load_dataset(DATA_PATHS[args.env_name])
+    df = df.sort_values(by=[df.columns[0]])
+    training_size = int(0.8*len(df))
+    sweep = Sweep(df.iloc[0:training_size], df.iloc[training_size:], args.env_name, space,
+                  num_trials=args.num_trials, min_timesteps=args.min_timesteps,
+                  max_timesteps=args.max_timesteps, eta=args.eta, episodes=args.episodes,
+                  num_workers=args.num_workers, cache_dir=args.cache_dir, seed=args.seed)
+    report = sweep.run()
+    pd.set_option('display.width', 200)
+    print(best_trials(report).to_string(index=False))
+    if args.report is not None:
+        report.to_csv(args.report, index=False)
@@ -0,0 +1,200 @@
+######################################################################
+# Walk-forward evaluation                                             #
+# The dataset is cut into rolling train/test folds; every fold is     #
+# trained and evaluated in a worker process and the per-fold metrics  #
+# are combined into one report                                        #
+######################################################################
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from config import get_config
+from envs.MarketData import MarketData
+from evaluate.Lockstep import LockstepEvaluator
+
+DATA_PATHS = {'stock': './data/stock/AAPL.csv', 'bitcoin': './data/bitcoin/coinbaseUSD.csv'}
+METRICS = ['return', 'max_drawdown', 'trades']
+
+
+def walk_forward_folds(length, train_size, test_size, step=None):
+    '''
+    (train, test) pairs of row ranges over a dataset of `length` rows: every fold trains on
+    train_size rows and tests on the test_size rows that follow, and the next fold starts
+    step rows later (test_size by default, so the test ranges tile the data)
+    '''
+    step = step or test_size
+    folds = []
+    start = 0
+    while start + train_size + test_size <= length:
+        folds.append((range(start, start + train_size),
+                      range(start + train_size, start + train_size + test_size)))
+        start += step
+    return folds
+
+
+def data_hash(data):
+    '''sha256 of the prices a fold is trained on'''
+    sha = hashlib.sha256()
+    for values in (data.features, data.open_prices, data.close_prices):
+        sha.update(np.ascontiguousarray(values).tobytes())
+    return sha.hexdigest()
+
+
+def _run_fold(fold, train_data, test_data, assetType, timesteps, seed, cache_dir, episodes):
+    '''train (or load from the cache) and evaluate one fold; runs in a worker process'''
+    # imported here so that the parent process does not have to load tensorflow
+    from stable_baselines.common.policies import MlpPolicy
+    from stable_baselines.common.vec_env import DummyVecEnv
+    from stable_baselines import PPO2
+    from envs.TradeEnv import TradeEnv
+
+    # the model depends on the training data, the training run and the env's config
+    key = hashlib.sha256(json.dumps({'data': data_hash(train_data), 'timesteps': timesteps,
+                                     'seed': seed, 'config': vars(get_config(assetType))},
+                                    sort_keys=True).encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, 'ppo2_{}_{}.zip'.format(assetType, key))
+
+    start = time.perf_counter()
+    cached = os.path.exists(path)
+    if cached:
+        model = PPO2.load(path)
+    else:
+        def make_env():
+            env = TradeEnv(train_data, assetType)
+            env.seed(seed)
+            return env
+        model = PPO2(MlpPolicy, DummyVecEnv([make_env]), seed=seed, n_cpu_tf_sess=1)
+        model.learn(total_timesteps=timesteps)
+        # write then rename, so other runs never load a partial model
+        tmp = '{}.{}.tmp.zip'.format(path[:-len('.zip')], os.getpid())
+        model.save(tmp)
+        os.replace(tmp, path)
+    train_seconds = time.perf_counter() - start
+
+    # episodes differ in the prices drawn between open and close
+    test_envs = [TradeEnv(test_data, assetType) for _ in range(episodes)]
+    for k, env in enumerate(test_envs):
+        env.seed(seed * episodes + k)
+    metrics = pd.DataFrame(LockstepEvaluator(model, test_envs).run())
+    for env in test_envs:
+        env.close()
+    result = {'fold': fold, 'model': path, 'cached': cached, 'train_seconds': train_seconds,
+              'episodes': episodes}
+    result.update(metrics.mean().to_dict())
+    return result
+
+
+class WalkForward():
+    '''
+    Walk-forward evaluation of PPO2 on a dataset: the rows are cut into rolling train/test
+    folds (see walk_forward_folds), and every fold is trained and evaluated in a pool of
+    worker processes. Trained models are cached in cache_dir under the hash of the fold's
+    training data, the number of timesteps, the seed and the env config, so repeated runs
+    only train folds that changed. Every fold's model is evaluated on `episodes` episodes
+    of its test data run in lockstep, and the fold's metrics are their means.
+    '''
+    def __init__(self, df, assetType, train_size, test_size, step=None, timesteps=10000,
+                 num_workers=None, cache_dir='./models/walkforward', seed=0, episodes=1,
+                 start_method=None):
+        '''
+        input:
+            df, assetType:
+            as for TradeEnv
+
+            train_size, test_size, step:
+            rows per training and test range, and rows between the starts of two folds
+
+            timesteps:
+            an int; training timesteps per fold
+
+            num_workers:
+            an int or None; worker processes, all cores by default
+
+            start_method:
+            a string or None; multiprocessing start method, 'forkserver' where available
+        '''
+        self.data = df if isinstance(df, MarketData) else MarketData.from_df(df)
+        self.assetType = assetType
+        self.folds = walk_forward_folds(len(self.data), train_size, test_size, step)
+        if not self.folds:
+            raise ValueError('{} rows are too few for a fold of {} training and {} test rows'.format(
+                len(self.data), train_size, test_size))
+        self.timesteps = timesteps
+        self.num_workers = min(num_workers or os.cpu_count(), len(self.folds))
+        self.cache_dir = cache_dir
+        self.seed = seed
+        self.episodes = episodes
+        if start_method is None:
+            forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver_available else 'spawn'
+        self.start_method = start_method
+
+    def run(self):
+        '''train and evaluate every fold; returns a DataFrame with one row of metrics per fold'''
+        os.makedirs(self.cache_dir, exist_ok=True)
+        ctx = multiprocessing.get_context(self.start_method)
+        with ProcessPoolExecutor(self.num_workers, mp_context=ctx) as pool:
+            futures = []
+            for fold, (train, test) in enumerate(self.folds):
+                # every worker only receives the rows of its own fold
+                train_data = self._rows(train)
+                test_data = self._rows(test)
+                futures.append(pool.submit(_run_fold, fold, train_data, test_data, self.assetType,
+                                           self.timesteps, self.seed + fold, self.cache_dir,
+                                           self.episodes))
+            results = [future.result() for future in futures]
+
+        report = pd.DataFrame(results)
+        report.insert(1, 'train_start', [train.start for train, _ in self.folds])
+        report.insert(2, 'test_start', [test.start for _, test in self.folds])
+        report.insert(3, 'test_stop', [test.stop for _, test in self.folds])
+        return report
+
+    def _rows(self, rows):
+        '''a copy of the rows, so that only they are sent to the worker'''
+        data = self.data[rows.start:rows.stop]
+        return MarketData(data.features.copy(), data.open_prices.copy(), data.close_prices.copy(),
+                          data.columns)
+
+
+def summarise(report):
+    '''mean, standard deviation, min and max of the fold metrics'''
+    return report[METRICS].astype(float).agg(['mean', 'std', 'min', 'max'])
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--env_name', required=True, type=str, choices=list(DATA_PATHS))
+parser.add_argument('--train_size', required=True, type=int, help='rows of every training range')
+parser.add_argument('--test_size', required=True, type=int, help='rows of every test range')
+parser.add_argument('--step', default=None, type=int,
+                    help='rows between the starts of two folds; test_size by default')
+parser.add_argument('--timesteps', default=10000, type=int, help='training timesteps per fold')
+parser.add_argument('--num_workers', default=None, type=int)
+parser.add_argument('--cache_dir', default='./models/walkforward', type=str)
+parser.add_argument('--seed', default=0, type=int)
+parser.add_argument('--episodes', default=1, type=int,
+                    help='test episodes per fold, with different price draws, run in lockstep')
+parser.add_argument('--report', default=None, type=str, help='write the per-fold metrics to this CSV')
+
+
+if __name__ == '__main__':
+    from data.DatasetCache import load_dataset
+    args = parser.parse_args()
+    df = load_dataset(DATA_PATHS[args.env_name])
+    df = df.sort_values(by=[df.columns[0]])
+    walk_forward = WalkForward(df, args.env_name, args.train_size, args.test_size, step=args.step,
+                               timesteps=args.timesteps, num_workers=args.num_workers,
+                               cache_dir=args.cache_dir, seed=args.seed, episodes=args.episodes)
+    report = walk_forward.run()
+    pd.set_option('display.width', 200)
+    print(report.drop(columns=['model']).to_string(index=False))
+    print(summarise(report).to_string())
+    if args.report is not None:
+        report.to_csv(args.report, index=False)
@@ -0,0 +1,191 @@
+######################################################################
+# Live/paper trading of a trained model on a stream of bars           #
+# Bars arrive over a websocket, the observation window is updated     #
+# incrementally, and every decision reports its end-to-end latency    #
+######################################################################
+
+import time
+import json
+import asyncio
+import argparse
+import aiohttp
+import numpy as np
+import pandas as pd
+
+from data.DatasetCache import load_dataset
+from data.FeaturePipeline import FeaturePipeline
+from data.ReplayServer import ReplayServer
+from envs.LiveTradeEnv import LiveTradeEnv
+
+DATA_PATHS = {'stock': './data/stock/AAPL.csv', 'bitcoin': './data/bitcoin/coinbaseUSD.csv'}
+# action sent instead of a late decision
+HOLD = np.array([2.5, 0.0])
+LATENCIES = ['feed_ms', 'observe_ms', 'policy_ms', 'order_ms', 'total_ms']
+# statuses of orders the broker filled, in full or for the assets it returns
+FILLED = ('filled', 'partially_filled')
+
+
+class LiveTrader():
+    '''
+    Trades a model on the bars of a websocket feed (see data/ReplayServer.py for the message
+    format). Every bar is appended to the window of a LiveTradeEnv, the model decides on the
+    new observation, and the order it makes is sent to order_url and awaited. The env books
+    the order only once the broker replies {'status': 'filled', 'price': ..., 'assets': ...},
+    at the price filled and for the assets filled (all of the order when missing); other
+    statuses, e.g. 'rejected', leave the book as it was.
+
+    A decision that is not ready within budget_ms of its bar being received is replaced by
+    a hold, so no order goes out on a stale price. Every decision records its latencies:
+    feed (bar sent to received, when the feed stamps sent_at on a shared clock), observe,
+    policy, order (sent to acknowledged) and total (received to acknowledged).
+    '''
+    def __init__(self, env, model, feed_url, order_url=None, budget_ms=50.0, deterministic=True):
+        '''
+        input:
+            env:
+            a LiveTradeEnv, reset by run()
+
+            model:
+            a stable-baselines model, or anything with predict(observation, deterministic)
+
+            feed_url, order_url:
+            strings; websocket URL of the bars and HTTP URL orders are POSTed to, or None to
+            only trade on paper
+
+            budget_ms:
+            a float or None; latency budget of a decision from its bar being received
+        '''
+        self.env = env
+        self.model = model
+        self.feed_url = feed_url
+        self.order_url = order_url
+        self.budget_ms = budget_ms
+        self.deterministic = deterministic
+        self.decisions = []
+
+    async def run(self, max_bars=None):
+        '''trade until the feed ends or after max_bars bars; returns the decisions'''
+        self.env.reset()
+        self.decisions = []
+        async with aiohttp.ClientSession() as session:
+            async with session.ws_connect(self.feed_url) as ws:
+                async for message in ws:
+                    received = time.perf_counter()
+                    received_at = time.time()
+                    if message.type != aiohttp.WSMsgType.TEXT:
+                        break
+                    data = json.loads(message.data)
+                    if data.get('end'):
+                        break
+                    await self._decide(session, data, received, received_at)
+                    if max_bars is not None and len(self.decisions) >= max_bars:
+                        break
+        return self.decisions
+
+    async def _decide(self, session, data, received, received_at):
+        obs = self.env.observe(data['bar'])
+        observed = time.perf_counter()
+        action, _states = self.model.predict(obs, deterministic=self.deterministic)
+        decided = time.perf_counter()
+
+        late = self.budget_ms is not None and (decided - received) * 1000 > self.budget_ms
+        order = self.env.order(HOLD if late else action)
+        status, price = None, None
+        ordered = time.perf_counter()
+        if order is not None and self.order_url is not None:
+            message = {'step': self.env.current_step, 'side': order['side'], 'assets': order['assets'],
+                       'price': self.env.current_price}
+            async with session.post(self.order_url, json=message) as response:
+                response.raise_for_status()
+                reply = await response.json()
+            status = reply.get('status')
+            if status in FILLED:
+                order = dict(order, assets=reply.get('assets', order['assets']))
+                price = reply.get('price')
+            else:
+                order = None
+        elif order is not None:
+            status = 'paper'
+        acknowledged = time.perf_counter()
+        trade, reward = self.env.fill(order, price)
+        done = time.perf_counter()
+
+        self.decisions.append({
+            'step': self.env.current_step,
+            'date': data['bar'][self.env.history.columns[0]],
+            'action_type': float(action[0]),
+            'amount': float(action[1]),
+            'late': late,
+            'status': status,
+            'side': trade['type'] if trade is not None else None,
+            'assets': trade['assets'] if trade is not None else 0.0,
+            'price': self.env.current_price,
+            'net_worth': self.env.net_worth,
+            'reward': reward,
+            'feed_ms': (received_at - data['sent_at']) * 1000 if 'sent_at' in data else np.nan,
+            'observe_ms': (observed - received) * 1000,
+            'policy_ms': (decided - observed) * 1000,
+            'order_ms': (acknowledged - ordered) * 1000,
+            'total_ms': (done - received) * 1000})
+
+
+def latency_summary(decisions):
+    '''mean and percentiles of every latency of the decisions, in milliseconds'''
+    report = pd.DataFrame(decisions)
+    return report[LATENCIES].describe(percentiles=[0.5, 0.9, 0.99]).drop(['count', 'std'])
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--env_name', required=True, type=str, choices=list(DATA_PATHS))
+parser.add_argument('--model', default=None, type=str,
+                    help='saved PPO2 model; ./models/ppo2_<env_name> by default')
+parser.add_argument('--history', default=0.8, type=float,
+                    help='fraction of the dataset used as history before the stream; '
+                         'the local replay plays the rest')
+parser.add_argument('--url', default=None, type=str,
+                    help='websocket URL of a bar feed; a local replay of the dataset by default')
+parser.add_argument('--orders_url', default=None, type=str,
+                    help='URL orders are POSTed to with --url; paper trading only without it')
+parser.add_argument('--speed', default=None, type=float,
+                    help='how many times faster than real time the local replay runs, instead of '
+                         '--interval; e.g. 86400 plays daily bars one a second')
+parser.add_argument('--interval', default=0.1, type=float,
+                    help='seconds between two bars of the local replay, unless --speed is given')
+parser.add_argument('--budget_ms', default=50.0, type=float,
+                    help='latency budget of a decision; late decisions hold instead of trading')
+parser.add_argument('--bars', default=None, type=int, help='stop after this many bars')
+parser.add_argument('--features', action='store_true',
+                    help='the model was trained with --features of testEnv.py')
+parser.add_argument('--report', default=None, type=str, help='write every decision to this CSV')
+
+
+async def main(args, model):
+    df = load_dataset(DATA_PATHS[args.env_name])
+    df = df.sort_values(by=[df.columns[0]])
+    history_size = int(args.history * len(df))
+    pipeline = FeaturePipeline() if args.features else None
+    env = LiveTradeEnv(df.iloc[:history_size], args.env_name, pipeline=pipeline)
+    if args.url is not None:
+        trader = LiveTrader(env, model, args.url, args.orders_url, budget_ms=args.budget_ms)
+        return await trader.run(args.bars)
+    # real time is a day per bar for daily data, so bars are evenly spaced unless --speed is given
+    speed, interval = (args.speed, None) if args.speed is not None else (1.0, args.interval)
+    async with ReplayServer(df.iloc[history_size:], speed=speed, interval=interval) as server:
+        trader = LiveTrader(env, model, server.bars_url, server.orders_url, budget_ms=args.budget_ms)
+        return await trader.run(args.bars)
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # imported here so that the feed and env can be used without tensorflow
+    from stable_baselines import PPO2
+    model = PPO2.load(args.model or './models/ppo2_{}'.format(args.env_name))
+    decisions = asyncio.run(main(args, model))
+    report = pd.DataFrame(decisions)
+    pd.set_option('display.width', 200)
+    print('{} decisions, {} late, {} trades, final net worth {:.2f}'.format(
+        len(report), int(report['late'].sum()), int(report['side'].notna().sum()),
+        report['net_worth'].iloc[-1] if len(report) else float('nan')))
+    print(latency_summary(decisions).to_string())
+    if args.report is not None:
+        report.to_csv(args.report, index=False)
@@ -0,0 +1,203 @@
+######################################################################
+# Headless export of episodes to a video or a sequence of frames      #
+# The env only queues step snapshots; a worker process draws them on  #
+# an offscreen TradeGraph and encodes the frames                      #
+######################################################################
+
+import os
+import queue
+import shutil
+import traceback
+import subprocess
+import multiprocessing
+from envs.TradeLedger import TradeLedger
+
+# containers that need yuv420p frames to play in most players
+YUV_FORMATS = {'.mp4', '.m4v', '.mov', '.mkv'}
+
+
+def ffmpeg_path():
+    '''the ffmpeg binary used by matplotlib's animation writers'''
+    import matplotlib
+    return matplotlib.rcParams['animation.ffmpeg_path']
+
+
+class VideoWriter():
+    '''pipes raw RGBA frames into ffmpeg, which encodes them into path by its extension'''
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.process = None
+
+    def write(self, frame):
+        if self.process is None:
+            height, width = frame.shape[:2]
+            command = [ffmpeg_path(), '-y', '-loglevel', 'error',
+                       '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{}x{}'.format(width, height),
+                       '-r', str(self.fps), '-i', '-',
+                       # most codecs need even dimensions
+                       '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+            if os.path.splitext(self.path)[1].lower() in YUV_FORMATS:
+                command += ['-pix_fmt', 'yuv420p']
+            self.process = subprocess.Popen(command + [self.path], stdin=subprocess.PIPE)
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError('ffmpeg failed to encode {}'.format(self.path))
+
+
+class FrameSequenceWriter():
+    '''saves every frame as <directory>/frame_<number>.png'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, frame):
+        from matplotlib.image import imsave
+        imsave(os.path.join(self.directory, 'frame_{:06d}.png'.format(self.count)), frame)
+        self.count += 1
+
+    def close(self):
+        pass
+
+
+def get_writer(path, fps):
+    '''a VideoWriter for paths with an extension, otherwise a FrameSequenceWriter of a directory'''
+    if os.path.splitext(path)[1]:
+        return VideoWriter(path, fps)
+    return FrameSequenceWriter(path)
+
+
+def _worker(snapshots, results, df, path, title, fps, render_every, window_size):
+    '''
+    draw batches of snapshots on an offscreen TradeGraph and write every frame drawn,
+    until the None sentinel; sends back the number of frames, or the error
+    '''
+    # imported here so that the env process never has to load matplotlib for exporting
+    from render.TradeGraph import TradeGraph
+
+    frames = 0
+    try:
+        graph = TradeGraph(df, title, render_every=render_every, headless=True)
+        writer = get_writer(path, fps)
+        trades = TradeLedger()
+        try:
+            while True:
+                batch = snapshots.get()
+                if batch is None:
+                    break
+                for current_step, net_worth, new_trades, new_episode in batch:
+                    if new_episode:
+                        trades = TradeLedger()
+                    if new_trades is not None:
+                        trades.extend(new_trades)
+                    if graph.render(current_step, net_worth, trades, window_size=window_size):
+                        writer.write(graph.frame())
+                        frames += 1
+        finally:
+            writer.close()
+            graph.close()
+        results.send(('done', frames))
+    except Exception:
+        results.send(('error', traceback.format_exc()))
+
+
+class FrameExporter():
+    '''
+    Renders an episode without a display into a video (path with an extension, encoded by
+    ffmpeg, e.g. 'episode.mp4' or 'episode.gif') or into a directory of PNG frames (path
+    without one).
+
+    submit only copies the step's net worth and the trades added since the last call into
+    a batch; every batch_size steps the batch is put on a bounded queue for a worker
+    process, which draws the frames on an offscreen TradeGraph and encodes them. The env
+    only waits when the worker falls max_queue batches behind.
+    '''
+    def __init__(self, df, path, title=None, fps=30, render_every=1, window_size=40,
+                 batch_size=64, max_queue=16, start_method=None):
+        '''
+        input:
+            df:
+            a pandas dataframe; the market data the steps index into, as for TradeGraph
+
+            path:
+            a string; video file, or directory of PNG frames
+
+            fps, render_every, window_size:
+            frames per second of the video, draw every render_every-th step, steps shown
+
+            start_method:
+            a string or None; multiprocessing start method, 'forkserver' where available
+        '''
+        if os.path.splitext(path)[1] and shutil.which(ffmpeg_path()) is None:
+            raise RuntimeError('ffmpeg is needed to encode {}; install it, set matplotlib\'s '
+                               'animation.ffmpeg_path, or export PNG frames to a directory'.format(path))
+        self.path = path
+        self.batch_size = batch_size
+        self.batch = []
+        self.trades = None
+        self.trades_sent = 0
+        self.closed = False
+
+        if start_method is None:
+            forkserver_available = 'forkserver' in multiprocessing.get_all_start_methods()
+            start_method = 'forkserver' if forkserver_available else 'spawn'
+        ctx = multiprocessing.get_context(start_method)
+        self.snapshots = ctx.Queue(maxsize=max_queue)
+        self.results, work_results = ctx.Pipe(duplex=False)
+        args = (self.snapshots, work_results, df, path, title, fps, render_every, window_size)
+        # daemon=True: if the main process crashes, we should not cause things to hang
+        self.process = ctx.Process(target=_worker, args=args, daemon=True)
+        self.process.start()
+        work_results.close()
+
+    def submit(self, current_step, net_worth, trades):
+        '''queue the state of one step; trades is the env's TradeLedger of the episode'''
+        # a new ledger means a new episode
+        new_episode = trades is not self.trades
+        if new_episode:
+            self.trades = trades
+            self.trades_sent = 0
+        new_trades = trades[self.trades_sent:] if len(trades) > self.trades_sent else None
+        self.batch.append((current_step, net_worth, new_trades, new_episode))
+        self.trades_sent = len(trades)
+        if len(self.batch) >= self.batch_size:
+            self._put(self.batch)
+            self.batch = []
+
+    def _put(self, item):
+        while True:
+            try:
+                self.snapshots.put(item, timeout=1)
+                return
+            except queue.Full:
+                if not self.process.is_alive():
+                    self._result()
+
+    def _result(self):
+        '''number of frames written by the worker; raises its error if it failed'''
+        try:
+            status, value = self.results.recv()
+        except EOFError:
+            raise RuntimeError('frame export worker exited with code {}'.format(self.process.exitcode))
+        if status == 'error':
+            raise RuntimeError('frame export to {} failed:\n{}'.format(self.path, value))
+        return value
+
+    def close(self):
+        '''send the remaining snapshots, wait for every frame to be written; returns their number'''
+        if self.closed:
+            return
+        self.closed = True
+        if self.batch:
+            self._put(self.batch)
+            self.batch = []
+        self._put(None)
+        frames = self._result()
+        self.process.join()
+        return frames
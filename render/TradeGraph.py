@@ -1,11 +1,14 @@
 import numpy as np
 import matplotlib
 import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 from matplotlib import style
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.ticker import FuncFormatter
+from collections import deque
 import datetime as dt
-import time
-from mpl_finance import candlestick_ochl as candlestick
+from data.DatasetCache import parse_timestamps
 
 # config
 style.use('dark_background')
@@ -14,192 +17,357 @@ UP_COLOR = '#27A59A'
 DOWN_COLOR = '#EF534F'
 UP_TEXT_COLOR = '#73D3CC'
 DOWN_TEXT_COLOR = '#DC2C27'
+CANDLE_WIDTH = 0.8
+
+
+def fit_limits(limits, low, high, margin):
+    '''
+    new axis limits around [low, high] with `margin` of the range added on each side, or None
+    if the current limits still hold the data and are no more than twice the padded range
+    '''
+    span = max(high - low, abs(high) * 1e-6, 1e-12)
+    if limits is not None:
+        if limits[0] <= low and high <= limits[1] and limits[1] - limits[0] <= 2 * span * (1 + 2 * margin):
+            return None
+    return (low - span * margin, high + span * margin)
 
 
-def date2num(date):
-    try:
-        timestamp = time.mktime(dt.datetime.strptime(date, '%Y-%m-%d').timetuple())
-        return timestamp
-    except:
-        # 'date' is already a number
-        return date
-
-def num2date(timestamp):
-    try:
-        date = dt.datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
-        return date
-    except:
-        # 'num' is already date 
-        return timestamp
-    
-    
 class TradeGraph():
-    '''A trading visualization using matplotlib made to render OpenAI gym environments'''
-    def __init__(self, df, title=None):
+    '''
+    A trading visualization using matplotlib made to render OpenAI gym environments
+
+    The artists are created once and kept between frames. Each frame only computes the
+    candles and volume bars that entered or left the window, and blits the animated
+    artists over a cached background. The axes limits move in pages, and the background is
+    only redrawn when they change. Text is slow to draw, so trade labels are part of the
+    background: a new trade's label is drawn onto it once, and labels are removed when the
+    axes move on. With render_every=N only every Nth call to render draws a frame.
+
+    With headless=True the figure is drawn on an offscreen Agg canvas instead of a window,
+    so it works without a display; frame() returns the last frame drawn as an RGBA array.
+    '''
+    def __init__(self, df, title=None, render_every=1, headless=False):
         self.df = df
         self.net_worths = np.zeros(len(df))
-
-        # Create a figure on screen and set the title
-        fig = plt.figure()
-        fig.suptitle(title)
+        self.render_every = render_every
+        self.headless = headless
+        self.calls = 0
+
+        # dates parsed once into unix seconds; daily data is labelled by date only
+        self.timestamps = parse_timestamps(self.df[self.df.columns[1]])
+        daily = (self.timestamps % 86400 == 0).all()
+        self.date_format = '%Y-%m-%d' if daily else '%Y-%m-%d %H:%M'
+        self.opens = self.df['Open'].values
+        self.closes = self.df['Close'].values
+        self.highs = self.df['High'].values
+        self.lows = self.df['Low'].values
+        self.volumes = self.df[self.df.columns[self.df.columns.str.contains('Volume')][0]].values
+
+        # Create a figure on screen, or on an offscreen canvas outside pyplot, and set the title
+        if headless:
+            self.fig = Figure()
+            FigureCanvasAgg(self.fig)
+        else:
+            self.fig = plt.figure()
+        self.fig.suptitle(title)
 
         # Create top subplot for net worth axis
-        # first arg is size, second is location 
-        self.net_worth_ax = plt.subplot2grid((6, 1), (0, 0), rowspan=2, colspan=1)
+        # first arg is size, second is location
+        grid = self.fig.add_gridspec(6, 1)
+        self.net_worth_ax = self.fig.add_subplot(grid[0:2, 0])
 
         # Create bottom subplot for shared price/volume axis
-        self.price_ax = plt.subplot2grid((6, 1), (2, 0), 
-        rowspan=8, colspan=1, sharex=self.net_worth_ax)
+        self.price_ax = self.fig.add_subplot(grid[2:6, 0], sharex=self.net_worth_ax)
 
         # Create a new axis for volume which shares its x-axis with price
         self.volume_ax = self.price_ax.twinx()
 
         # Add padding to make graph easier to view
-        plt.subplots_adjust(left=0.11, bottom=0.24, right=0.90, top=0.90, wspace=0.2, hspace=0)
+        self.fig.subplots_adjust(left=0.11, bottom=0.24, right=0.90, top=0.90, wspace=0.2, hspace=0)
 
-        # Show the graph without blocking the rest of the program
-        plt.show(block=False) 
+        self._create_artists()
 
+        # window currently drawn: one entry per candle, oldest first
+        self.candles = deque()
+        self.last_step = None
+        # labels of the trades of the ledger last rendered, by index in it
+        self.trade_labels = {}
+        self.labelled_trades = None
+        self.limits = {}
+        self.min_net_worth = np.inf
+        self.max_net_worth = -np.inf
 
-    def _render_net_worth(self, current_step, net_worth, step_range, dates):
-        # Clear the frame rendered last step
-        self.net_worth_ax.clear()
+        # capture the background whenever the figure is fully drawn, e.g. on resize
+        self.background = None
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+        # Show the graph without blocking the rest of the program
+        if not headless:
+            plt.show(block=False)
 
-        # Plot net worths
-        self.net_worth_ax.plot_date(dates, self.net_worths[step_range], '-', label='Net Worth')
+
+    def _create_artists(self):
+        '''create the animated artists that are updated in place every frame'''
+        self.net_worth_line, = self.net_worth_ax.plot([], [], '-', label='Net Worth', animated=True)
 
         # Show legend, which uses the label we defined for the plot above
-        self.net_worth_ax.legend()
         legend = self.net_worth_ax.legend(loc=2, ncol=2, prop={'size': 8})
         legend.get_frame().set_alpha(0.4)
 
-        last_date = date2num(self.df[self.df.columns[1]].values[current_step])
-        #last_date = date2num(self.df['Date'].values[current_step])
-        last_net_worth = self.net_worths[current_step]
+        self.net_worth_label = self.net_worth_ax.annotate('', (0, 0), xytext=(0, 0),
+                                                          bbox=dict(boxstyle='round',
+                                                          fc='w', ec='k', lw=1),
+                                                          color="black",
+                                                          fontsize="small",
+                                                          animated=True)
+
+        # candlesticks as wick segments and body rectangles
+        self.wicks = LineCollection([], linewidths=1, animated=True)
+        self.bodies = PolyCollection([], animated=True)
+        self.price_ax.add_collection(self.wicks)
+        self.price_ax.add_collection(self.bodies)
+
+        self.price_label = self.price_ax.annotate('', (0, 0), xytext=(0, 0),
+                                                  bbox=dict(boxstyle='round',
+                                                  fc='w', ec='k', lw=1),
+                                                  color="black",
+                                                  fontsize="small",
+                                                  animated=True)
+
+        self.volume_bars = PolyCollection([], alpha=0.4, animated=True)
+        self.volume_ax.add_collection(self.volume_bars)
+        self.volume_ax.yaxis.set_ticks([])
 
-        # Annotate the current net worth on the net worth graph
-        self.net_worth_ax.annotate('{0:.2f}'.format(net_worth), 
-                                   (last_date, last_net_worth),
-                                   xytext=(last_date, last_net_worth),
-                                   bbox=dict(boxstyle='round',
-                                   fc='w', ec='k', lw=1),
-                                   color="black",
-                                   fontsize="small")
+        # Format the date ticks to be more easily read
+        self.price_ax.xaxis.set_major_formatter(FuncFormatter(self._format_date))
+        self.price_ax.xaxis.set_tick_params(labelrotation=45)
+
+        # Hide duplicate net worth date labels
+        plt.setp(self.net_worth_ax.get_xticklabels(), visible=False)
 
-        # Add space above and below min/max net worth
-        self.net_worth_ax.set_ylim(min(self.net_worths[np.nonzero(self.net_worths)]) / 1.25, 
-                                   max(self.net_worths) * 1.25)
-        
 
+    def _format_date(self, x, pos=None):
+        step = int(round(x))
+        if 0 <= step < len(self.timestamps):
+            return dt.datetime.fromtimestamp(self.timestamps[step], dt.timezone.utc).strftime(self.date_format)
+        return ''
+
+
+    def _candle(self, step):
+        '''wick, body, color and volume bar of the candle at step'''
+        x = step
+        half = CANDLE_WIDTH / 2
+        o, c = self.opens[step], self.closes[step]
+        body_low, body_high = min(o, c), max(o, c)
+        color = UP_COLOR if c >= o else DOWN_COLOR
+        wick = [(x, self.lows[step]), (x, self.highs[step])]
+        body = [(x - half, body_low), (x - half, body_high), (x + half, body_high), (x + half, body_low)]
+        # volume bars are colored by price direction, and not drawn for unchanged prices
+        volume = self.volumes[step] if o != c else 0
+        volume_color = UP_COLOR if o < c else DOWN_COLOR
+        bar = [(x - half, 0), (x - half, volume), (x + half, volume), (x + half, 0)]
+        return step, wick, body, color, bar, volume_color
+
+
+    def _update_candles(self, window_start, current_step):
+        '''add the candles that entered the window and drop those that left it'''
+        if self.last_step is None or current_step < self.last_step or self.last_step < window_start:
+            # the window jumped, e.g. at the start of a new session
+            self.candles.clear()
+            first_new = window_start
+        else:
+            first_new = self.last_step + 1
+        for step in range(max(first_new, window_start), current_step + 1):
+            self.candles.append(self._candle(step))
+        while self.candles and self.candles[0][0] < window_start:
+            self.candles.popleft()
+        self.last_step = current_step
+
+        _, wicks, bodies, colors, bars, volume_colors = zip(*self.candles)
+        self.wicks.set_segments(wicks)
+        self.wicks.set_colors(colors)
+        self.bodies.set_verts(bodies)
+        self.bodies.set_facecolors(colors)
+        self.bodies.set_edgecolors(colors)
+        self.volume_bars.set_verts(bars)
+        self.volume_bars.set_facecolors(volume_colors)
+
+
+    def _render_net_worth(self, current_step, net_worth, step_range):
+        self.net_worth_line.set_data(np.arange(step_range.start, step_range.stop),
+                                     self.net_worths[step_range.start:step_range.stop])
 
-    def _render_price(self, current_step, net_worth, dates, step_range):
-        self.price_ax.clear()
+        # Annotate the current net worth on the net worth graph
+        self.net_worth_label.set_text('{0:.2f}'.format(net_worth))
+        self.net_worth_label.xy = (current_step, net_worth)
+        self.net_worth_label.set_position((current_step, net_worth))
 
-        # Format data for OHCL candlestick graph
-        candlesticks = zip(dates,
-                           self.df['Open'].values[step_range], self.df['Close'].values[step_range],
-                           self.df['High'].values[step_range], self.df['Low'].values[step_range])
 
-        # Plot price using candlestick graph from mpl_finance
-        candlestick(self.price_ax, candlesticks, width=1,
-                    colorup=UP_COLOR, colordown=DOWN_COLOR)
-        
-        last_date = date2num(self.df[self.df.columns[1]].values[current_step])
-        last_close = self.df['Close'].values[current_step]
-        last_high = self.df['High'].values[current_step]
+    def _render_price(self, current_step):
+        last_close = self.closes[current_step]
+        last_high = self.highs[current_step]
 
         # Print the current price to the price axis
-        self.price_ax.annotate('{0:.2f}'.format(last_close), 
-                               (last_date, last_close),
-                               xytext=(last_date, last_high),
-                               bbox=dict(boxstyle='round',
-                               fc='w', ec='k', lw=1),
-                               color="black",
-                               fontsize="small")
-
-        # Shift price axis up to give volume chart space
-        ylim = self.price_ax.get_ylim()
-        self.price_ax.set_ylim(ylim[0] - (ylim[1] - ylim[0])
-                               * VOLUME_CHART_HEIGHT, ylim[1])
-
-
-    def _render_volume(self, current_step, net_worth, dates, step_range):
-        self.volume_ax.clear()
-        
-        
-        volume = np.array(self.df[self.df.columns[self.df.columns.str.contains('Volume')][0]].values[step_range])
-
-        #np.array(self.df['Volume'].values[step_range])
-
-        pos = self.df['Open'].values[step_range] - \
-            self.df['Close'].values[step_range] < 0
-        neg = self.df['Open'].values[step_range] - \
-            self.df['Close'].values[step_range] > 0
-
-        # Color volume bars based on price direction on that date
-        self.volume_ax.bar(dates[pos], volume[pos], color=UP_COLOR,
-                           alpha=0.4, width=1, align='center')
-        self.volume_ax.bar(dates[neg], volume[neg], color=DOWN_COLOR,
-                           alpha=0.4, width=1, align='center')
-
-        # Cap volume axis height below price chart and hide ticks
-        self.volume_ax.set_ylim(0, max(volume) / VOLUME_CHART_HEIGHT)
-        self.volume_ax.yaxis.set_ticks([])
+        self.price_label.set_text('{0:.2f}'.format(last_close))
+        self.price_label.xy = (current_step, last_close)
+        self.price_label.set_position((current_step, last_high))
+
+
+    def _render_trades(self, trades, step_range):
+        '''
+        keep one label per trade of step_range; returns the labels added, or None if labels
+        were removed and the background has to be redrawn
+        '''
+        # binary searches of the TradeLedger, see TradeLedger.between
+        indices = trades.index_between(step_range.start, step_range.stop).tolist()
+        if trades is not self.labelled_trades:
+            # a new episode, or a restored state: its indices are other trades
+            self.labelled_trades = trades
+            keep = set()
+        else:
+            keep = set(indices)
+
+        removed = False
+        for index in list(self.trade_labels):
+            if index not in keep:
+                self.trade_labels.pop(index).remove()
+                removed = True
+
+        added = []
+        for index in indices:
+            if index in self.trade_labels:
+                continue
+            trade = trades[index]
+            step = trade['step']
+            if trade['type'] == 'buy':
+                high_low = self.lows[step]
+                color = UP_TEXT_COLOR
+            else:
+                high_low = self.highs[step]
+                color = DOWN_TEXT_COLOR
+
+            total = '{0:.2f}'.format(trade['total'])
+
+            # Print the trade's total next to its candle
+            label = self.price_ax.text(step, high_low, f'${total}', color=color, fontsize=8,
+                                       clip_on=True)
+            self.trade_labels[index] = label
+            added.append(label)
+        return None if removed else added
+
+
+    def _update_limits(self, window_start, current_step, window_size):
+        '''
+        move the axes limits if the window no longer fits in them; returns whether they
+        changed, in which case the background has to be redrawn
+        '''
+        changed = False
+
+        x_limits = self.limits.get('x')
+        if x_limits is None or window_start - 0.5 < x_limits[0] or current_step + 0.5 > x_limits[1]:
+            # leave room for half a window of steps before the axis moves again
+            page = max(window_size // 2, 5)
+            self.limits['x'] = (window_start - 1, current_step + page + 1)
+            self.price_ax.set_xlim(self.limits['x'])
+            changed = True
+
+        # Add space above and below min/max net worth
+        net_worth_limits = fit_limits(self.limits.get('net_worth'), self.min_net_worth / 1.25,
+                                      self.max_net_worth * 1.25, 0.05)
+        if net_worth_limits is not None:
+            self.limits['net_worth'] = net_worth_limits
+            self.net_worth_ax.set_ylim(net_worth_limits)
+            changed = True
+
+        start, stop = max(window_start, 0), current_step + 1
+        price_limits = fit_limits(self.limits.get('price'), self.lows[start:stop].min(),
+                                  self.highs[start:stop].max(), 0.25)
+        if price_limits is not None:
+            self.limits['price'] = price_limits
+            # Shift price axis up to give volume chart space
+            self.price_ax.set_ylim(price_limits[0] - (price_limits[1] - price_limits[0])
+                                   * VOLUME_CHART_HEIGHT, price_limits[1])
+            changed = True
 
+        # Cap volume axis height below price chart
+        volume_limits = fit_limits(self.limits.get('volume'), 0, self.volumes[start:stop].max(), 0.25)
+        if volume_limits is not None:
+            self.limits['volume'] = volume_limits
+            self.volume_ax.set_ylim(0, volume_limits[1] / VOLUME_CHART_HEIGHT)
+            changed = True
 
-    def _render_trades(self, current_step, trades, step_range):
-        for trade in trades:
-            if trade['step'] in step_range:
-                date = date2num(self.df[self.df.columns[1]].values[trade['step']])
-                high = self.df['High'].values[trade['step']]
-                low = self.df['Low'].values[trade['step']]
+        return changed
 
-                if trade['type'] == 'buy':
-                    high_low = low
-                    color = UP_TEXT_COLOR
-                else:
-                    high_low = high
-                    color = DOWN_TEXT_COLOR
 
-                total = '{0:.2f}'.format(trade['total'])
+    def _animated_artists(self):
+        return [self.net_worth_line, self.net_worth_label, self.wicks, self.bodies,
+                self.volume_bars, self.price_label]
 
-                # Print the current price to the price axis
-                self.price_ax.annotate(f'${total}', 
-                                       (date, high_low),
-                                       xytext=(date, high_low),
-                                       color=color,
-                                       fontsize=8,
-                                       arrowprops=(dict(color=color)))
+
+    def _on_draw(self, event):
+        # a full draw leaves the animated artists out: keep it as the background
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+
+    def _draw_animated(self):
+        for artist in self._animated_artists():
+            self.fig.draw_artist(artist)
 
 
     def render(self, current_step, net_worth, trades, window_size=40):
-        '''take all the information from the current timestep and render a live representation'''
+        '''
+        take all the information from the current timestep and render a live representation;
+        returns whether a frame was drawn
+        '''
 
         self.net_worths[current_step] = net_worth
+        # running min (of non-zero values, as zeros are steps never rendered) and max
+        if net_worth != 0:
+            self.min_net_worth = min(self.min_net_worth, net_worth)
+        self.max_net_worth = max(self.max_net_worth, net_worth)
+
+        # only draw every render_every calls
+        self.calls += 1
+        if (self.calls - 1) % self.render_every:
+            return False
 
         window_start = max(current_step - window_size, 0)
         step_range = range(window_start, current_step + 1)
 
-        # Format dates as timestamps, necessary for candlestick graph
-        dates = np.array([date2num(x) for x in self.df[self.df.columns[1]].values[step_range]])
-    
+        self._update_candles(window_start, current_step)
+        self._render_net_worth(current_step, net_worth, step_range)
+        self._render_price(current_step)
+        moved = self._update_limits(window_start, current_step, window_size)
+        # labels are only taken off the background when the axes move: until then they
+        # stay for every trade since the window the page started with
+        page_start = max(int(self.limits['x'][0]) + 1, 0)
+        added = self._render_trades(trades, range(page_start, current_step + 1))
+
+        canvas = self.fig.canvas
+        if moved or added is None or self.background is None:
+            plt.setp(self.price_ax.get_xticklabels(), horizontalalignment='right')
+            # redraws the background and the animated artists through _on_draw
+            canvas.draw()
+        else:
+            canvas.restore_region(self.background)
+            if added:
+                for label in added:
+                    self.fig.draw_artist(label)
+                self.background = canvas.copy_from_bbox(self.fig.bbox)
+            self._draw_animated()
+        canvas.blit(self.fig.bbox)
 
-        self._render_net_worth(current_step, net_worth, step_range, dates)
-        self._render_price(current_step, net_worth, dates, step_range)
-        self._render_volume(current_step, net_worth, dates, step_range)
-        self._render_trades(current_step, trades, step_range)
+        # Necessary to view frames before they are unrendered
+        canvas.flush_events()
+        return True
 
-        # Format the date ticks to be more easily read
-        date_labels = np.array([num2date(x) for x in self.df[self.df.columns[1]].values[step_range]])
-        self.price_ax.set_xticklabels(date_labels, rotation=45, horizontalalignment='right')
 
-        # Hide duplicate net worth date labels
-        plt.setp(self.net_worth_ax.get_xticklabels(), visible=False)
-
-        # Necessary to view frames before they are unrendered
-        plt.pause(0.001)
+    def frame(self):
+        '''the figure as last drawn, an RGBA array of shape (height, width, 4)'''
+        return np.asarray(self.fig.canvas.buffer_rgba())
 
 
     def close(self):
-        plt.close()
-
+        if not self.headless:
+            plt.close(self.fig)
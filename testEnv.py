@@ -1,61 +1,157 @@
-import gym
-import datetime as dt
-import pandas as pd
-
-from stable_baselines.common.policies import MlpPolicy
-from stable_baselines.common.vec_env import DummyVecEnv
-from stable_baselines import PPO2
+######################################################################
+# Command line of training and testing an agent                      #
+# Arguments are checked before tensorflow and stable-baselines are   #
+# imported, and worker processes that re-import this script as their #
+# __main__ load none of them                                         #
+######################################################################
 
+import os
 import argparse
-from config import get_config
-from envs.TradeEnv import TradeEnv
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--env_name', required=True, type=str,
                     choices=['stock', 'FX', 'option','bitcoin'])
+parser.add_argument('--num_envs', default=1, type=int,
+                    help='number of training sessions stepped together by VecTradeEnv')
+parser.add_argument('--num_workers', default=0, type=int,
+                    help='run the training envs in this many worker processes sharing the '
+                         'market data in shared memory; -1 uses all cores')
+parser.add_argument('--memmap', action='store_true',
+                    help='read the market data through memory maps instead of loading it')
+parser.add_argument('--features', action='store_true',
+                    help='append the technical indicators of data/FeaturePipeline.py to the market '
+                         'data; they are computed once and cached with the dataset')
+parser.add_argument('--db', default=None, type=str,
+                    help='SQLite file to record the episodes and trades of single-process envs in')
+parser.add_argument('--render', default=None, type=str, choices=['live', 'headless', 'file', 'none'],
+                    help='render the test episodes in a window, to a video without a display, '
+                         'or as text; live by default, and file for option')
+parser.add_argument('--render_path', default='render.mp4', type=str,
+                    help='video file, or directory of PNG frames, written with --render headless')
+parser.add_argument('--eval_episodes', default=0, type=int,
+                    help='instead of the rendered test run, evaluate this many test episodes '
+                         'in lockstep with one batched predict per step and print their metrics')
+parser.add_argument('--profile', action='store_true',
+                    help='time the phases of the training envs\' steps and log them to tensorboard; '
+                         'needs TradeEnvs, i.e. --num_envs 1 or --num_workers')
+parser.add_argument('--profile_every', default=1000, type=int,
+                    help='timesteps between two logs of the phase timings')
 
 
-
-if __name__ == '__main__':
-    args = parser.parse_args()
+def data_settings(args):
+    '''check the arguments and return the dataset path and title of the graph'''
+    if args.memmap and args.features:
+        parser.error('--features needs the dataset loaded into memory, not --memmap')
+    if args.render is None:
+        args.render = 'file' if args.env_name == 'option' else 'live'
     if args.env_name == 'stock':
-        df = pd.read_csv('./data/stock/AAPL.csv')
+        data_path = './data/stock/AAPL.csv'
         graph_title = 'Apple Stock'
     elif args.env_name == 'bitcoin':
-        df = pd.read_csv('./data/bitcoin/coinbaseUSD.csv')
+        data_path = './data/bitcoin/coinbaseUSD.csv'
         graph_title = 'coinbase'
     elif args.env_name == 'FX':
-        '''TODO'''
-        pass
+        parser.error('the FX env is not implemented yet')
     elif args.env_name == 'option':
-        '''TODO'''
-        pass
+        # index options are priced off the underlying's bars
+        data_path = './data/stock/AAPL.csv'
+        graph_title = 'Apple Options'
+        if args.num_envs > 1 or args.num_workers != 0 or args.profile or args.db is not None:
+            parser.error('option trains a single OptionEnv; --num_envs, --num_workers, --profile '
+                         'and --db are not supported')
+        if args.render not in ('file', 'none'):
+            parser.error('OptionEnv renders with --render file or none')
+
+    return data_path, graph_title
+
+
+def main(args):
+    data_path, graph_title = data_settings(args)
+    # imported here so that --help, argument errors and worker processes stay light
+    import pandas as pd
+    from stable_baselines.common.policies import MlpPolicy
+    from stable_baselines.common.vec_env import DummyVecEnv
+    from stable_baselines import PPO2
+    from data.DatasetCache import load_dataset
+    from data.FeaturePipeline import FeaturePipeline
+    from data.TradeStore import TradeStore, SQLiteBackend
+    from envs.TradeEnv import TradeEnv
+    from envs.OptionEnv import OptionEnv
+    from envs.VecTradeEnv import VecTradeEnv
+    from envs.SharedMemVecEnv import SharedMemVecEnv
+    from envs.MarketData import MemmapMarketData
+    from evaluate.Lockstep import LockstepEvaluator
 
     # spliting train/test env
-    training_size = int(0.8*len(df))
-    train_df = df.iloc[0:training_size]
-    test_df = df.iloc[training_size+1:len(df)]
-    train_df = train_df.sort_values(by=[train_df.columns[0]])
-    test_df = test_df.sort_values(by=[test_df.columns[0]])
+    if args.memmap:
+        # market data memory-mapped from the dataset cache, already in time order
+        data = MemmapMarketData(data_path)
+        training_size = int(0.8*len(data))
+        train_df = data[0:training_size]
+        test_df = data[training_size+1:len(data)]
+    else:
+        df = FeaturePipeline().load(data_path) if args.features else load_dataset(data_path)
+        training_size = int(0.8*len(df))
+        train_df = df.iloc[0:training_size]
+        test_df = df.iloc[training_size+1:len(df)]
+        train_df = train_df.sort_values(by=[train_df.columns[0]])
+        test_df = test_df.sort_values(by=[test_df.columns[0]])
+
+    store, agent_id = None, None
+    if args.db is not None:
+        store = TradeStore(SQLiteBackend(args.db))
+        agent_id = store.register_agent(args.env_name)
 
     # The algorithms require a vectorized environment to run
-    train_env = DummyVecEnv([lambda: TradeEnv(train_df,args.env_name)])
-    test_env = DummyVecEnv([lambda: TradeEnv(test_df,args.env_name)])
+    if args.num_workers != 0:
+        num_workers = None if args.num_workers < 0 else args.num_workers
+        train_env = SharedMemVecEnv(train_df, args.env_name, max(args.num_envs, num_workers or os.cpu_count()),
+                                    num_workers=num_workers)
+    elif args.num_envs > 1:
+        train_env = VecTradeEnv(train_df, args.env_name, args.num_envs)
+    elif args.env_name == 'option':
+        train_env = DummyVecEnv([lambda: OptionEnv(train_df, args.env_name)])
+    else:
+        train_env = DummyVecEnv([lambda: TradeEnv(train_df,args.env_name,store=store,agent_id=agent_id)])
+    if args.env_name == 'option':
+        test_env = DummyVecEnv([lambda: OptionEnv(test_df, args.env_name)])
+    else:
+        test_env = DummyVecEnv([lambda: TradeEnv(test_df,args.env_name,store=store,agent_id=agent_id)])
     # Define a model, doc:  https://stable-baselines.readthedocs.io/en/master/guide/tensorboard.html#logging-more-values
     model = PPO2(MlpPolicy, train_env, verbose=1,tensorboard_log="./tensorboard/")
-    model.learn(total_timesteps=10000)
+    callback = None
+    if args.profile:
+        from evaluate.ProfilingCallback import ProfilingCallback
+        train_env.env_method('enable_profiling')
+        callback = ProfilingCallback(args.profile_every)
+    model.learn(total_timesteps=10000, callback=callback)
     model.save('./models/ppo2_{}'.format(args.env_name))
 
-    # init testing env
-    obs = test_env.reset()
-    
-    # start agent 
-    for _ in range(1000):
-        train_env.render(title=graph_title) 
-        action, _states = model.predict(obs)
-        obs, rewards, done, info = train_env.step(action)
+    if args.eval_episodes > 0:
+        # episodes differ in the prices drawn between open and close
+        make_env = OptionEnv if args.env_name == 'option' else TradeEnv
+        eval_envs = [make_env(test_df, args.env_name) for _ in range(args.eval_episodes)]
+        for k, env in enumerate(eval_envs):
+            env.seed(k)
+        metrics = pd.DataFrame(LockstepEvaluator(model, eval_envs).run())
+        print(metrics.describe())
+    else:
+        # init testing env
+        obs = test_env.reset()
         
-        if done: obs = test_env.reset()
+        # start agent 
+        for _ in range(1000):
+            test_env.render(mode=args.render, title=graph_title, path=args.render_path)
+            action, _states = model.predict(obs)
+            obs, rewards, done, info = test_env.step(action)
+            
+            if done: obs = test_env.reset()
 
+    train_env.close()
     test_env.close()
-    
+    if store is not None:
+        store.close()
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -0,0 +1,22 @@
+import numpy as np
+import pandas as pd
+
+from data.DatasetCache import DatasetCache
+
+
+def test_load_keeps_missing_text_values(tmp_path):
+    path = str(tmp_path / 'prices.csv')
+    length = 25
+    pd.DataFrame({'Date': pd.bdate_range('2000-01-01', periods=length).strftime('%Y-%m-%d'),
+                  'Symbol': ['A', None, 'B', 'C', 'D'] * 5,
+                  'Note': [None] * 10 + ['split'] + [None] * 14,
+                  'Close': np.arange(length, dtype=float)}).to_csv(path, index=False)
+    expected = pd.read_csv(path)
+
+    # chunks of 10 make the first chunk of Note all missing
+    for chunksize in (1000, 10):
+        cache = DatasetCache(path, str(tmp_path / 'cache{}'.format(chunksize)))
+        cache.build(chunksize=chunksize)
+        loaded = cache.load()
+        pd.testing.assert_frame_equal(loaded.astype(object), expected.astype(object))
+        assert len(loaded.dropna()) == len(expected.dropna()) == 1
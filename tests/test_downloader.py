@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+import aiohttp
+import numpy as np
+import pandas as pd
+import pytest
+
+import data.Downloader
+from data.Downloader import Downloader, RateLimiter
+from data.StubServer import StubServer, daily_prices
+
+
+def sync(downloader, server, symbols, start, end):
+    '''sync through server; returns the rows added per symbol'''
+    async def run():
+        async with server:
+            downloader.url = server.url
+            return await downloader.async_sync(symbols, start, end)
+    return asyncio.run(run())
+
+
+def business_days(start, end):
+    return pd.bdate_range(start, end).strftime('%Y-%m-%d').tolist()
+
+
+def requested_days(server):
+    '''business days of all the requests the server got'''
+    return sorted(day for query in server.requests
+                  for day in business_days(pd.Timestamp(int(query['period1']), unit='s'),
+                                           pd.Timestamp(int(query['period2']), unit='s') - pd.Timedelta(days=1)))
+
+
+def test_sync_fetches_symbols_concurrently(tmp_path):
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000, max_connections=8, chunk_days=60)
+    latency = 0.2
+    server = StubServer(latency=latency)
+    symbols = ['AAA', 'BBB', 'CCC']
+    started = time.monotonic()
+    added = sync(downloader, server, symbols, '2019-01-01', '2019-12-31')
+    elapsed = time.monotonic() - started
+
+    days = business_days('2019-01-01', '2019-12-31')
+    assert added == {symbol: len(days) for symbol in symbols}
+    for symbol in symbols:
+        df = pd.read_csv(tmp_path / '{}.csv'.format(symbol))
+        assert df['Date'].tolist() == days
+        expected = daily_prices(symbol, int(pd.Timestamp('2019-01-01').timestamp()),
+                                int(pd.Timestamp('2019-12-31').timestamp()))[::-1]
+        np.testing.assert_allclose(df['Close'], [price['close'] for price in expected])
+    # 21 requests, 8 at a time
+    assert len(server.requests) == 21
+    assert elapsed < 6 * latency
+
+
+def test_failed_requests_back_off_exponentially(tmp_path, monkeypatch):
+    sleeps = []
+    sleep = asyncio.sleep
+
+    async def recording_sleep(delay, *args, **kwargs):
+        if delay > 0:
+            sleeps.append(delay)
+        await sleep(0)
+
+    monkeypatch.setattr(asyncio, 'sleep', recording_sleep)
+    monkeypatch.setattr(data.Downloader.random, 'random', lambda: 0.0)
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000, max_retries=3, backoff=0.01)
+    with pytest.raises(aiohttp.ClientResponseError) as error:
+        sync(downloader, StubServer(fail_rate=1.0), ['AAA'], '2019-01-01', '2019-01-31')
+    assert error.value.status == 503
+    assert sleeps == pytest.approx([0.01, 0.02, 0.04])
+
+
+def test_temporary_failures_are_retried(tmp_path):
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000, backoff=0.001, max_retries=20,
+                            chunk_days=30)
+    server = StubServer(fail_rate=0.5, seed=1)
+    added = sync(downloader, server, ['AAA'], '2019-01-01', '2019-06-30')
+    assert added['AAA'] == len(business_days('2019-01-01', '2019-06-30'))
+    # every chunk is requested until it succeeds
+    assert len(server.requests) > len(list(downloader.chunks([(pd.Timestamp('2019-01-01').date(),
+                                                               pd.Timestamp('2019-06-30').date())])))
+
+
+def test_rate_limited_requests_wait_for_retry_after(tmp_path):
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000, backoff=0.001, chunk_days=60)
+    # two requests of one symbol, the second answered 429 with Retry-After: 1
+    server = StubServer(rate_limit=1)
+    started = time.monotonic()
+    added = sync(downloader, server, ['AAA'], '2019-01-01', '2019-03-31')
+    assert time.monotonic() - started >= 1.0
+    assert added['AAA'] == len(business_days('2019-01-01', '2019-03-31'))
+    assert len(server.requests) == 3
+
+
+def test_rate_limiter_spaces_requests():
+    rate, per = 10, 0.25
+
+    async def acquire_times(count):
+        limiter = RateLimiter(rate, per)
+        times = []
+        for _ in range(count):
+            await limiter.acquire()
+            times.append(time.monotonic())
+        return np.array(times)
+
+    times = asyncio.run(acquire_times(2 * rate))
+    # a burst of `rate` requests, then one every per / rate seconds
+    assert times[rate - 1] - times[0] < per / rate
+    after_burst = times[rate - 1:] - times[0]
+    assert (after_burst >= np.arange(rate + 1) * per / rate - 0.005).all()
+    assert times[-1] - times[0] == pytest.approx(per, abs=0.1)
+
+
+def test_resync_requests_only_missing_days(tmp_path):
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000)
+    sync(downloader, StubServer(), ['AAA'], '2019-01-01', '2019-06-30')
+
+    server = StubServer()
+    added = sync(downloader, server, ['AAA'], '2018-07-02', '2019-12-31')
+    assert added['AAA'] == len(business_days('2018-07-02', '2018-12-31')) + \
+        len(business_days('2019-07-01', '2019-12-31'))
+    assert requested_days(server) == business_days('2018-07-02', '2018-12-31') + \
+        business_days('2019-07-01', '2019-12-31')
+    assert pd.read_csv(tmp_path / 'AAA.csv')['Date'].tolist() == business_days('2018-07-02', '2019-12-31')
+
+    server = StubServer()
+    assert sync(downloader, server, ['AAA'], '2018-07-02', '2019-12-31') == {'AAA': 0}
+    assert server.requests == []
+
+
+def test_resync_fills_gaps_between_stored_days(tmp_path):
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000)
+    sync(downloader, StubServer(), ['AAA'], '2000-01-01', '2005-12-31')
+    sync(downloader, StubServer(), ['AAA'], '2010-01-01', '2015-12-31')
+
+    server = StubServer()
+    added = sync(downloader, server, ['AAA'], '2000-01-01', '2015-12-31')
+    assert added['AAA'] == len(business_days('2006-01-01', '2009-12-31'))
+    assert requested_days(server) == business_days('2006-01-01', '2009-12-31')
+    assert pd.read_csv(tmp_path / 'AAA.csv')['Date'].tolist() == business_days('2000-01-01', '2015-12-31')
+
+
+def test_short_gaps_are_taken_as_holidays(tmp_path):
+    downloader = Downloader(out_dir=str(tmp_path), rate_limit=1000, min_gap=3)
+    sync(downloader, StubServer(), ['AAA'], '2019-01-01', '2019-12-31')
+    path = tmp_path / 'AAA.csv'
+    df = pd.read_csv(path)
+    # a two day holiday, and a week missing
+    holiday, week = ['2019-07-04', '2019-07-05'], business_days('2019-09-02', '2019-09-06')
+    df[~df['Date'].isin(holiday + week)].to_csv(path, index=False)
+
+    server = StubServer()
+    assert sync(downloader, server, ['AAA'], '2019-01-01', '2019-12-31') == {'AAA': len(week)}
+    assert requested_days(server) == week
@@ -0,0 +1,14 @@
+import numpy as np
+
+from data.FeaturePipeline import FeaturePipeline
+from tests.test_trade_env import random_walk
+
+
+def test_warmed_stream_matches_transform():
+    df = random_walk(300)
+    pipeline = FeaturePipeline()
+    batch = pipeline.transform(df)[pipeline.names].values
+    for start in (0, 1, 10, 100):
+        stream = pipeline.stream(df.iloc[:start])
+        values = np.array([stream.update(bar) for _, bar in df.iloc[start:].iterrows()])
+        np.testing.assert_allclose(values, batch[start:], rtol=1e-9, atol=1e-9)
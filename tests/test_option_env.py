@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import get_config
+from envs.OptionEnv import OptionEnv
+
+
+def crashing_underlying(length=400):
+    '''an underlying that falls to a few % of its median, below the lowest strikes of the chain'''
+    close = np.concatenate([np.full(length // 2, 100.0), np.full(length - length // 2, 3.0)])
+    dates = pd.bdate_range('2000-01-01', periods=length).strftime('%Y-%m-%d')
+    return pd.DataFrame({'Date': dates, 'Open': close, 'High': close * 1.01, 'Low': close * 0.99,
+                         'Close': close, 'Adj Close': close, 'Volume': np.full(length, 1000)})
+
+
+def test_rebalancing_at_low_spot_conserves_value():
+    config = get_config('option', tran_cost=0.0, serial=True)
+    env = OptionEnv(crashing_underlying(), 'option', config=config)
+    env.reset()
+    rebalance = env._take_action
+    unlisted = []
+
+    def checked(action):
+        before = env.net_worth
+        unlisted.append(not env.chain['listed'].all())
+        rebalance(action)
+        after = env.balance + float(env.book['quantity'] * config.contract_size @ env.book['mark'])
+        assert after == pytest.approx(before, rel=1e-9, abs=1e-6)
+        assert len(np.unique(env.book['key'])) == len(env.book['key'])
+
+    env._take_action = checked
+    for step in range(env.steps_left):
+        # hold cash until the crash, then buy everything and sell everything in turn
+        buy = env.current_price < 10 and step % 2 == 0
+        env.step(np.ones(env.num_contracts) if buy else np.zeros(env.num_contracts))
+    assert any(unlisted)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from config import get_config
+from envs.PortfolioEnv import PortfolioEnv
+from tests.test_trade_env import random_walk
+
+TRAN_COST = 0.01
+
+
+def portfolio(num_assets=3):
+    '''random walks whose open and close agree, so every trade is at the close'''
+    dfs = {}
+    for i in range(num_assets):
+        df = random_walk(100, seed=i)
+        df[['Open', 'High', 'Low', 'Close', 'Adj Close']] *= i + 1
+        dfs['asset{}'.format(i)] = df
+    return dfs
+
+
+def make_env(tran_cost=TRAN_COST):
+    env = PortfolioEnv(portfolio(), 'stock', config=get_config('stock', tran_cost=tran_cost, serial=True))
+    env.seed(0)
+    return env
+
+
+def test_observation_shape():
+    env = make_env()
+    obs = env.reset()
+    config = env.config
+    assert obs.shape == (3, 6 + config.num_portfolio_status, config.lookback_range + 1)
+    assert obs.shape == env.observation_space.shape
+    obs, _, _, _ = env.step(np.array([0.2, 0.3, 0.1]))
+    assert obs.shape == env.observation_space.shape
+
+
+def test_weights_above_one_are_scaled_down():
+    env = make_env()
+    env.reset()
+    net_worth = env.net_worth
+    env.step(np.array([0.5, 0.5, 1.0]))
+    price = env.current_price
+    weights = np.array([0.25, 0.25, 0.5])
+    np.testing.assert_array_equal(env.assets_held, np.trunc(weights * net_worth / (price * (1 + TRAN_COST))))
+    assert env.balance >= 0
+
+
+def test_buys_are_capped_by_cash():
+    tran_cost = 0.05
+    env = make_env(tran_cost)
+    env.reset()
+    env.step(np.array([1.0, 0.0, 0.0]))
+    # the cost of selling asset0 leaves too little cash to buy the whole target of asset1
+    net_worth = env.balance + float(env.assets_held @ env.close_prices[env.frame_start + env.current_step])
+    env.step(np.array([0.0, 1.0, 0.0]))
+    price = env.current_price
+    target = np.trunc(net_worth / (price[1] * (1 + tran_cost)))
+    assert env.assets_held[0] == 0
+    assert 0 < env.assets_held[1] < target
+    assert 0 <= env.balance < price[1] * (1 + tran_cost)
+
+
+def test_cost_basis_and_sales_after_a_sell_and_a_buy():
+    env = make_env()
+    env.reset()
+    env.step(np.array([0.0, 0.0, 0.9]))
+    bought_at = env.current_price[2]
+    held = env.assets_held[2]
+    assert env.avg_cost[2] == pytest.approx(bought_at * (1 + TRAN_COST))
+
+    env.step(np.array([0.0, 0.0, 0.0]))
+    sold_at = env.current_price[2]
+    assert env.assets_held[2] == 0
+    assert env.avg_cost[2] == 0
+    assert env.total_sales_value[2] == pytest.approx(held * sold_at * (1 - TRAN_COST))
+    assert env.total_assets_sold[2] == held
+
+    env.step(np.array([0.0, 0.0, 0.5]))
+    assert env.assets_held[2] > 0
+    assert env.avg_cost[2] == pytest.approx(env.current_price[2] * (1 + TRAN_COST))
+    assert env.total_sales_value[2] == pytest.approx(held * sold_at * (1 - TRAN_COST))
+    # a sell then a buy of the same instrument in the ledger
+    assert [trade['type'] for trade in env.trades] == ['buy', 'sell', 'buy']
+    assert {trade['asset'] for trade in env.trades} == {2}
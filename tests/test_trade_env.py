@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from envs.TradeEnv import TradeEnv
+
+
+def random_walk(length=600, seed=0):
+    rng = np.random.RandomState(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.01, length)))
+    dates = pd.bdate_range('2000-01-01', periods=length).strftime('%Y-%m-%d')
+    return pd.DataFrame({'Date': dates, 'Open': close, 'High': close * 1.01, 'Low': close * 0.99,
+                         'Close': close, 'Adj Close': close, 'Volume': np.full(length, 1000)})
+
+
+def trade_some(env, actions):
+    for action in actions:
+        env.step(np.array(action))
+
+
+def test_set_state_restores_snapshots_out_of_order():
+    env = TradeEnv(random_walk(), 'stock')
+    env.seed(0)
+    env.reset()
+    trade_some(env, [[0.5, 0.5], [1.5, 0.5]] * 5)
+    first = env.get_state()
+
+    # buys then sells after the first snapshot
+    trade_some(env, [[0.5, 0.5], [1.5, 0.5]] * 5)
+    second = env.get_state()
+    second_trades = list(env.trades)
+    second_net_worth = env.net_worth
+
+    # a branch from the first snapshot that only buys, over the rows the second recorded
+    env.set_state(first)
+    trade_some(env, [[0.5, 0.1]] * 10)
+    branch_trades = list(env.trades)
+
+    env.set_state(second)
+    assert list(env.trades) == second_trades
+    assert env.net_worth == second_net_worth
+    env.set_state(first)
+    trade_some(env, [[0.5, 0.1]] * 10)
+    assert list(env.trades) == branch_trades
@@ -0,0 +1,28 @@
+from envs.TradeLedger import TradeLedger
+from render.TradeGraph import TradeGraph
+from tests.test_trade_env import random_walk
+
+
+def label_texts(graph):
+    return sorted(label.get_text() for label in graph.trade_labels.values())
+
+
+def test_labels_follow_the_trades_of_the_ledger():
+    graph = TradeGraph(random_walk(200).reset_index(), headless=True)
+    trades = TradeLedger()
+    for step in range(60, 70):
+        if step == 65:
+            # two buys at the same step
+            trades.append(step, 'buy', 1.0, 1.0)
+            trades.append(step, 'buy', 1.0, 2.0)
+        graph.render(step, 10000.0, trades, window_size=20)
+    assert label_texts(graph) == ['$1.00', '$2.00']
+
+    # a session restarts, with another trade at the same step and side
+    restarted = TradeLedger()
+    for step in range(60, 70):
+        if step == 65:
+            restarted.append(step, 'buy', 1.0, 3.0)
+        graph.render(step, 10000.0, restarted, window_size=20)
+    assert label_texts(graph) == ['$3.00']
+    graph.close()
@@ -0,0 +1,74 @@
+import numpy as np
+
+from envs.TradeLedger import TradeLedger
+
+
+def brute_force_between(trades, start, stop):
+    return [trade for trade in trades if start <= trade['step'] < stop]
+
+
+def test_between_after_steps_go_back():
+    trades = TradeLedger(capacity=4)
+    rng = np.random.RandomState(0)
+    # two sessions of one episode, the second starting before the end of the first
+    for session_start in (50, 10):
+        for step in range(session_start, session_start + 40):
+            trades.append(step, 'buy' if rng.rand() < 0.5 else 'sell', 1.0, float(step))
+    assert not trades.in_order
+    for start, stop in [(20, 30), (0, 100), (45, 60), (89, 95)]:
+        assert list(trades.between(start, stop)) == brute_force_between(trades, start, stop)
+
+
+def test_between_in_order_uses_views():
+    trades = TradeLedger()
+    for step in range(100):
+        trades.append(step, 'buy', 1.0, 1.0)
+    extra = TradeLedger.from_arrays([100, 101], [1, 1], [1.0, 1.0], [2.0, 2.0])
+    trades.extend(extra)
+    assert trades.in_order
+    window = trades.between(20, 30)
+    assert window.steps.tolist() == list(range(20, 30))
+    assert np.shares_memory(window.steps, trades.steps)
+
+    trades.extend(TradeLedger.from_arrays([5], [0], [1.0], [1.0]))
+    assert not trades.in_order
+    assert trades.between(0, 10).steps.tolist() == [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 5]
+
+
+def test_between_bisects_after_a_restart(monkeypatch):
+    trades = TradeLedger()
+    # serial sessions restart from the first step
+    for session in range(3):
+        for step in range(1000):
+            trades.append(step, 'buy', 1.0, float(session))
+    assert not trades.in_order
+
+    searched, sorts = [], []
+    searchsorted, argsort = np.searchsorted, np.argsort
+
+    def counting_searchsorted(a, v, *args, **kwargs):
+        searched.append(len(a))
+        return searchsorted(a, v, *args, **kwargs)
+
+    def counting_argsort(a, *args, **kwargs):
+        sorts.append(len(a))
+        return argsort(a, *args, **kwargs)
+
+    monkeypatch.setattr(np, 'searchsorted', counting_searchsorted)
+    monkeypatch.setattr(np, 'argsort', counting_argsort)
+    for start in (500, 600):
+        window = trades.between(start, start + 10)
+        assert window.steps.tolist() == list(range(start, start + 10)) * 3
+        assert window.column('total').tolist() == [0.0] * 10 + [1.0] * 10 + [2.0] * 10
+    # bisections in the last run and in the sorted earlier runs, sorted once
+    assert searched == [1000, 1000, 2000, 2000] * 2
+    assert sorts == [2000]
+
+    trades.append(2000, 'sell', 1.0, 3.0)
+    window = trades.between(1500, 2500)
+    assert window.steps.tolist() == [2000]
+    assert np.shares_memory(window.steps, trades.steps)
+    # a new session sorts the runs before it again
+    trades.append(0, 'buy', 1.0, 4.0)
+    assert trades.between(0, 1).column('total').tolist() == [0.0, 1.0, 2.0, 4.0]
+    assert sorts == [2000, 3001]
@@ -0,0 +1,94 @@
+import sqlite3
+
+import numpy as np
+
+from data.TradeStore import TradeStore, SQLiteBackend
+from envs.TradeEnv import TradeEnv
+from tests.test_trade_env import random_walk
+
+
+def read_rows(path, query):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute(query).fetchall()
+    finally:
+        db.close()
+
+
+def trade(step, side='buy'):
+    return {'step': step, 'type': side, 'assets': 1.0, 'total': float(step)}
+
+
+def test_records_episodes_and_trades(tmp_path):
+    path = str(tmp_path / 'trades.db')
+    store = TradeStore(SQLiteBackend(path), flush_interval=0.05)
+    agent_id = store.register_agent('stock')
+    episode_id = store.new_episode_id()
+    for step in range(10):
+        store.record_trade(episode_id, trade(step, 'buy' if step % 2 else 'sell'))
+    store.record_episode(episode_id, agent_id, 'stock', 10, 5, 10000, 10100.5, 3.0, 10)
+    store.flush()
+    assert read_rows(path, 'SELECT COUNT(*) FROM Trades') == [(10,)]
+    store.close()
+
+    assert read_rows(path, 'SELECT AgentId, AssetType FROM Agents') == [(agent_id, 0)]
+    assert read_rows(path, 'SELECT EpisodeId, AgentId, Steps, FrameStart, InitialBalance, '
+                           'FinalNetWorth, TotalReward, NumTrades FROM Episodes') == \
+        [(episode_id, agent_id, 10, 5, 10000.0, 10100.5, 3.0, 10)]
+    assert read_rows(path, 'SELECT EpisodeId, Step, TradeType, Assets, Total FROM Trades ORDER BY Step') == \
+        [(episode_id, step, 'buy' if step % 2 else 'sell', 1.0, float(step)) for step in range(10)]
+    assert store.failed == 0 and store.dropped == 0 and store.error is None
+
+
+def test_rows_are_written_in_batches(tmp_path):
+    store = TradeStore(SQLiteBackend(str(tmp_path / 'trades.db')), batch_size=100,
+                       flush_interval=0.05)
+    batches = []
+    write = store._write
+
+    def recording_write(rows):
+        batches.append(len(rows))
+        write(rows)
+
+    store._write = recording_write
+    # rows queue up while the writer waits for the only connection
+    connection = store.pool.get()
+    episode_id = store.new_episode_id()
+    for step in range(250):
+        store.record_trade(episode_id, trade(step))
+    store.pool.put(connection)
+    store.close()
+
+    assert sum(batches) == 250
+    assert max(batches) == 100
+    assert len(batches) <= 4
+
+
+def test_failed_writes_are_counted(tmp_path):
+    path = str(tmp_path / 'trades.db')
+    store = TradeStore(SQLiteBackend(path), flush_interval=0.05)
+    episode_id = store.new_episode_id()
+    # trades of an invalid type, in one or two batches
+    store.record_trade(episode_id, trade(0, 'hold'))
+    store.record_trade(episode_id, trade(1, 'hold'))
+    store.flush()
+    assert store.failed == 2
+    assert isinstance(store.error, sqlite3.IntegrityError)
+
+    # later batches are still written
+    store.record_trade(episode_id, trade(2))
+    store.close()
+    assert read_rows(path, 'SELECT Step FROM Trades') == [(2,)]
+    assert store.failed == 2
+
+
+def test_fx_episodes_are_recorded(tmp_path):
+    path = str(tmp_path / 'trades.db')
+    store = TradeStore(SQLiteBackend(path), flush_interval=0.05)
+    env = TradeEnv(random_walk(), 'FX', store=store)
+    env.reset()
+    for _ in range(20):
+        env.step(np.array([0.5, 0.5]))
+    env.reset()
+    store.close()
+    assert read_rows(path, 'SELECT Steps, TotalReward FROM Episodes') == [(20, 0.0)]